@@ -1,7 +1,13 @@
 import platform
 
-available_audio_devices = []
-default_audio_device = None
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst
 
 available_encoders = []
 if platform.system() == 'Linux':
@@ -12,13 +18,6 @@ if platform.system() == 'Linux':
         'speex',
         'vorbis'
     ]
-    from pulsectl import Pulse
-    with Pulse('ScreenRecorder') as pulse:
-        for source in pulse.source_list():
-            available_audio_devices.append(
-                (source.description, source.name)
-            )
-        default_audio_device = pulse.server_info().default_source_name
 elif platform.system() == 'Darwin':
     available_encoders = [
         'opus',
@@ -28,4 +27,55 @@ elif platform.system() == 'Windows':
     available_encoders = [
         'opus',
         'speex'
-    ]
\ No newline at end of file
+    ]
+
+# filled on first use, recorder processes get their device from the parent
+# and never talk to the sound server for this
+audio_device_cache = None
+
+
+def audio_devices():
+    # returns ([(description, name), ...], default device name)
+    global audio_device_cache
+    if audio_device_cache is not None:
+        return audio_device_cache
+
+    devices = []
+    default = None
+    if platform.system() == 'Linux':
+        from pulsectl import Pulse, PulseError
+        try:
+            with Pulse('ScreenRecorder') as pulse:
+                for source in pulse.source_list():
+                    devices.append(
+                        (source.description, source.name)
+                    )
+                default = pulse.server_info().default_source_name
+        except PulseError as e:
+            # no sound server, e.g. on a headless box
+            print('Could not query PulseAudio devices: {}'.format(e))
+    audio_device_cache = (devices, default)
+    return audio_device_cache
+
+def get_audio_encoder(codec, bitrate):
+    encoder = None
+    if codec == 'aac':
+        encoder = Gst.ElementFactory.make('faac')
+        encoder.set_property('bitrate', bitrate * 1000)
+    elif codec == 'mp3':
+        encoder = Gst.ElementFactory.make('lamemp3enc')
+        encoder.set_property('bitrate', bitrate)
+        encoder.set_property('cbr', True)
+    elif codec == 'opus':
+        encoder = Gst.ElementFactory.make('opusenc')
+        encoder.set_property('bitrate', bitrate * 1000)
+        encoder.set_property('bitrate-type', 0)  # cbr
+    elif codec == 'speex':
+        encoder = Gst.ElementFactory.make('speexenc')
+        encoder.set_property('bitrate', bitrate * 1000)
+        encoder.set_property('abr', True)
+    elif codec == 'vorbis':
+        encoder = Gst.ElementFactory.make('vorbisenc')
+        encoder.set_property('bitrate', bitrate * 1000)
+        encoder.set_property('managed', True)
+    return encoder
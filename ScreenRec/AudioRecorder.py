@@ -12,14 +12,39 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GObject
 
 from ScreenRec.IPC import IPCWatcher
-from ScreenRec.AudioEncoder import available_encoders, available_audio_devices, default_audio_device
+from ScreenRec.Telemetry import PipelineStats
+from ScreenRec.Latency import StartLatencyProbe
+from ScreenRec.AudioEncoder import available_encoders, audio_devices, get_audio_encoder
+from ScreenRec.Transport import make_shm_sink, shm_audio_caps, shm_audio_size
+
+def make_audio_source(device, test_source=False):
+    src = None
+
+    if test_source:
+        # synthetic tone, for benchmarks
+        src = Gst.ElementFactory.make('audiotestsrc', 'audio_source')
+        src.set_property('is-live', True)
+    elif platform.system() == 'Linux':
+        src = Gst.ElementFactory.make('pulsesrc', 'audio_source')
+        src.set_property('device', device)
+        src.set_property('client-name', 'ScreenRecorder')
+    elif platform.system() == 'Darwin':
+        src = Gst.ElementFactory.make('avfaudiosrc', 'audio_source')
+        # TODO: settings?
+    elif platform.system() == 'Windows':
+        src = None
+        # TODO: Windows
+
+    src.set_property('do-timestamp', True)
+
+    return src
+
 
 class AudioRecorder:
 
     ENCODERS = available_encoders
-    DEVICES = available_audio_devices
 
-    def __init__(self, mainloop=None, device=None, encoder=None, samplerate=44100, channels=2, bitrate=128, port=None, **kwargs):
+    def __init__(self, mainloop=None, device=None, encoder=None, samplerate=44100, channels=2, bitrate=128, port=None, socket_path=None, test_source=False, **kwargs):
         self.mainloop = mainloop
         self.id = 'audio_recorder'
 
@@ -39,24 +64,14 @@ class AudioRecorder:
         self.channels = channels
         self.bitrate = bitrate
         self.port = port
+        self.socket_path = socket_path
+        self.test_source = test_source
+        self.stats = None
         self.build_gst_pipeline(encoder)
 
     def build_gst_pipeline(self, encoding_method):
-        # display src
-        src = None
-
-        if platform.system() == 'Linux':
-            src = Gst.ElementFactory.make('pulsesrc', 'source')
-            src.set_property('device', self.device)
-            src.set_property('client-name', 'ScreenRecorder')
-        elif platform.system() == 'Darwin':
-            src = Gst.ElementFactory.make('avfaudiosrc', 'source')
-            # TODO: settings?
-        elif platform.system() == 'Windows':
-            src = None
-            # TODO: Windows
-
-        src.set_property('do-timestamp', True)
+        # audio src
+        src = make_audio_source(self.device, test_source=self.test_source)
 
         # assemble pipeline
         self.pipeline = Gst.Pipeline.new('playback')
@@ -67,7 +82,9 @@ class AudioRecorder:
         print('Using {} encoder, device: {}'.format(encoding_method, self.device))
 
         # output part of pipeline
-        if self.port:
+        if self.socket_path:
+            cap_string = shm_audio_caps
+        elif self.port:
             cap_string = 'audio/x-raw,format=S16BE,rate=44100,channels=2'
         else:
             cap_string = 'audio/x-raw,format=S16LE,rate={},channels={}'.format(
@@ -79,34 +96,17 @@ class AudioRecorder:
         self.pipeline.add(filter)
         src.link(filter)
 
-        # TODO: Export to AudioEncoder.py
         encoder = None
-        if not self.port:
-            # build encoding pipelines
-            if encoding_method == 'aac':
-                encoder = Gst.ElementFactory.make('faac')
-                encoder.set_property('bitrate', self.bitrate * 1000)
-            elif encoding_method == 'mp3':
-                encoder = Gst.ElementFactory.make('lamemp3enc')
-                encoder.set_property('bitrate', self.bitrate)
-                encoder.set_property('cbr', True)
-            elif encoding_method == 'opus':
-                encoder = Gst.ElementFactory.make('opusenc')
-                encoder.set_property('bitrate', self.bitrate * 1000)
-                encoder.set_property('bitrate-type', 0)  # cbr
-            elif encoding_method == 'speex':
-                encoder = Gst.ElementFactory.make('speexenc')
-                encoder.set_property('bitrate', self.bitrate * 1000)
-                encoder.set_property('abr', True)
-            elif encoding_method == 'vorbis':
-                encoder = Gst.ElementFactory.make('vorbisenc')
-                encoder.set_property('bitrate', self.bitrate * 1000)
-                encoder.set_property('managed', True)
-
+        if not self.port and not self.socket_path:
+            encoder = get_audio_encoder(encoding_method, self.bitrate)
             self.pipeline.add(encoder)
             filter.link(encoder)
 
-        if self.port:
+        if self.socket_path:
+            self.sink = make_shm_sink(self.socket_path, shm_audio_size)
+            self.pipeline.add(self.sink)
+            filter.link(self.sink)
+        elif self.port:
             payloader = 'rtpL16pay'
             rtp_payload = Gst.ElementFactory.make(payloader)
             self.pipeline.add(rtp_payload)
@@ -141,6 +141,9 @@ class AudioRecorder:
 
         # on message print errors
         self.bus.connect('message', self.on_message)
+        if getattr(self, 'comm', None):
+            # the supervisor waits for our state changes
+            self.comm.watch_pipeline(self.bus, self.pipeline)
 
     def on_message(self, bus, message):
         t = message.type
@@ -153,11 +156,45 @@ class AudioRecorder:
             print('ERROR: ', message.parse_error())
             self.stop()
 
+    def on_command(self, command):
+        if 'start' in command:
+            self.start_measured(command['start'])
+        if 'pause' in command:
+            self.pause()
+        if 'resume' in command:
+            self.resume()
+
+    def arm(self):
+        # build and preroll now, recording then only flips to PLAYING
+        self.pipeline.set_state(Gst.State.PAUSED)
+
+    def start_measured(self, start):
+        self.start_probe = StartLatencyProbe(self.pipeline, start['clicked'], self.on_started)
+        self.start(path=start.get('filename', None))
+
+    def on_started(self, latency):
+        print('Recording started {:.0f} ms after the click'.format(latency))
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'started': { 'id': self.id, 'latency': latency } })
+
+    def pause(self):
+        # live sources stop producing in PAUSED and the running time stops with
+        # them, so the paused span does not show up in the timestamps
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PLAYING)
+
     def start(self, path=None):
         if path:
             path = os.path.expanduser(path)
             self.sink.set_property('location', path)
         self.pipeline.set_state(Gst.State.PLAYING)
+        if getattr(self, 'comm', None):
+            # publish pipeline health to the control window
+            self.stats = PipelineStats(self.id, self.pipeline, self.comm.outQueue)
 
         clock = self.pipeline.get_pipeline_clock().get_time()
         print('clock', clock)
@@ -165,6 +202,8 @@ class AudioRecorder:
         print('delay', self.pipeline.get_delay())
 
     def stop(self):
+        if self.stats:
+            self.stats.stop()
         if self.pipeline:
             eos = Gst.Event.new_eos()
             self.pipeline.send_event(eos)
@@ -178,8 +217,8 @@ def main(**kwargs):
     if 'device' not in kwargs:
         raise AttributeError('no device supplied')
 
-    if 'filename' not in kwargs and 'port' not in kwargs:
-        raise AttributeError('either set filename or port')
+    if 'filename' not in kwargs and 'port' not in kwargs and 'socket_path' not in kwargs:
+        raise AttributeError('either set filename, port or socket_path')
 
     from setproctitle import setproctitle
     setproctitle('ScreenRecorder - AudioCapture for device {}'.format(kwargs['device']))
@@ -190,13 +229,21 @@ def main(**kwargs):
     Gst.init(None)
 
     # Start audio recorder
-    if 'filename' in kwargs:
+    if kwargs.get('armed', False):
+        # wait for the start command
+        recorder = AudioRecorder(mainloop=mainloop, **kwargs)
+        recorder.arm()
+    elif 'filename' in kwargs:
         recorder = AudioRecorder(mainloop=mainloop, **kwargs)
         recorder.start(path=kwargs['filename'])
     else:
         recorder = AudioRecorder(mainloop=mainloop, **kwargs)
         recorder.start()
 
+    if kwargs.get('clicked') is not None and not kwargs.get('armed', False):
+        # cold start, measured the same way for comparison
+        recorder.start_probe = StartLatencyProbe(recorder.pipeline, kwargs['clicked'], recorder.on_started)
+
     # run the main loop
     try:
         mainloop.run()
@@ -206,13 +253,15 @@ def main(**kwargs):
 
 # if run as script start recording
 if __name__ == "__main__":
+    devices, default_device = audio_devices()
+
     parser = argparse.ArgumentParser(description='Record audio')
     parser.add_argument(
         '-d', '--device',
         type=str,
         nargs=1,
-        default=[default_audio_device],
-        choices=[d[1] for d in AudioRecorder.DEVICES],
+        default=[default_device],
+        choices=[d[1] for d in devices],
         dest='device',
         help='device to capture'
     )
@@ -0,0 +1,179 @@
+import argparse
+import time
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst, GObject
+
+from ScreenRec.VideoEncoder import available_encoders, available_profiles, get_recording_sink
+from ScreenRec.Latency import EncoderLatencyProbe
+
+
+def calibration_key(encoder, width, height, fps, profile=None):
+    key = '{}:{}x{}@{}'.format(encoder, width, height, fps)
+    if profile and profile != available_profiles[0]:
+        # keys of the default profile stay what they were before there were profiles
+        key += ':{}'.format(profile)
+    return key
+
+
+# Measure the latency of an encoder on this host by feeding it synthetic frames
+# of the size and rate it will see when recording. Returns milliseconds or None.
+def measure_encoder_delay(encoder, width, height, fps, profile=None, frames=150, timeout=30, cancelled=None):
+    pipeline = Gst.Pipeline.new('calibration')
+
+    src = Gst.ElementFactory.make('videotestsrc')
+    src.set_property('is-live', True)
+    Gst.util_set_object_arg(src, 'pattern', 'ball')  # moving content, like a real screen
+
+    # same format ximagesrc delivers
+    cap_string = 'video/x-raw,format=BGRx,width={},height={},framerate={}/1'.format(width, height, fps)
+    caps = Gst.Caps.from_string(cap_string)
+    filter = Gst.ElementFactory.make('capsfilter')
+    filter.set_property('caps', caps)
+
+    enc, _ = get_recording_sink(
+        scale_width=width,
+        scale_height=height,
+        fps=fps,
+        encoder=encoder,
+        profile=profile,
+        expose_src=True
+    )
+    probe = EncoderLatencyProbe(enc.get_by_name('video_encoder'), window=frames)
+
+    sink = Gst.ElementFactory.make('fakesink')
+    sink.set_property('sync', False)
+
+    pipeline.add(src)
+    pipeline.add(filter)
+    pipeline.add(enc)
+    pipeline.add(sink)
+    src.link(filter)
+    filter.link(enc)
+    enc.link(sink)
+
+    bus = pipeline.get_bus()
+    pipeline.set_state(Gst.State.PLAYING)
+
+    result = None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        message = bus.timed_pop_filtered(100 * Gst.MSECOND, Gst.MessageType.ERROR)
+        if message:
+            print('ERROR: ', message.parse_error())
+            break
+        if len(probe.samples) >= frames:
+            result = probe.latency()
+            break
+        if cancelled and cancelled():
+            print('Calibration cancelled')
+            break
+
+    pipeline.set_state(Gst.State.NULL)
+    return result
+
+
+def main(**kwargs):
+    from setproctitle import setproctitle
+    setproctitle('ScreenRecorder - Encoder calibration')
+
+    # Initialize Gstreamer
+    GObject.threads_init()
+    Gst.init(None)
+
+    encoder = kwargs['encoder']
+    width = kwargs['width']
+    height = kwargs['height']
+    fps = kwargs['fps']
+    profile = kwargs.get('profile', None)
+
+    cancelled = None
+    if 'comm_queues' in kwargs:
+        # no main loop here, poll for a quit command between measurements
+        _, in_queue = kwargs['comm_queues']
+
+        def quit_requested():
+            while not in_queue.empty():
+                if 'quit' in in_queue.get():
+                    return True
+            return False
+        cancelled = quit_requested
+
+    delay = measure_encoder_delay(encoder, width, height, fps, profile=profile, cancelled=cancelled)
+    print('Encoder {} at {}x{}@{}: {} ms'.format(encoder, width, height, fps, delay))
+
+    if delay is not None and 'comm_queues' in kwargs:
+        out_queue, _ = kwargs['comm_queues']
+        out_queue.put({
+            'calibrated': {
+                'key': calibration_key(encoder, width, height, fps, profile),
+                'delay': delay
+            }
+        })
+    return delay
+
+# if run as script calibrate and store the result in the config file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the encoder latency used for A/V sync')
+    parser.add_argument(
+        '-e', '--encoder',
+        type=str,
+        nargs=1,
+        dest='encoder',
+        default=[available_encoders[0]],
+        choices=available_encoders,
+        help='encoder to calibrate'
+    )
+    parser.add_argument(
+        '-p', '--profile',
+        type=str,
+        nargs=1,
+        dest='profile',
+        default=[available_profiles[0]],
+        choices=available_profiles,
+        help='encoder profile to calibrate'
+    )
+    parser.add_argument(
+        '-x', '--width',
+        type=int,
+        nargs=1,
+        default=[1920],
+        dest='width',
+        help='width of the encoded video'
+    )
+    parser.add_argument(
+        '-y', '--height',
+        type=int,
+        nargs=1,
+        default=[1080],
+        dest='height',
+        help='height of the encoded video'
+    )
+    parser.add_argument(
+        '-f', '--fps',
+        type=int,
+        nargs=1,
+        default=[30],
+        dest='fps',
+        help='frames per second'
+    )
+    args = parser.parse_args()
+
+    delay = main(
+        encoder=args.encoder[0],
+        width=args.width[0],
+        height=args.height[0],
+        fps=args.fps[0],
+        profile=args.profile[0]
+    )
+    if delay is not None:
+        from ScreenRec.model.configfile import config
+        key = calibration_key(args.encoder[0], args.width[0], args.height[0], args.fps[0], args.profile[0])
+        config.encoder_delays[key] = delay
+        config.save()
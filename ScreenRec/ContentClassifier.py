@@ -0,0 +1,130 @@
+import sys
+import time
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst, GstVideo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+available_content_modes = [
+    'auto',    # screen settings, frame rate and bitrate follow what is on screen
+    'screen',  # text, UI and flat colors
+    'camera'   # natural images, e.g. a webcam or a playing video
+]
+
+# What the classes mean for the encoder. psy_tune and ref can only be set when the
+# encoder is built, fps and bitrate are factors of the configured ones and change
+# while recording.
+content_settings = {
+    'screen': { 'psy_tune': 'animation', 'ref': 4, 'fps': 0.5, 'bitrate': 0.6 },
+    'camera': { 'psy_tune': 'film', 'ref': 3, 'fps': 1.0, 'bitrate': 1.0 }
+}
+
+# packed formats with 4 bytes per pixel, what screen sources deliver, and whether the
+# padding or alpha byte comes first in memory
+packed_formats = {
+    'BGRx': False, 'RGBx': False, 'BGRA': False, 'RGBA': False,
+    'xRGB': True, 'xBGR': True, 'ARGB': True, 'ABGR': True
+}
+
+
+def color_mask(padding_first):
+    # the bits of a pixel read as one native 32 bit word that hold the colors
+    if padding_first == (sys.byteorder == 'little'):
+        return 0xffffff00
+    return 0x00ffffff
+
+
+# Looks at one frame every `interval` seconds and decides whether it shows screen
+# content or natural images. Screens have long runs of identical neighbouring pixels
+# and few distinct colors, camera images have noise everywhere. The class changes
+# after SWITCH_AFTER samples in a row agree, so a single busy frame (a video
+# thumbnail, a photo scrolled past) does not flip it. Until the first sample there is
+# no class and the recording runs at the configured rate and bitrate. Needs numpy.
+class ContentClassifier:
+    SWITCH_AFTER = 3
+    ROW_STEP = 4  # sampled rows and columns
+    FLAT_RATIO = 0.6  # share of neighbouring pixels with exactly the same color
+    MAX_PALETTE = 4096  # distinct colors among the sampled pixels
+
+    def __init__(self, pad, content=None, on_change=None, interval=2):
+        self.content = content
+        self.on_change = on_change
+        self.interval = interval
+        self.last_sample = 0
+        self.candidate = None
+        self.agreeing = 0
+        self.geometry = None
+        self.probe = None
+        if numpy is None:
+            print('numpy not installed, content classification disabled')
+            return
+        pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_event)
+        self.probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_event(self, pad, info):
+        event = info.get_event()
+        if event.type == Gst.EventType.CAPS:
+            video_info = GstVideo.VideoInfo()
+            self.geometry = None
+            if video_info.from_caps(event.parse_caps()):
+                format = GstVideo.VideoFormat.to_string(video_info.finfo.format)
+                if format in packed_formats:
+                    self.geometry = (
+                        video_info.width, video_info.height, video_info.stride[0],
+                        color_mask(packed_formats[format])
+                    )
+        return Gst.PadProbeReturn.OK
+
+    def classify(self, data):
+        width, height, stride, mask = self.geometry
+        frame = numpy.frombuffer(data, dtype=numpy.uint32, count=height * stride // 4)
+        # padding and alpha say nothing about the picture, compare colors only
+        pixels = frame.reshape(height, -1)[::ContentClassifier.ROW_STEP, :width] & numpy.uint32(mask)
+        flat = numpy.count_nonzero(pixels[:, 1:] == pixels[:, :-1]) / pixels[:, 1:].size
+        palette = len(numpy.unique(pixels[:, ::ContentClassifier.ROW_STEP]))
+        if flat > ContentClassifier.FLAT_RATIO and palette < ContentClassifier.MAX_PALETTE:
+            return 'screen', flat, palette
+        return 'camera', flat, palette
+
+    def on_buffer(self, pad, info):
+        now = time.monotonic()
+        if self.geometry is None or now - self.last_sample < self.interval:
+            return Gst.PadProbeReturn.OK
+        self.last_sample = now
+
+        buffer = info.get_buffer()
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.PadProbeReturn.OK
+        try:
+            content, flat, palette = self.classify(mapinfo.data)
+        finally:
+            buffer.unmap(mapinfo)
+
+        if content == self.content:
+            self.candidate = None
+            self.agreeing = 0
+            return Gst.PadProbeReturn.OK
+        if content != self.candidate:
+            self.candidate = content
+            self.agreeing = 0
+        self.agreeing += 1
+        if self.agreeing >= ContentClassifier.SWITCH_AFTER or self.content is None:
+            print('Content looks like {} now, {:.0%} flat, {} colors'.format(content, flat, palette))
+            self.content = content
+            self.candidate = None
+            self.agreeing = 0
+            if self.on_change:
+                self.on_change(content)
+        return Gst.PadProbeReturn.OK
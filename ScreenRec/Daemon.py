@@ -0,0 +1,282 @@
+import argparse
+import inspect
+import json
+import os
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+from time import time
+
+from ScreenRec.Supervisor import QueueManager, RecordingSession
+from ScreenRec.Farm import Farm
+from ScreenRec.model.configfile import config
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+    return os.path.join(runtime_dir, 'ScreenRecorder.sock')
+
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RPCError(Exception):
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+        super().__init__(message)
+
+
+# One connection per client, kept open for as many requests as it likes. Requests and
+# responses are JSON-RPC 2.0 objects, one per line.
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            response = self.server.daemon.handle_line(line)
+            if response is None:
+                # notification, nothing to answer
+                continue
+            try:
+                self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Headless owner of the recording processes, driven through a Unix domain socket
+class Daemon:
+
+    def __init__(self, socket_path=None, display=None, pool_size=None):
+        if display:
+            # recorders and source windows inherit it, e.g. an Xvfb server
+            os.environ['DISPLAY'] = display
+
+        self.socket_path = socket_path if socket_path else default_socket_path()
+        if pool_size is None:
+            pool_size = int(config.rec_settings.worker_pool)
+
+        self.comm = QueueManager(pool_size=pool_size)
+        self.comm.start()
+        self.session = RecordingSession(self.comm, display=display)
+        # independent recordings of other displays, e.g. one Xvfb per test session
+        self.farm = Farm(self.comm)
+        # session changes are serialized, status reads go without waiting
+        self.lock = threading.Lock()
+
+        self.methods = {
+            'start': self.start,
+            'stop': self.stop,
+            'pause': self.pause,
+            'resume': self.resume,
+            'switch': self.switch,
+            'save_replay': self.save_replay,
+            'sources': self.sources,
+            'status': self.status,
+            'farm_add': self.farm.add,
+            'farm_remove': self.farm.remove,
+            'farm_status': self.farm.status
+        }
+
+        self.session.calibrate()
+        self.session.arm()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = Server(self.socket_path, RequestHandler)
+        self.server.daemon = self
+        print('Daemon: listening on {}'.format(self.socket_path))
+
+    def handle_line(self, line):
+        id = None
+        # until the request could be read, errors are answered with id null
+        notification = False
+        try:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                raise RPCError(PARSE_ERROR, 'Parse error')
+            if not isinstance(request, dict) or not isinstance(request.get('method', None), str):
+                raise RPCError(INVALID_REQUEST, 'Invalid request')
+            id = request.get('id', None)
+            notification = 'id' not in request
+
+            method = self.methods.get(request['method'], None)
+            if not method:
+                raise RPCError(METHOD_NOT_FOUND, 'Method not found: {}'.format(request['method']))
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, 'Params must be an object')
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+            result = method(**params)
+        except RPCError as e:
+            if notification:
+                print('Daemon: notification failed: {}'.format(e.message))
+                return None
+            return { 'jsonrpc': '2.0', 'id': id, 'error': { 'code': e.code, 'message': e.message } }
+        except Exception as e:
+            # keep serving, the client gets told instead of waiting for an answer
+            print('Daemon: request failed: {}'.format(e))
+            if notification:
+                return None
+            return { 'jsonrpc': '2.0', 'id': id, 'error': { 'code': INTERNAL_ERROR, 'message': str(e) } }
+
+        if notification:
+            return None
+        return { 'jsonrpc': '2.0', 'id': id, 'result': result }
+
+    def start(self, filename=None, wait=True):
+        clicked = time()
+        with self.lock:
+            started = self.session.start(clicked=clicked, filename=filename)
+            ids = list(self.session.recording_ids)
+        result = { 'started': started, 'output_path': self.session.output_path }
+        if started and wait:
+            # answer once the pipelines run, not when the processes were asked to
+            result['playing'] = self.comm.wait_state(ids)
+        return result
+
+    def stop(self):
+        with self.lock:
+            return { 'stopped': self.session.stop() }
+
+    def pause(self, paused=True):
+        with self.lock:
+            changed = self.session.pause(paused)
+        return { 'paused': self.session.paused, 'changed': changed }
+
+    def resume(self):
+        return self.pause(paused=False)
+
+    def switch(self, source):
+        with self.lock:
+            switched = self.session.switch(source)
+        if not switched:
+            raise RPCError(INVALID_PARAMS, 'Can not switch to {}'.format(source))
+        return { 'source': source }
+
+    def save_replay(self, seconds=None):
+        with self.lock:
+            return { 'saved': self.session.save_replay(seconds) }
+
+    def sources(self):
+        return [
+            { 'id': button.id, 'title': button.title, 'type': button.button_type }
+            for button in config.buttons
+        ]
+
+    def status(self):
+        return self.session.status()
+
+    def serve(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.quit()
+
+    def quit(self):
+        print('Daemon: quitting')
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        with self.lock:
+            # no new armed processes, everything is going down
+            self.session.stop(arm=False)
+        self.farm.shutdown()
+        self.comm.queue.put({ 'quit': True })
+        self.comm.join()
+
+
+def request(method, params=None, socket_path=None):
+    # one shot client, scripts that send many requests should keep the connection open
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path if socket_path else default_socket_path())
+    try:
+        message = { 'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params if params else {} }
+        client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        response = client.makefile('rb').readline()
+    finally:
+        client.close()
+    return json.loads(response.decode('utf-8'))
+
+
+def main(**kwargs):
+    from setproctitle import setproctitle
+    setproctitle('ScreenRecorder - Daemon')
+
+    daemon = Daemon(**kwargs)
+
+    def on_signal(signum, frame):
+        # serve_forever has to be stopped from another thread
+        threading.Thread(target=daemon.server.shutdown).start()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    daemon.serve()
+
+
+# if run as script start the daemon, or talk to a running one
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Screen recorder daemon with a JSON-RPC control socket')
+    parser.add_argument(
+        '-s', '--socket',
+        type=str,
+        nargs=1,
+        dest='socket_path',
+        default=[default_socket_path()],
+        help='Unix domain socket to listen on'
+    )
+    parser.add_argument(
+        '-d', '--display',
+        type=str,
+        nargs=1,
+        dest='display',
+        default=[None],
+        help='X display to record and open source windows on, e.g. an Xvfb server'
+    )
+    parser.add_argument(
+        '-p', '--pool-size',
+        type=int,
+        nargs=1,
+        dest='pool_size',
+        default=[None],
+        help='number of pre-initialized source window processes, defaults to the settings'
+    )
+    parser.add_argument(
+        '-c', '--call',
+        type=str,
+        nargs='+',
+        dest='call',
+        default=None,
+        help='send a request to a running daemon instead: METHOD [JSON params]'
+    )
+
+    args = parser.parse_args()
+
+    if args.call:
+        params = json.loads(args.call[1]) if len(args.call) > 1 else {}
+        print(json.dumps(request(args.call[0], params, args.socket_path[0]), indent=4))
+    else:
+        main(
+            socket_path=args.socket_path[0],
+            display=args.display[0],
+            pool_size=args.pool_size[0]
+        )
@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from ScreenRec.ScreenRecorder import main as screenrecord_main
+from ScreenRec.Supervisor import QueueManager
+from ScreenRec.Telemetry import stats_health
+
+available_farm_outputs = [
+    'file',  # each recorder muxes into its own file
+    'udp',   # RTP stream to a leased port, for a consumer on this host
+    'shm'    # shared memory channel with a leased socket name
+]
+
+
+# Host CPU utilization, sampled from /proc/stat. Falls back to the load average where
+# there is no /proc, which lags but is better than nothing.
+class CPUMonitor(threading.Thread):
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.utilization = 0.0
+        self.running = True
+        super().__init__(daemon=True)
+
+    def sample(self):
+        with open('/proc/stat') as fp:
+            values = [int(v) for v in fp.readline().split()[1:]]
+        idle = values[3] + values[4]  # idle + iowait
+        return sum(values) - idle, sum(values)
+
+    def run(self):
+        last = None
+        while self.running:
+            try:
+                current = self.sample()
+                if last and current[1] > last[1]:
+                    self.utilization = (current[0] - last[0]) / (current[1] - last[1])
+                last = current
+            except (IOError, ValueError, IndexError):
+                self.utilization = min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+
+# Many independent screen recordings, one ScreenRecorder process per X display, with
+# their ports and channels leased from the supervisor. New recordings go through
+# admission control: below degrade_load they start as requested, up to max_load with
+# halved frame rate and size and the fastest preset, above that they are refused.
+# Recordings started in the last few seconds have not shown up in the CPU sample yet,
+# their cost is estimated from the running ones.
+class Farm:
+    DEGRADE_LOAD = 0.7
+    MAX_LOAD = 0.9
+    SETTLE_TIME = 5  # seconds until a new recording shows in the CPU sample
+
+    def __init__(self, comm, degrade_load=DEGRADE_LOAD, max_load=MAX_LOAD):
+        self.comm = comm
+        self.degrade_load = degrade_load
+        self.max_load = max_load
+        self.recordings = {}
+        self.lock = threading.Lock()
+        self.cpu = CPUMonitor()
+        self.cpu.start()
+
+    def process_id(self, name):
+        return 'farm-{}'.format(name)
+
+    def projected_load(self):
+        now = time.monotonic()
+        settled = [r for r in self.recordings.values() if now - r['started'] >= Farm.SETTLE_TIME]
+        settling = len(self.recordings) - len(settled)
+        utilization = self.cpu.utilization
+        if settled:
+            cost = utilization / len(settled)
+        else:
+            # assume one core per recording until we know better
+            cost = 1 / (os.cpu_count() or 1)
+        return utilization + settling * cost, cost
+
+    def reap(self):
+        # forget recordings whose process is gone, the supervisor takes their channels back
+        for name, recording in list(self.recordings.items()):
+            process = self.comm.processes.get(self.process_id(name), None)
+            if process is None and time.monotonic() - recording['started'] < Farm.SETTLE_TIME:
+                # the supervisor has not started it yet
+                continue
+            if process is None or not process.is_alive():
+                del self.recordings[name]
+
+    def add(self, name, display, filename=None, output='file', width=1920, height=1080,
+            fps=30, encoder=None):
+        with self.lock:
+            self.reap()
+            if name in self.recordings:
+                return { 'admitted': False, 'reason': 'recording {} exists'.format(name) }
+            if output not in available_farm_outputs:
+                return { 'admitted': False, 'reason': 'unknown output {}'.format(output) }
+            if output == 'file' and not filename:
+                return { 'admitted': False, 'reason': 'file output needs a filename' }
+
+            load, cost = self.projected_load()
+            if load + cost > self.max_load:
+                return {
+                    'admitted': False,
+                    'reason': 'cpu saturated, projected load {:.0%}'.format(load + cost)
+                }
+            degraded = load + cost > self.degrade_load
+
+            kwargs = {
+                'id': self.process_id(name),
+                'display': display,
+                'width': int(width),
+                'height': int(height),
+                'fps': int(fps),
+                # back off on its own when the host gets busy after admission
+                'adaptive': True
+            }
+            if encoder:
+                kwargs['encoder'] = encoder
+            if degraded:
+                kwargs['fps'] = max(1, int(fps) // 2)
+                kwargs['scale_width'] = int(width) // 2
+                kwargs['scale_height'] = int(height) // 2
+                kwargs['preset'] = 'ultrafast'
+
+            lease = {}
+            if output == 'udp':
+                try:
+                    lease['port'] = self.comm.channels.lease_port()
+                except RuntimeError as e:
+                    return { 'admitted': False, 'reason': str(e) }
+                kwargs['port'] = lease['port']
+            elif output == 'shm':
+                lease['socket_path'] = self.comm.channels.lease_channel(self.process_id(name))
+                kwargs['socket_path'] = lease['socket_path']
+            else:
+                kwargs['filename'] = filename
+
+            self.comm.queue.put({
+                'execute': {
+                    'id': self.process_id(name),
+                    'main': screenrecord_main,
+                    'kwargs': kwargs,
+                    'leases': list(lease.values()),
+                    'supervised': True
+                }
+            })
+            self.recordings[name] = {
+                'display': display,
+                'output': output,
+                'lease': lease,
+                'degraded': degraded,
+                'started': time.monotonic()
+            }
+            print('Farm: recording {} on {}{}'.format(name, display, ', degraded' if degraded else ''))
+            return { 'admitted': True, 'degraded': degraded, 'lease': lease }
+
+    def remove(self, name):
+        with self.lock:
+            if name not in self.recordings:
+                return False
+            self.comm.queue.put({ 'terminate': self.process_id(name) })
+            del self.recordings[name]
+            return True
+
+    def remove_all(self):
+        for name in list(self.recordings.keys()):
+            self.remove(name)
+
+    def status(self):
+        with self.lock:
+            self.reap()
+            recordings = {}
+            totals = { 'fps': 0.0, 'dropped': 0, 'duplicated': 0, 'bytes_per_second': 0.0, 'degraded': 0 }
+            levels = ['ok', 'struggling', 'overloaded']
+            worst = 'ok'
+            for name, recording in self.recordings.items():
+                entry = dict(recording, started=None)
+                history = self.comm.stats.get(self.process_id(name), None)
+                if history:
+                    stats = history[-1]
+                    entry['health'] = stats_health(stats)
+                    entry['fps'] = stats['frames'] / stats['interval']
+                    entry['dropped'] = stats['dropped']
+                    entry['duplicated'] = stats['duplicated']
+                    entry['bytes_per_second'] = stats['bytes'] / stats['interval']
+                    totals['fps'] += entry['fps']
+                    totals['dropped'] += entry['dropped']
+                    totals['duplicated'] += entry['duplicated']
+                    totals['bytes_per_second'] += entry['bytes_per_second']
+                    if levels.index(entry['health']) > levels.index(worst):
+                        worst = entry['health']
+                restart = self.comm.restarts.get(self.process_id(name), None)
+                if restart:
+                    entry['restarts'] = restart['count']
+                    entry['restart_latency'] = restart['latency']
+                if recording['degraded']:
+                    totals['degraded'] += 1
+                recordings[name] = entry
+
+            load, cost = self.projected_load()
+            return {
+                'recordings': recordings,
+                'count': len(recordings),
+                'totals': totals,
+                'health': worst,
+                'cpu': self.cpu.utilization,
+                'projected_load': load,
+                'recording_cost': cost
+            }
+
+    def shutdown(self):
+        self.remove_all()
+        self.cpu.stop()
+
+
+def start_xvfb(number, width, height):
+    # a virtual X server on display :number, returns once it accepts connections
+    process = subprocess.Popen(
+        ['Xvfb', ':{}'.format(number), '-screen', '0', '{}x{}x24'.format(width, height), '-nolisten', 'tcp'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    socket_path = '/tmp/.X11-unix/X{}'.format(number)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Xvfb :{} exited with {}'.format(number, process.returncode))
+        time.sleep(0.1)
+    return process
+
+
+# if run as script record a number of local Xvfb displays, to try the farm on one machine
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Record many Xvfb displays at once')
+    parser.add_argument(
+        '-n', '--displays',
+        type=int,
+        nargs=1,
+        dest='displays',
+        default=[4],
+        help='number of Xvfb servers to start'
+    )
+    parser.add_argument(
+        '-f', '--first-display',
+        type=int,
+        nargs=1,
+        dest='first_display',
+        default=[100],
+        help='display number of the first Xvfb server'
+    )
+    parser.add_argument(
+        '-x', '--width',
+        type=int,
+        nargs=1,
+        dest='width',
+        default=[1280],
+        help='width of the virtual screens'
+    )
+    parser.add_argument(
+        '-y', '--height',
+        type=int,
+        nargs=1,
+        dest='height',
+        default=[720],
+        help='height of the virtual screens'
+    )
+    parser.add_argument(
+        '-t', '--duration',
+        type=int,
+        nargs=1,
+        dest='duration',
+        default=[30],
+        help='seconds to record'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        nargs=1,
+        dest='output',
+        default=['file'],
+        choices=available_farm_outputs,
+        help='where the recorders send their video'
+    )
+    parser.add_argument(
+        '-p', '--path',
+        type=str,
+        nargs=1,
+        dest='path',
+        default=[None],
+        help='directory for the recordings, a temporary one if not set'
+    )
+
+    args = parser.parse_args()
+
+    if not shutil.which('Xvfb'):
+        raise SystemExit('Xvfb is not installed')
+
+    path = args.path[0] if args.path[0] else tempfile.mkdtemp(prefix='ScreenRecorder-farm-')
+    servers = []
+    comm = QueueManager()
+    comm.start()
+    farm = Farm(comm)
+    try:
+        for i in range(args.displays[0]):
+            number = args.first_display[0] + i
+            servers.append(start_xvfb(number, args.width[0], args.height[0]))
+            result = farm.add(
+                'display-{}'.format(number),
+                ':{}'.format(number),
+                filename=os.path.join(path, 'display-{}.ts'.format(number)),
+                output=args.output[0],
+                width=args.width[0],
+                height=args.height[0]
+            )
+            print(json.dumps(result))
+
+        deadline = time.monotonic() + args.duration[0]
+        while time.monotonic() < deadline:
+            time.sleep(2)
+            status = farm.status()
+            print(json.dumps({
+                'count': status['count'],
+                'health': status['health'],
+                'cpu': round(status['cpu'], 2),
+                'totals': status['totals']
+            }))
+    finally:
+        farm.shutdown()
+        comm.queue.put({ 'quit': True })
+        comm.join()
+        for server in servers:
+            server.terminate()
+            server.wait()
+        print('Recordings in {}'.format(path))
@@ -0,0 +1,162 @@
+import time
+import zlib
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst, GstVideo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+available_capture_modes = [
+    'constant',  # grab every frame, pad to a constant framerate
+    'damage'     # only forward frames when the screen content changed
+]
+
+
+# Pad probe that drops frames whose content did not change since the last forwarded
+# frame. With ximagesrc in damage mode only the damaged regions are copied so the
+# grab itself is cheap, this makes sure the encoder only sees frames that differ.
+# One frame is forwarded at least every `min_refresh` milliseconds so the stream
+# does not stall on a static screen.
+class DamageGate:
+
+    def __init__(self, pad, min_refresh=1000):
+        self.min_refresh = min_refresh * Gst.MSECOND
+        self.last_checksum = None
+        self.last_pts = None
+        self.passed = 0
+        self.dropped = 0
+        self.probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.PadProbeReturn.OK
+        try:
+            checksum = zlib.adler32(mapinfo.data)
+        finally:
+            buffer.unmap(mapinfo)
+
+        if checksum == self.last_checksum \
+           and self.last_pts is not None \
+           and buffer.pts - self.last_pts < self.min_refresh:
+            self.dropped += 1
+            return Gst.PadProbeReturn.DROP
+
+        self.last_checksum = checksum
+        self.last_pts = buffer.pts
+        self.passed += 1
+        return Gst.PadProbeReturn.OK
+
+
+# Pad probe in front of the encoder that drops frames repeating the last forwarded one,
+# e.g. the copies videorate makes of a static screen. The container has no frame
+# durations, players show a frame until the next one, so dropping is all it takes to
+# extend it. With numpy every ROW_STEP-th row is compared against the same rows of
+# the last forwarded frame as 64 bit words, far cheaper than encoding the frame.
+# A mouse cursor or text caret spans more rows than that, changes that fall between
+# the sampled rows show up with the next forced frame at least every `min_refresh`
+# milliseconds. Without numpy the whole frame goes through adler32.
+class DuplicateGate:
+    ROW_STEP = 4
+
+    def __init__(self, pad, min_refresh=1000):
+        self.min_refresh = min_refresh * Gst.MSECOND
+        self.reference = None
+        self.last_pts = None
+        self.rows = None
+        self.passed = 0
+        self.dropped = 0
+        self.probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+        pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_event)
+
+    def on_event(self, pad, info):
+        event = info.get_event()
+        if event.type == Gst.EventType.CAPS:
+            # the size of the first plane, the others follow the same content
+            video_info = GstVideo.VideoInfo()
+            if video_info.from_caps(event.parse_caps()):
+                self.rows = (video_info.height, video_info.stride[0])
+            self.reference = None
+        return Gst.PadProbeReturn.OK
+
+    def vectorized(self):
+        return numpy is not None and self.rows is not None
+
+    def sample(self, data):
+        if not self.vectorized():
+            return zlib.adler32(data)
+        height, stride = self.rows
+        if stride % 8:
+            frame = numpy.frombuffer(data, dtype=numpy.uint8, count=height * stride)
+        else:
+            frame = numpy.frombuffer(data, dtype=numpy.uint64, count=height * stride // 8)
+        return frame.reshape(height, -1)[::DuplicateGate.ROW_STEP]
+
+    def on_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.PadProbeReturn.OK
+        try:
+            sample = self.sample(mapinfo.data)
+            if self.reference is not None \
+               and self.last_pts is not None \
+               and buffer.pts - self.last_pts < self.min_refresh:
+                if self.vectorized():
+                    repeated = numpy.array_equal(sample, self.reference)
+                else:
+                    repeated = sample == self.reference
+                if repeated:
+                    self.dropped += 1
+                    return Gst.PadProbeReturn.DROP
+
+            # the buffer memory is reused upstream, keep a copy of the sampled rows
+            self.reference = sample.copy() if self.vectorized() else sample
+        finally:
+            buffer.unmap(mapinfo)
+
+        self.last_pts = buffer.pts
+        self.passed += 1
+        return Gst.PadProbeReturn.OK
+
+
+# Pad probe on parsed H.264 that drops everything up to the first keyframe, so a
+# recording never starts with frames that reference data it did not get. While it
+# drops, on_waiting is called at most every `retry` milliseconds so the sender can be
+# asked for a keyframe instead of waiting for the next regular one.
+class KeyframeGate:
+
+    def __init__(self, pad, on_waiting=None, retry=500):
+        self.pad = pad
+        self.on_waiting = on_waiting
+        self.retry = retry / 1000
+        self.last_request = None
+        self.dropped = 0
+        self.probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        if not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            # sps and pps come with every keyframe, from here on everything decodes
+            print('Keyframe gate open, dropped {} frames before'.format(self.dropped))
+            self.probe = None
+            return Gst.PadProbeReturn.REMOVE
+
+        self.dropped += 1
+        now = time.monotonic()
+        if self.on_waiting and (self.last_request is None or now - self.last_request >= self.retry):
+            self.last_request = now
+            self.on_waiting()
+        return Gst.PadProbeReturn.DROP
@@ -23,8 +23,49 @@ class IPCWatcher(threading.Thread):
                 print('IPC got {}'.format(command))
             if 'quit' in command:
                 quit = True
-            GLib.idle_add(self.run_command, command)
+            GLib.idle_add(self.dispatch, command)
+
+    def dispatch(self, command):
+        # commands with a request_id are answered once they ran on the main loop
+        try:
+            self.run_command(command)
+        except Exception as e:
+            if 'request_id' not in command:
+                raise
+            print('IPC command failed: {}'.format(e))
+            self.reply(command, error=str(e))
+            return False
+        self.reply(command)
+        return False
+
+    def reply(self, command, error=None):
+        if 'request_id' not in command:
+            return
+        self.outQueue.put({
+            'reply': {
+                'id': getattr(self.main, 'id', None),
+                'request_id': command['request_id'],
+                'error': error
+            }
+        })
+
+    def watch_pipeline(self, bus, pipeline):
+        # report every state the pipeline reaches, the supervisor waits for PLAYING
+        def on_state_changed(bus, message):
+            if message.src != pipeline:
+                return
+            old, new, pending = message.parse_state_changed()
+            self.outQueue.put({
+                'pipeline_state': {
+                    'id': getattr(self.main, 'id', None),
+                    'state': new.value_nick.upper()
+                }
+            })
+
+        bus.connect('message::state-changed', on_state_changed)
 
     def run_command(self, command):
         if 'quit' in command:
-            self.main.stop()
\ No newline at end of file
+            self.main.stop()
+        elif hasattr(self.main, 'on_command'):
+            self.main.on_command(command)
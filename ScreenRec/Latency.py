@@ -0,0 +1,93 @@
+import time
+from collections import deque
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst
+
+
+# Measures how long frames spend inside an encoder by matching the timestamps of the
+# buffers going in and coming out of it. Encoders keep the PTS of their input frames.
+class EncoderLatencyProbe:
+
+    MAX_PENDING = 1000
+
+    def __init__(self, element, window=120):
+        self.pending = {}
+        self.samples = deque(maxlen=window)
+        self.sink_probe = element.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self.on_sink_buffer)
+        self.src_probe = element.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.on_src_buffer)
+
+    def on_sink_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        self.pending[buffer.pts] = time.monotonic()
+        if len(self.pending) > EncoderLatencyProbe.MAX_PENDING:
+            # frames the encoder dropped never come out, forget the oldest one
+            del self.pending[next(iter(self.pending))]
+        return Gst.PadProbeReturn.OK
+
+    def on_src_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        start = self.pending.pop(buffer.pts, None)
+        if start is not None:
+            self.samples.append((time.monotonic() - start) * 1000)
+        return Gst.PadProbeReturn.OK
+
+    def latency(self):
+        # median in milliseconds, robust against single frames stuck behind a keyframe
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[len(samples) // 2]
+
+
+# Measures how old frames are when they pass a pad: live sources stamp every buffer
+# with the running time it was captured at, the difference to the running time now
+# is the glass-to-here latency.
+class GlassLatencyProbe:
+
+    def __init__(self, pipeline, pad, window=120):
+        self.pipeline = pipeline
+        self.samples = deque(maxlen=window)
+        self.probe = pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        clock = self.pipeline.get_clock()
+        if clock is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            running_time = clock.get_time() - self.pipeline.get_base_time()
+            self.samples.append((running_time - buffer.pts) / Gst.MSECOND)
+        return Gst.PadProbeReturn.OK
+
+    def latency(self):
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[len(samples) // 2]
+
+
+# Reports how long it took from the record click (wall clock, set by the control
+# window) until the first buffer reached one of the sinks of a pipeline.
+class StartLatencyProbe:
+
+    def __init__(self, pipeline, clicked, callback):
+        self.clicked = clicked
+        self.callback = callback
+        self.done = False
+
+        for element in pipeline.iterate_recurse():
+            if element.has_flag(Gst.ElementFlags.SINK) and not isinstance(element, Gst.Bin):
+                element.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    def on_buffer(self, pad, info):
+        if not self.done:
+            self.done = True
+            if self.clicked is not None:
+                # respawned and restarted processes have no click to measure from
+                self.callback((time.time() - self.clicked) * 1000)
+        return Gst.PadProbeReturn.REMOVE
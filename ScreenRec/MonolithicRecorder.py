@@ -0,0 +1,308 @@
+import argparse
+import os
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst, GObject
+
+from ScreenRec.IPC import IPCWatcher
+from ScreenRec.Telemetry import PipelineStats
+from ScreenRec.Latency import StartLatencyProbe
+from ScreenRec.AudioEncoder import available_encoders as available_audio_encoders, get_audio_encoder
+from ScreenRec.VideoEncoder import available_encoders, available_profiles, get_recording_sink, force_keyframe
+from ScreenRec.ScreenRecorder import make_screen_source
+from ScreenRec.FrameGate import DamageGate
+from ScreenRec.AudioRecorder import make_audio_source
+
+available_engines = [
+    'multiprocess',  # screen recorder, audio recorder and muxer in separate processes
+    'monolithic'     # everything in one pipeline in one process
+]
+
+
+# Screen capture, audio capture, encoders and muxer in one pipeline that shares one clock,
+# so there is no need for RTP transport and no need for a hardcoded A/V delay
+class MonolithicRecorder:
+
+    ENCODERS = available_encoders
+    AUDIO_ENCODERS = available_audio_encoders
+
+    def __init__(self, mainloop=None, **kwargs):
+        self.id = 'recorder'
+        self.mainloop = mainloop
+        from ScreenRec.model.configfile import config
+
+        if 'comm_queues' in kwargs:
+            self.comm = IPCWatcher(kwargs['comm_queues'], self)
+            self.comm.start()
+
+        self.scale_width = kwargs.get('scale_width', config.rec_settings.scale_width)
+        self.scale_height = kwargs.get('scale_height', config.rec_settings.scale_height)
+        self.width = kwargs.get('width', config.rec_settings.width)
+        self.height = kwargs.get('height', config.rec_settings.height)
+        self.fps = kwargs.get('fps', config.rec_settings.fps)
+        self.encoder = kwargs.get('encoder', config.rec_settings.encoder)
+        if not self.encoder:
+            self.encoder = MonolithicRecorder.ENCODERS[0]
+        self.profile = kwargs.get('profile', config.rec_settings.profile)
+        self.content_mode = kwargs.get('content_mode', config.rec_settings.content_mode)
+        self.display = kwargs.get('display', config.rec_settings.screen)
+        self.capture_mode = kwargs.get('capture_mode', config.rec_settings.capture_mode)
+        self.min_refresh = kwargs.get('min_refresh', config.rec_settings.min_refresh)
+        self.gate = None
+        self.stats = None
+
+        self.device = kwargs.get('device', config.audio_settings.device)
+        self.audio_codec = kwargs.get('audio_codec', config.audio_settings.encoder)
+        if not self.audio_codec:
+            self.audio_codec = MonolithicRecorder.AUDIO_ENCODERS[0]
+        self.audio_bitrate = kwargs.get('audio_bitrate', config.audio_settings.bitrate)
+
+        self.build_gst_pipeline()
+
+    def build_gst_pipeline(self):
+        # assemble pipeline
+        self.pipeline = Gst.Pipeline.new('recorder')
+        self.pipeline.use_clock(Gst.SystemClock.obtain())
+
+        # video part
+        damage = self.capture_mode == 'damage'
+        video_src = make_screen_source(self.display, self.width, self.height, use_damage=damage)
+        if damage:
+            self.gate = DamageGate(video_src.get_static_pad('src'), min_refresh=self.min_refresh)
+        video_queue = Gst.ElementFactory.make('queue')
+
+        video_enc, _ = get_recording_sink(
+            scale_width=self.scale_width if self.scale_width else self.width,
+            scale_height=self.scale_height if self.scale_height else self.height,
+            fps=self.fps,
+            encoder=self.encoder,
+            profile=self.profile,
+            min_refresh=self.min_refresh,
+            content='camera' if self.content_mode == 'camera' else 'screen',
+            expose_src=True,
+            variable_framerate=damage
+        )
+
+        self.pipeline.add(video_src)
+        self.pipeline.add(video_queue)
+        self.pipeline.add(video_enc)
+        video_src.link(video_queue)
+        video_queue.link(video_enc)
+
+        # audio part
+        audio_src = make_audio_source(self.device)
+        audio_queue = Gst.ElementFactory.make('queue')
+        audio_convert = Gst.ElementFactory.make('audioconvert')
+        audio_resample = Gst.ElementFactory.make('audioresample')
+        audio_enc = get_audio_encoder(self.audio_codec, self.audio_bitrate)
+
+        self.pipeline.add(audio_src)
+        self.pipeline.add(audio_queue)
+        self.pipeline.add(audio_convert)
+        self.pipeline.add(audio_resample)
+        self.pipeline.add(audio_enc)
+        audio_src.link(audio_queue)
+        audio_queue.link(audio_convert)
+        audio_convert.link(audio_resample)
+        audio_resample.link(audio_enc)
+
+        # muxer, the encoders report their latency so the muxer aligns the tracks
+        muxer = Gst.ElementFactory.make('mpegtsmux')
+        self.sink = Gst.ElementFactory.make('filesink')
+        self.pipeline.add(muxer)
+        self.pipeline.add(self.sink)
+
+        video_pad = muxer.get_request_pad('sink_%d')
+        audio_pad = muxer.get_request_pad('sink_%d')
+        Gst.Element.link_pads(video_enc, 'src', muxer, video_pad.get_name())
+        Gst.Element.link_pads(audio_enc, 'src', muxer, audio_pad.get_name())
+
+        muxer.link(self.sink)
+
+        self.create_bus()
+
+    def create_bus(self):
+        # create a bus
+        self.bus = self.pipeline.get_bus()
+
+        # we want signal watchers
+        self.bus.add_signal_watch()
+
+        # on message print errors
+        self.bus.connect('message', self.on_message)
+        if getattr(self, 'comm', None):
+            # the supervisor waits for our state changes
+            self.comm.watch_pipeline(self.bus, self.pipeline)
+
+    def on_message(self, bus, message):
+        t = message.type
+
+        if t == Gst.MessageType.EOS:
+            # end of stream, just disable the switch and stop processing
+            self.stop()
+        if t == Gst.MessageType.ERROR:
+            # some error occured, log and stop
+            print('ERROR: ', message.parse_error())
+            self.stop()
+
+    def on_command(self, command):
+        if 'start' in command:
+            self.start_measured(command['start'])
+        if 'pause' in command:
+            self.pause()
+        if 'resume' in command:
+            self.resume()
+
+    def arm(self):
+        # build now, the filesink can only get its location up to READY
+        self.pipeline.set_state(Gst.State.READY)
+
+    def start_measured(self, start):
+        self.start_probe = StartLatencyProbe(self.pipeline, start['clicked'], self.on_started)
+        self.start(path=start.get('filename', None))
+
+    def on_started(self, latency):
+        print('Recording started {:.0f} ms after the click'.format(latency))
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'started': { 'id': self.id, 'latency': latency } })
+
+    def pause(self):
+        # live sources stop producing in PAUSED and the running time stops with
+        # them, so the paused span does not show up in the timestamps
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PLAYING)
+            # the first frame after the pause must not reference the ones before it
+            force_keyframe(self.pipeline)
+
+    def start(self, path='~/output.ts'):
+        path = os.path.expanduser(path)
+        self.sink.set_property('location', path)
+        self.pipeline.set_state(Gst.State.PLAYING)
+        if getattr(self, 'comm', None):
+            # publish pipeline health to the control window
+            self.stats = PipelineStats(self.id, self.pipeline, self.comm.outQueue)
+
+    def stop(self):
+        if self.stats:
+            self.stats.stop()
+        if self.pipeline:
+            eos = Gst.Event.new_eos()
+            self.pipeline.send_event(eos)
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+        if self.mainloop:
+            self.mainloop.quit()
+            self.comm.join()
+
+
+def main(**kwargs):
+    if 'filename' not in kwargs and not kwargs.get('armed', False):
+        raise AttributeError('you have to set a filename')
+
+    from setproctitle import setproctitle
+    setproctitle('ScreenRecorder - Recorder')
+
+    # Initialize Gstreamer
+    GObject.threads_init()
+    mainloop = GObject.MainLoop()
+    Gst.init(None)
+
+    # Start recorder
+    recorder = MonolithicRecorder(mainloop=mainloop, **kwargs)
+    if kwargs.get('armed', False):
+        # wait for the start command, it brings the final filename
+        recorder.arm()
+    else:
+        recorder.start(path=kwargs['filename'])
+
+    if kwargs.get('clicked') is not None and not kwargs.get('armed', False):
+        # cold start, measured the same way for comparison
+        recorder.start_probe = StartLatencyProbe(recorder.pipeline, kwargs['clicked'], recorder.on_started)
+
+    # run the main loop
+    try:
+        mainloop.run()
+    except:
+        recorder.stop()
+        mainloop.quit()
+
+# if run as script start recording
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Record screen and audio in one process')
+    parser.add_argument(
+        '-d', '--display',
+        type=str,
+        nargs=1,
+        default=['0'],
+        dest='display',
+        help='display index to capture, or an X display name like :99'
+    )
+    parser.add_argument(
+        '-x', '--width',
+        type=int,
+        nargs=1,
+        default=[1920],
+        dest='width',
+        help='width of the screen area to capture'
+    )
+    parser.add_argument(
+        '-y', '--height',
+        type=int,
+        nargs=1,
+        default=[1080],
+        dest='height',
+        help='height of the screen area to capture'
+    )
+    parser.add_argument(
+        '-e', '--encoder',
+        type=str,
+        nargs=1,
+        dest='encoder',
+        default=[MonolithicRecorder.ENCODERS[0]],
+        choices=MonolithicRecorder.ENCODERS,
+        help='video encoder to use'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        nargs=1,
+        dest='profile',
+        default=[None],
+        choices=available_profiles,
+        help='encoder profile, trades quality for latency'
+    )
+    parser.add_argument(
+        '-a', '--audio-device',
+        type=str,
+        nargs=1,
+        dest='device',
+        default=[None],
+        help='audio device to capture'
+    )
+    parser.add_argument(
+        'filename',
+        nargs=1,
+        type=str,
+        help='output file'
+    )
+    args = parser.parse_args()
+
+    main(
+        filename=args.filename[0],
+        display=args.display[0],
+        width=args.width[0],
+        height=args.height[0],
+        encoder=args.encoder[0],
+        profile=args.profile[0],
+        device=args.device[0]
+    )
@@ -0,0 +1,149 @@
+import time
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst
+
+# Steps from the configured quality down to the cheapest one, relative to what the
+# recording was started with. Presets only apply to encoders that can change them
+# while playing, bitrate, frame rate and size work everywhere.
+quality_levels = [
+    { 'bitrate': 1.0, 'fps': 1.0, 'scale': 1.0, 'preset': None },
+    { 'bitrate': 0.75, 'fps': 1.0, 'scale': 1.0, 'preset': 'superfast' },
+    { 'bitrate': 0.6, 'fps': 0.67, 'scale': 1.0, 'preset': 'superfast' },
+    { 'bitrate': 0.5, 'fps': 0.67, 'scale': 0.75, 'preset': 'ultrafast' },
+    { 'bitrate': 0.35, 'fps': 0.5, 'scale': 0.5, 'preset': 'ultrafast' },
+]
+
+
+def mutable_property(element, name):
+    # only touch properties the element accepts in PLAYING
+    spec = element.find_property(name)
+    return spec is not None and bool(spec.flags & Gst.PARAM_MUTABLE_PLAYING)
+
+
+# Closed loop over the telemetry of a recording: steps the quality down when the queue
+# in front of the encoder fills up or the encoder falls behind, and back up once there
+# is headroom again. Stepping down needs a few loaded records in a row, stepping up
+# many calm ones and a cool down after every change, so it does not oscillate.
+class QualityController:
+    DOWN_AFTER = 2  # loaded records in a row
+    UP_AFTER = 10  # calm records in a row
+    COOLDOWN = 5  # seconds after a change before the next one
+    LOADED_FILL = 0.5
+    CALM_FILL = 0.1
+    LATENCY_MARGIN = 1.5  # encoder latency over the best seen that counts as falling behind
+
+    def __init__(self, pipeline, width, height, fps, on_decision=None):
+        self.pipeline = pipeline
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.on_decision = on_decision
+        self.level = 0
+        self.loaded = 0
+        self.calm = 0
+        self.last_change = 0
+        self.best_latency = None
+
+        self.encoder = pipeline.get_by_name('video_encoder')
+        self.rate_filter = pipeline.get_by_name('rate_filter')
+        self.scale_filter = pipeline.get_by_name('scale_filter')
+        self.scale_format = None
+        if self.scale_filter:
+            # the filter also fixes the encoder format, keep it when resizing
+            structure = self.scale_filter.get_property('caps').get_structure(0)
+            self.scale_format = structure.get_string('format')
+        self.videorate = None
+        for element in pipeline.iterate_recurse():
+            factory = element.get_factory()
+            if factory and factory.get_name() == 'videorate':
+                self.videorate = element
+
+        self.bitrate = None
+        if self.encoder and mutable_property(self.encoder, 'bitrate'):
+            self.bitrate = self.encoder.get_property('bitrate')
+        self.base_bitrate = self.bitrate
+        self.preset = None
+        if self.encoder and mutable_property(self.encoder, 'speed-preset'):
+            value = self.encoder.get_property('speed-preset')
+            self.preset = getattr(value, 'value_nick', value)
+
+    def rebase(self, fps=None, bitrate_factor=1.0):
+        # the content changed what full quality means, e.g. screen content needs less;
+        # the current level is applied on top of the new base
+        if fps:
+            self.fps = fps
+        if self.bitrate:
+            self.bitrate = int(self.base_bitrate * bitrate_factor)
+        self.set_level(self.level, 'content changed')
+
+    def update(self, stats):
+        # called with every telemetry record
+        latency = stats['encoder_latency']
+        if latency is not None and (self.best_latency is None or latency < self.best_latency):
+            self.best_latency = latency
+        behind = latency is not None and self.best_latency is not None \
+            and latency > self.best_latency * QualityController.LATENCY_MARGIN + 100
+
+        if stats['queue_fill'] > QualityController.LOADED_FILL or behind:
+            self.loaded += 1
+            self.calm = 0
+        elif stats['queue_fill'] < QualityController.CALM_FILL and not behind:
+            self.calm += 1
+            self.loaded = 0
+        else:
+            self.loaded = 0
+            self.calm = 0
+
+        if time.monotonic() - self.last_change < QualityController.COOLDOWN:
+            return
+        if self.loaded >= QualityController.DOWN_AFTER and self.level < len(quality_levels) - 1:
+            reason = 'queue {:.0%}, encoder {} ms'.format(
+                stats['queue_fill'], '{:.0f}'.format(latency) if latency is not None else '-'
+            )
+            self.set_level(self.level + 1, reason)
+        elif self.calm >= QualityController.UP_AFTER and self.level > 0:
+            self.set_level(self.level - 1, 'headroom for {} s'.format(self.calm))
+
+    def set_level(self, level, reason):
+        step = quality_levels[level]
+        self.level = level
+        self.loaded = 0
+        self.calm = 0
+        self.last_change = time.monotonic()
+
+        decision = { 'level': level, 'reason': reason }
+        if self.bitrate:
+            decision['bitrate'] = int(self.bitrate * step['bitrate'])
+            self.encoder.set_property('bitrate', decision['bitrate'])
+        if self.preset is not None:
+            decision['preset'] = step['preset'] if step['preset'] else self.preset
+            Gst.util_set_object_arg(self.encoder, 'speed-preset', decision['preset'])
+
+        decision['fps'] = max(1, int(round(self.fps * step['fps'])))
+        if self.rate_filter:
+            caps = Gst.Caps.from_string('video/x-raw,framerate={}/1'.format(decision['fps']))
+            self.rate_filter.set_property('caps', caps)
+        elif self.videorate:
+            # variable frame rate, only the upper limit can move
+            self.videorate.set_property('max-rate', decision['fps'])
+
+        if self.scale_filter:
+            # even sizes, the encoders want them for 4:2:0
+            decision['width'] = int(self.width * step['scale']) // 2 * 2
+            decision['height'] = int(self.height * step['scale']) // 2 * 2
+            cap_string = 'video/x-raw,width={},height={}'.format(decision['width'], decision['height'])
+            if self.scale_format:
+                cap_string += ',format={}'.format(self.scale_format)
+            caps = Gst.Caps.from_string(cap_string)
+            self.scale_filter.set_property('caps', caps)
+
+        print('Quality level {}: {}'.format(level, decision))
+        if self.on_decision:
+            self.on_decision(decision)
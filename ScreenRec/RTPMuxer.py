@@ -1,6 +1,8 @@
 import argparse
 import os, subprocess
 import threading
+from collections import deque
+from datetime import datetime
 
 # gi is GObject instrospection
 import gi
@@ -9,16 +11,33 @@ import gi
 gi.require_version('Gst', '1.0')
 
 # Import GStreamer
-from gi.repository import Gst, GObject
+from gi.repository import Gst, GObject, GLib
 
 from ScreenRec.IPC import IPCWatcher
-from ScreenRec.AudioEncoder import available_encoders
+from ScreenRec.Telemetry import PipelineStats
+from ScreenRec.Latency import StartLatencyProbe
+from ScreenRec.AudioEncoder import available_encoders, get_audio_encoder
+from ScreenRec.Transport import available_transports, make_shm_src, shm_audio_caps, shm_video_caps
+from ScreenRec.ReplayBuffer import ReplayBuffer
+from ScreenRec.FrameGate import KeyframeGate
+
+available_output_modes = [
+    'file',       # write everything to one file
+    'replay',     # keep the last minutes in memory, write them out on request
+    'segmented'   # rolling files split at keyframes by duration or size
+]
 
 class RTPMuxer:
 
     AUDIO_ENCODERS = available_encoders
-
-    def __init__(self, mainloop=None, audio_port=7654, video_port=7655, audio_delay=1150, audio_codec=None, audio_bitrate=128, **kwargs):
+    TRANSPORTS = available_transports
+    OUTPUT_MODES = available_output_modes
+
+    def __init__(self, mainloop=None, audio_port=7654, video_port=7655, audio_delay=1150, audio_codec=None, audio_bitrate=128,
+                 transport='udp', audio_socket=None, video_socket=None,
+                 output_mode='file', replay_budget=512,
+                 segment_duration=600, segment_size=0, segment_retention=0,
+                 segment_start=0, segments=None, **kwargs):
         self.id = 'muxer'
         self.mainloop = mainloop
 
@@ -26,15 +45,164 @@ class RTPMuxer:
             self.comm = IPCWatcher(kwargs['comm_queues'], self)
             self.comm.start()
 
+        self.transport = transport
         self.audio_port = audio_port
         self.video_port = video_port
+        self.audio_socket = audio_socket
+        self.video_socket = video_socket
         self.audio_delay = audio_delay
         self.audio_codec = audio_codec if audio_codec else RTPMuxer.AUDIO_ENCODERS[0]
         self.audio_bitrate = audio_bitrate
+        self.output_mode = output_mode
+        self.replay_budget = replay_budget
+        self.replay = None
+        self.segment_duration = segment_duration
+        self.segment_size = segment_size
+        self.segment_retention = segment_retention
+        # a restarted muxer continues the numbering and the retention of the one before
+        self.segment_start = segment_start
+        self.segments = deque(segments if segments else [])
+        self.audio_jitterbuffer = None
+        self.audio_offset_pad = None
+        self.sink = None
+        self.filename = None
+        self.stats = None
+        self.keyframe_gate = None
+        self.video_parser = None
         self.build_gst_pipeline()
 
     def build_gst_pipeline(self):
+        # assemble pipeline
+        self.pipeline = Gst.Pipeline.new('playback')
+        self.pipeline.use_clock(Gst.SystemClock.obtain())
+
+        if self.transport == 'shm':
+            audio_out, video_out = self.build_shm_sources()
+        else:
+            audio_out, video_out = self.build_rtp_sources()
+
+        audio_queue = Gst.ElementFactory.make('queue')
+        audio_queue.set_property('max-size-buffers', 200)
+        audio_queue.set_property('max-size-bytes', 104857600)  # 10 MB
+        audio_queue.set_property('max-size-time', 10000000000)  # 10 sec
+
+        video_parser = Gst.ElementFactory.make('h264parse')
+        video_queue = Gst.ElementFactory.make('queue')
+        video_queue.set_property('max-size-buffers', 200)
+        video_queue.set_property('max-size-bytes', 104857600)  # 10 MB
+        video_queue.set_property('max-size-time', 10000000000)  # 10 sec
+
+        self.pipeline.add(audio_queue)
+        self.pipeline.add(video_parser)
+        self.pipeline.add(video_queue)
+        audio_out.link(audio_queue)
+        video_out.link(video_parser)
+        video_parser.link(video_queue)
+
+        # the senders may have started before we listened, start the file with a keyframe
+        self.video_parser = video_parser
+        self.resync()
+
+        # audio encoder
+
+        encoder = get_audio_encoder(self.audio_codec, self.audio_bitrate)
+
+        audio_convert = Gst.ElementFactory.make('audioconvert')
+
+        self.pipeline.add(audio_convert)
+        self.pipeline.add(encoder)
+        audio_queue.link(audio_convert)
+        audio_convert.link(encoder)
+
+        if self.output_mode == 'replay':
+            self.build_replay_output(encoder, video_queue)
+        elif self.output_mode == 'segmented':
+            self.build_segmented_output(encoder, video_queue)
+        else:
+            self.build_file_output(encoder, video_queue)
 
+        self.create_bus()
+
+    def build_file_output(self, audio_out, video_out):
+        # muxer = Gst.ElementFactory.make('matroskamux')
+        muxer = Gst.ElementFactory.make('mpegtsmux')
+        self.pipeline.add(muxer)
+
+        # audio_pad = muxer.get_request_pad('audio_%u')
+        # video_pad = muxer.get_request_pad('video_%u')
+        audio_pad = muxer.get_request_pad('sink_%d')
+        video_pad = muxer.get_request_pad('sink_%d')
+        self.sink = Gst.ElementFactory.make('filesink')
+        self.sink.set_property('sync', True)
+        self.pipeline.add(self.sink)
+
+        # add remaining parts
+        Gst.Element.link_pads(audio_out, 'src', muxer, audio_pad.get_name())
+        Gst.Element.link_pads(video_out, 'src', muxer, video_pad.get_name())
+
+        muxer.link(self.sink)
+
+    def build_replay_output(self, audio_out, video_out):
+        # keep the encoded streams in memory, they are only muxed when saved
+        video_sink = Gst.ElementFactory.make('appsink', 'replay_video')
+        # stored as mpegtsmux takes it when the replay is saved, the parser converts
+        video_sink.set_property('caps', Gst.Caps.from_string('video/x-h264,stream-format=byte-stream,alignment=au'))
+        audio_sink = Gst.ElementFactory.make('appsink', 'replay_audio')
+        self.pipeline.add(video_sink)
+        self.pipeline.add(audio_sink)
+
+        audio_out.link(audio_sink)
+        video_out.link(video_sink)
+
+        self.replay = ReplayBuffer(budget=self.replay_budget * 1024 * 1024)
+        self.replay.attach(video_sink, audio_sink)
+
+    def build_segmented_output(self, audio_out, video_out):
+        # splitmuxsink starts a new file at the first keyframe after a limit is reached,
+        # so every segment starts with a decodable frame and is playable once closed
+        splitter = Gst.ElementFactory.make('splitmuxsink')
+        splitter.set_property('muxer', Gst.ElementFactory.make('mpegtsmux'))
+        splitter.set_property('max-size-time', self.segment_duration * Gst.SECOND)
+        splitter.set_property('max-size-bytes', self.segment_size * 1024 * 1024)
+        splitter.connect('format-location', self.on_format_location)
+        self.pipeline.add(splitter)
+
+        audio_pad = splitter.get_request_pad('audio_%u')
+        video_pad = splitter.get_request_pad('video')
+        Gst.Element.link_pads(audio_out, 'src', splitter, audio_pad.get_name())
+        Gst.Element.link_pads(video_out, 'src', splitter, video_pad.get_name())
+
+    def on_format_location(self, splitter, fragment_id):
+        # the filename template is formatted when the segment starts, the index
+        # keeps the names unique if segments are shorter than the template resolution
+        base, ext = os.path.splitext(os.path.expanduser(datetime.now().strftime(self.filename)))
+        index = self.segment_start + fragment_id
+        path = '{}-{:05d}{}'.format(base, index, ext)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.segments.append(path)
+        if self.segment_retention > 0:
+            # the oldest segments are closed already, the new one is not yet open
+            while len(self.segments) > self.segment_retention:
+                old = self.segments.popleft()
+                try:
+                    os.remove(old)
+                    print('Removed old segment {}'.format(old))
+                except OSError as e:
+                    print('Could not remove old segment {}: {}'.format(old, e))
+
+        if getattr(self, 'comm', None):
+            # the supervisor hands this on if it has to restart us
+            self.comm.outQueue.put({
+                'segments': { 'id': self.id, 'next': index + 1, 'paths': list(self.segments) }
+            })
+        print('Recording segment {}'.format(path))
+        return path
+
+    def build_rtp_sources(self):
         audio_src = Gst.ElementFactory.make('udpsrc', 'audiosrc')
         audio_src.set_property('port', self.audio_port)
         audio_src.set_property('reuse', True)
@@ -50,15 +218,10 @@ class RTPMuxer:
 
         audio_jitterbuffer = Gst.ElementFactory.make('rtpjitterbuffer')
         audio_jitterbuffer.set_property('latency', 2000)
-        print(self.audio_delay)
-        if self.audio_delay != 0:
-            audio_jitterbuffer.set_property('ts-offset', self.audio_delay * 1000000)
+        self.audio_jitterbuffer = audio_jitterbuffer
+        self.set_audio_delay(self.audio_delay)
 
         audio_depay = Gst.ElementFactory.make(depayloader)
-        audio_queue = Gst.ElementFactory.make('queue')
-        audio_queue.set_property('max-size-buffers', 200)
-        audio_queue.set_property('max-size-bytes', 104857600)  # 10 MB
-        audio_queue.set_property('max-size-time', 10000000000)  # 10 sec
 
         video_src = Gst.ElementFactory.make('udpsrc', 'videosrc')
         video_src.set_property('port', self.video_port)
@@ -75,87 +238,37 @@ class RTPMuxer:
         video_jitterbuffer.set_property('latency', 2000)
 
         video_depay = Gst.ElementFactory.make('rtph264depay')
-        video_parser = Gst.ElementFactory.make('h264parse')
-        video_queue = Gst.ElementFactory.make('queue')
-        video_queue.set_property('max-size-buffers', 200)
-        video_queue.set_property('max-size-bytes', 104857600)  # 10 MB
-        video_queue.set_property('max-size-time', 10000000000)  # 10 sec
 
-        # assemble pipeline
-        self.pipeline = Gst.Pipeline.new('playback')
-        self.pipeline.use_clock(Gst.SystemClock.obtain())
         self.pipeline.add(audio_src)
         self.pipeline.add(audio_filter)
         self.pipeline.add(audio_jitterbuffer)
         self.pipeline.add(audio_depay)
-        self.pipeline.add(audio_queue)
         self.pipeline.add(video_src)
         self.pipeline.add(video_filter)
         self.pipeline.add(video_jitterbuffer)
         self.pipeline.add(video_depay)
-        self.pipeline.add(video_parser)
-        self.pipeline.add(video_queue)
         audio_src.link(audio_filter)
         audio_filter.link(audio_jitterbuffer)
         audio_jitterbuffer.link(audio_depay)
-        audio_depay.link(audio_queue)
         video_src.link(video_filter)
         video_filter.link(video_jitterbuffer)
         video_jitterbuffer.link(video_depay)
-        video_depay.link(video_parser)
-        video_parser.link(video_queue)
 
-        # muxer = Gst.ElementFactory.make('matroskamux')
-        muxer = Gst.ElementFactory.make('mpegtsmux')
-        self.pipeline.add(muxer)
+        return audio_depay, video_depay
 
-        # audio_pad = muxer.get_request_pad('audio_%u')
-        # video_pad = muxer.get_request_pad('video_%u')
-        audio_pad = muxer.get_request_pad('sink_%d')
-        video_pad = muxer.get_request_pad('sink_%d')
-        self.sink = Gst.ElementFactory.make('filesink')
-        self.sink.set_property('sync', True)
-        self.pipeline.add(self.sink)
-
-        # audio encoder
+    def build_shm_sources(self):
+        # no packetization and no jitterbuffer, the buffers are timestamped when they
+        # arrive and the A/V delay is applied as a pad offset
+        audio_src, self.audio_shmsrc = make_shm_src(self.audio_socket, shm_audio_caps)
+        video_src, self.video_shmsrc = make_shm_src(self.video_socket, shm_video_caps)
 
-        # build encoding pipelines
-        # FIXME: get from AudioEncoder.py
-        encoder = None
-        if self.audio_codec == 'aac':
-            encoder = Gst.ElementFactory.make('faac')
-            encoder.set_property('bitrate', self.audio_bitrate * 1000)
-        elif self.audio_codec == 'mp3':
-            encoder = Gst.ElementFactory.make('lamemp3enc')
-            encoder.set_property('bitrate', self.audio_bitrate)
-            encoder.set_property('cbr', True)
-        elif self.audio_codec == 'opus':
-            encoder = Gst.ElementFactory.make('opusenc')
-            encoder.set_property('bitrate', self.audio_bitrate * 1000)
-            encoder.set_property('bitrate-type', 0)  # cbr
-        elif self.audio_codec == 'speex':
-            encoder = Gst.ElementFactory.make('speexenc')
-            encoder.set_property('bitrate', self.audio_bitrate * 1000)
-            encoder.set_property('abr', True)
-        elif self.audio_codec == 'vorbis':
-            encoder = Gst.ElementFactory.make('vorbisenc')
-            encoder.set_property('bitrate', self.audio_bitrate * 1000)
-            encoder.set_property('managed', True)
+        self.audio_offset_pad = audio_src.get_static_pad('src')
+        self.set_audio_delay(self.audio_delay)
 
-        audio_convert = Gst.ElementFactory.make('audioconvert')
-
-        self.pipeline.add(audio_convert)
-        self.pipeline.add(encoder)
-        audio_queue.link(audio_convert)
-        audio_convert.link(encoder)
-
-        # add remaining parts
-        Gst.Element.link_pads(encoder, 'src', muxer, audio_pad.get_name())
-        Gst.Element.link_pads(video_queue, 'src', muxer, video_pad.get_name())
-
-        muxer.link(self.sink)
+        self.pipeline.add(audio_src)
+        self.pipeline.add(video_src)
 
-        self.create_bus()
+        return audio_src, video_src
 
     def create_bus(self):
         # create a bus
@@ -166,6 +279,9 @@ class RTPMuxer:
 
         # on message print errors
         self.bus.connect('message', self.on_message)
+        if getattr(self, 'comm', None):
+            # the supervisor waits for our state changes
+            self.comm.watch_pipeline(self.bus, self.pipeline)
 
     def on_message(self, bus, message):
         t = message.type
@@ -173,17 +289,123 @@ class RTPMuxer:
         if t == Gst.MessageType.EOS:
             # end of stream, just disable the switch and stop processing
             self.stop()
+        if t == Gst.MessageType.ELEMENT:
+            structure = message.get_structure()
+            if structure and structure.get_name() == 'splitmuxsink-fragment-closed':
+                print('Segment finished: {}'.format(structure.get_string('location')))
         if t == Gst.MessageType.ERROR:
+            if self.transport == 'shm' and message.src in (self.audio_shmsrc, self.video_shmsrc):
+                # the sender went away (e.g. exclusive mode switch), wait for it to come back
+                print('WARNING: ', message.parse_error())
+                self.reconnect(message.src)
+                return
             # some error occured, log and stop
             print('ERROR: ', message.parse_error())
             self.stop()
 
+    def reconnect(self, shmsrc):
+        def try_connect():
+            if not self.pipeline:
+                return False
+            if not os.path.exists(shmsrc.get_property('socket-path')):
+                return True  # call again
+            shmsrc.sync_state_with_parent()
+            return False
+
+        shmsrc.set_state(Gst.State.NULL)
+        GLib.timeout_add(50, try_connect)
+
+    def on_command(self, command):
+        if 'start' in command:
+            self.start_measured(command['start'])
+        if 'pause' in command:
+            self.pause()
+        if 'resume' in command:
+            self.resume()
+        if 'save_replay' in command:
+            self.save_replay(command['save_replay'])
+        if 'audio_delay' in command:
+            self.set_audio_delay(command['audio_delay'])
+        if 'resync' in command and command['resync'] != 'audio_recorder':
+            # the video sender was restarted, continue with its first keyframe
+            self.resync()
+
+    def resync(self):
+        if self.keyframe_gate and self.keyframe_gate.probe:
+            return
+        self.keyframe_gate = KeyframeGate(self.video_parser.get_static_pad('src'), on_waiting=self.request_keyframe)
+
+    def request_keyframe(self):
+        # called from the streaming thread while the keyframe gate drops frames
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'keyframe_needed': self.id })
+
+    def set_audio_delay(self, delay):
+        print('A/V delay: {} ms'.format(delay))
+        self.audio_delay = delay
+        offset = int(delay * 1000000)
+        if self.audio_jitterbuffer:
+            self.audio_jitterbuffer.set_property('ts-offset', offset)
+        if self.audio_offset_pad:
+            self.audio_offset_pad.set_offset(offset)
+
+    def save_replay(self, seconds):
+        if not self.replay:
+            print('Not recording into a replay buffer, nothing to save')
+            return
+        # the filename is a strftime template in replay mode, every save gets its own file
+        path = datetime.now().strftime(self.filename)
+        self.replay.save(path, seconds)
+
+    def arm(self):
+        # build now, the filesink can only get its location up to READY
+        self.pipeline.set_state(Gst.State.READY)
+
+    def start_measured(self, start):
+        self.start_probe = StartLatencyProbe(self.pipeline, start['clicked'], self.on_started)
+        self.start(path=start.get('filename', None))
+
+    def on_started(self, latency):
+        print('Recording started {:.0f} ms after the click'.format(latency))
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'started': { 'id': self.id, 'latency': latency } })
+
+    def pause(self):
+        # live sources stop producing in PAUSED and the running time stops with
+        # them, so the paused span does not show up in the timestamps
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PLAYING)
+
     def start(self, path='~/output.ts'):
-        path = os.path.expanduser(path)
-        self.sink.set_property('location', path)
-        self.pipeline.set_state(Gst.State.PLAYING)
+        self.filename = path
+        if self.sink:
+            path = os.path.expanduser(path)
+            self.sink.set_property('location', path)
+
+        if self.transport == 'shm':
+            # shmsrc fails if the senders did not create their segments yet
+            def wait_for_senders():
+                if not self.pipeline:
+                    return False
+                if not os.path.exists(self.audio_socket) or not os.path.exists(self.video_socket):
+                    return True  # call again
+                self.pipeline.set_state(Gst.State.PLAYING)
+                return False
+            GLib.timeout_add(50, wait_for_senders)
+        else:
+            self.pipeline.set_state(Gst.State.PLAYING)
+
+        if getattr(self, 'comm', None):
+            # publish pipeline health to the control window
+            self.stats = PipelineStats(self.id, self.pipeline, self.comm.outQueue)
 
     def stop(self):
+        if self.stats:
+            self.stats.stop()
         if self.pipeline:
             eos = Gst.Event.new_eos()
             self.pipeline.send_event(eos)
@@ -205,7 +427,15 @@ def main(**kwargs):
 
     # Start screen recorder
     recorder = RTPMuxer(mainloop=mainloop, **kwargs)
-    recorder.start(path=kwargs['filename'])
+    if kwargs.get('armed', False):
+        # wait for the start command, it brings the final filename
+        recorder.arm()
+    else:
+        recorder.start(path=kwargs['filename'])
+
+    if kwargs.get('clicked') is not None and not kwargs.get('armed', False):
+        # cold start, measured the same way for comparison
+        recorder.start_probe = StartLatencyProbe(recorder.pipeline, kwargs['clicked'], recorder.on_started)
 
     # run the main loop
     try:
@@ -258,18 +488,92 @@ if __name__ == "__main__":
         default=[7655],
         help='video port to listen on'
     )
+    parser.add_argument(
+        '-t', '--transport',
+        type=str,
+        nargs=1,
+        dest='transport',
+        default=['udp'],
+        choices=RTPMuxer.TRANSPORTS,
+        help='how the recorders deliver their data'
+    )
+    parser.add_argument(
+        '--audio-socket',
+        type=str,
+        nargs=1,
+        dest='audio_socket',
+        default=[None],
+        help='shared memory control socket of the audio recorder'
+    )
+    parser.add_argument(
+        '--video-socket',
+        type=str,
+        nargs=1,
+        dest='video_socket',
+        default=[None],
+        help='shared memory control socket of the screen recorder'
+    )
+    parser.add_argument(
+        '-o', '--output-mode',
+        type=str,
+        nargs=1,
+        dest='output_mode',
+        default=['file'],
+        choices=RTPMuxer.OUTPUT_MODES,
+        help='write to file or keep a replay buffer in memory'
+    )
+    parser.add_argument(
+        '--replay-budget',
+        type=int,
+        nargs=1,
+        dest='replay_budget',
+        default=[512],
+        help='maximum size of the replay buffer in megabytes'
+    )
+    parser.add_argument(
+        '--segment-duration',
+        type=int,
+        nargs=1,
+        dest='segment_duration',
+        default=[600],
+        help='start a new segment after this many seconds, 0 for no limit'
+    )
+    parser.add_argument(
+        '--segment-size',
+        type=int,
+        nargs=1,
+        dest='segment_size',
+        default=[0],
+        help='start a new segment after this many megabytes, 0 for no limit'
+    )
+    parser.add_argument(
+        '--segment-retention',
+        type=int,
+        nargs=1,
+        dest='segment_retention',
+        default=[0],
+        help='only keep this many segments, 0 to keep all'
+    )
     parser.add_argument(
         'filename',
         nargs=1,
         type=str,
-        help='output file'
+        help='output file, strftime template for saved replays and segments in replay or segmented mode'
     )
     args = parser.parse_args()
 
     main(
         filename=args.filename[0],
+        output_mode=args.output_mode[0],
+        replay_budget=args.replay_budget[0],
+        segment_duration=args.segment_duration[0],
+        segment_size=args.segment_size[0],
+        segment_retention=args.segment_retention[0],
+        transport=args.transport[0],
         audio_port=args.audio_port[0],
         video_port=args.video_port[0],
+        audio_socket=args.audio_socket[0],
+        video_socket=args.video_socket[0],
         audio_codec=args.audio_codec[0],
         audio_bitrate=args.audio_bitrate[0],
         audio_delay=args.audio_delay[0]
@@ -0,0 +1,186 @@
+import os
+import threading
+from collections import deque
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst
+
+
+# One group of pictures: a keyframe, the frames depending on it and the audio
+# that arrived while it was the newest GOP. GOPs are only ever evicted as a whole
+# so the buffer always starts with a decodable frame.
+class GOP:
+
+    def __init__(self, pts):
+        self.pts = pts
+        self.video = []
+        self.audio = []
+        self.size = 0
+
+    def add(self, track, buffer):
+        track.append(buffer)
+        self.size += len(buffer[3])
+
+    def copy(self):
+        # the newest GOP keeps growing on the streaming thread, take it as it is now
+        gop = GOP(self.pts)
+        gop.video = list(self.video)
+        gop.audio = list(self.audio)
+        gop.size = self.size
+        return gop
+
+
+# Bounded in-memory ring buffer of encoded H.264 and audio buffers
+class ReplayBuffer:
+
+    def __init__(self, budget=512 * 1024 * 1024):
+        self.budget = budget
+        self.gops = deque()
+        self.size = 0
+        self.video_caps = None
+        self.audio_caps = None
+        self.lock = threading.Lock()
+
+    def attach(self, video_sink, audio_sink):
+        # appsinks at the end of the video and audio branches of the muxer pipeline
+        video_sink.set_property('emit-signals', True)
+        video_sink.set_property('sync', False)
+        video_sink.connect('new-sample', self.on_video_sample)
+
+        audio_sink.set_property('emit-signals', True)
+        audio_sink.set_property('sync', False)
+        audio_sink.connect('new-sample', self.on_audio_sample)
+
+    def on_video_sample(self, sink):
+        sample = sink.emit('pull-sample')
+        buffer = sample.get_buffer()
+        self.video_caps = sample.get_caps()
+
+        keyframe = not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        with self.lock:
+            if keyframe:
+                self.gops.append(GOP(buffer.pts))
+            if self.gops:
+                self.add(self.gops[-1].video, buffer)
+                self.evict()
+        return Gst.FlowReturn.OK
+
+    def on_audio_sample(self, sink):
+        sample = sink.emit('pull-sample')
+        buffer = sample.get_buffer()
+        self.audio_caps = sample.get_caps()
+
+        with self.lock:
+            # audio before the first keyframe could not be played back anyway
+            if self.gops:
+                self.add(self.gops[-1].audio, buffer)
+                self.evict()
+        return Gst.FlowReturn.OK
+
+    def add(self, track, buffer):
+        data = buffer.extract_dup(0, buffer.get_size())
+        entry = (buffer.pts, buffer.dts, buffer.duration, data, buffer.get_flags())
+        self.gops[-1].add(track, entry)
+        self.size += len(data)
+
+    def evict(self):
+        # drop the oldest GOPs until we are in budget again, always keep the current one
+        while self.size > self.budget and len(self.gops) > 1:
+            gop = self.gops.popleft()
+            self.size -= gop.size
+
+    def snapshot(self, seconds):
+        with self.lock:
+            if not self.gops:
+                return []
+            gops = [gop.copy() for gop in self.gops]
+
+        # newest timestamp we know of, then walk back to the GOP that covers the range
+        end = max([gops[-1].pts] + [entry[0] for entry in gops[-1].video if entry[0] != Gst.CLOCK_TIME_NONE])
+        start = end - seconds * Gst.SECOND
+        first = 0
+        for index, gop in enumerate(gops):
+            if gop.pts <= start:
+                first = index
+        return gops[first:]
+
+    def save(self, path, seconds):
+        gops = self.snapshot(seconds)
+        if not gops or not self.video_caps:
+            print('Replay buffer empty, nothing to save')
+            return None
+
+        thread = threading.Thread(target=self.write, args=(os.path.expanduser(path), gops))
+        thread.start()
+        return thread
+
+    def write(self, path, gops):
+        # mux the snapshot into a file with a short-lived pipeline, the capture continues
+        pipeline = Gst.Pipeline.new('replay')
+
+        video_src = Gst.ElementFactory.make('appsrc')
+        video_src.set_property('caps', self.video_caps)
+        video_src.set_property('format', Gst.Format.TIME)
+        video_src.set_property('max-bytes', 0)  # unlimited, we push everything up front
+
+        muxer = Gst.ElementFactory.make('mpegtsmux')
+        sink = Gst.ElementFactory.make('filesink')
+        sink.set_property('location', path)
+
+        pipeline.add(video_src)
+        pipeline.add(muxer)
+        pipeline.add(sink)
+        video_src.link(muxer)
+        muxer.link(sink)
+
+        audio_src = None
+        if self.audio_caps and any(gop.audio for gop in gops):
+            audio_src = Gst.ElementFactory.make('appsrc')
+            audio_src.set_property('caps', self.audio_caps)
+            audio_src.set_property('format', Gst.Format.TIME)
+            audio_src.set_property('max-bytes', 0)
+            pipeline.add(audio_src)
+            audio_src.link(muxer)
+
+        pipeline.set_state(Gst.State.PLAYING)
+
+        # with b-frames the first frames decode before the keyframe is shown, shift
+        # pts and dts alike so neither goes negative
+        start = gops[0].pts
+        offset = min([start] + [entry[1] for entry in gops[0].video if entry[1] != Gst.CLOCK_TIME_NONE])
+        for gop in gops:
+            self.push(video_src, gop.video, start, offset)
+            if audio_src:
+                self.push(audio_src, gop.audio, start, offset)
+        video_src.emit('end-of-stream')
+        if audio_src:
+            audio_src.emit('end-of-stream')
+
+        bus = pipeline.get_bus()
+        message = bus.timed_pop_filtered(
+            Gst.CLOCK_TIME_NONE,
+            Gst.MessageType.EOS | Gst.MessageType.ERROR
+        )
+        if message.type == Gst.MessageType.ERROR:
+            print('ERROR: ', message.parse_error())
+        else:
+            print('Saved replay to {}'.format(path))
+        pipeline.set_state(Gst.State.NULL)
+
+    def push(self, src, entries, start, offset):
+        for pts, dts, duration, data, flags in entries:
+            # audio from the first GOP may predate its keyframe, it is of no use
+            if pts != Gst.CLOCK_TIME_NONE and pts < start:
+                continue
+            buffer = Gst.Buffer.new_wrapped(data)
+            buffer.pts = pts - offset if pts != Gst.CLOCK_TIME_NONE else pts
+            buffer.dts = dts - offset if dts != Gst.CLOCK_TIME_NONE and dts >= offset else Gst.CLOCK_TIME_NONE
+            buffer.duration = duration
+            buffer.set_flags(flags)
+            src.emit('push-buffer', buffer)
@@ -15,15 +15,76 @@ gi.require_version('GstRtsp', '1.0')
 from gi.repository import Gst, GObject, GstNet, GstRtsp, GLib
 
 from ScreenRec.IPC import IPCWatcher
-from ScreenRec.VideoEncoder import available_encoders, encoder_delay, get_recording_sink
+from ScreenRec.Telemetry import PipelineStats
+from ScreenRec.VideoEncoder import available_encoders, available_profiles, available_rendition_outputs, encoder_delay, get_recording_sink, parse_rendition, rendition_path, force_keyframe
+from ScreenRec.FrameGate import DamageGate, available_capture_modes
+from ScreenRec.Latency import EncoderLatencyProbe, StartLatencyProbe
+from ScreenRec.SourceSelector import SourceSelector
+from ScreenRec.QualityController import QualityController
+from ScreenRec.ContentClassifier import ContentClassifier, available_content_modes, content_settings
+
+def x_display_name(display):
+    # screen index on the local X server, or a full display name like ':99' of an Xvfb
+    if isinstance(display, str) and ':' in display:
+        return display
+    return ':0.{}'.format(display)
+
+
+def make_screen_source(display, width, height, use_damage=False, test_source=False, fps=30):
+    src = None
+
+    if test_source:
+        # synthetic moving content in the format ximagesrc delivers, for benchmarks
+        src = Gst.Bin.new('source')
+        testsrc = Gst.ElementFactory.make('videotestsrc')
+        testsrc.set_property('is-live', True)
+        Gst.util_set_object_arg(testsrc, 'pattern', 'ball')
+        src.add(testsrc)
+
+        cap_string = 'video/x-raw,format=BGRx,width={},height={},framerate={}/1'.format(width, height, fps)
+        caps = Gst.Caps.from_string(cap_string)
+        filter = Gst.ElementFactory.make('capsfilter')
+        filter.set_property('caps', caps)
+        src.add(filter)
+        testsrc.link(filter)
+
+        ghost_src = Gst.GhostPad.new('src', filter.get_static_pad('src'))
+        src.add_pad(ghost_src)
+        return src
+    elif platform.system() == 'Linux':
+        src = Gst.ElementFactory.make('ximagesrc', 'source')
+        src.set_property('display-name', x_display_name(display))
+        src.set_property('use-damage', use_damage)
+        src.set_property('startx', 0)
+        src.set_property('starty', 0)
+        src.set_property('endx', width - 1)
+        src.set_property('endy', height - 1)
+    elif platform.system() == 'Darwin':
+        src = Gst.ElementFactory.make('avfvideosrc', 'source')
+        src.set_property('capture-screen', True)
+        src.set_property('capture-screen-cursor', True)
+        src.set_property('device-index', int(display))
+    elif platform.system() == 'Windows':
+        src = Gst.ElementFactory.make('dx9screencapsrc', 'source')
+        src.set_property('x', 0)
+        src.set_property('y', 0)
+        src.set_property('width', width - 1)
+        src.set_property('height', height - 1)
+        src.set_property('monitor', int(display))
+    src.set_property('do-timestamp', True)
+
+    return src
+
 
 class ScreenRecorder:
 
     ENCODERS = available_encoders
     ENCODER_DELAY = encoder_delay
+    CAPTURE_MODES = available_capture_modes
+    LATENCY_DRIFT_THRESHOLD = 100  # ms
 
     def __init__(self, mainloop=None, **kwargs):
-        self.id = 'screen_recorder'
+        self.id = kwargs.get('id', 'screen_recorder')
         self.mainloop = mainloop
         from ScreenRec.model.configfile import config
 
@@ -40,35 +101,41 @@ class ScreenRecorder:
         if not self.encoder:
             self.encoder = ScreenRecorder.ENCODERS[0]
         self.display = kwargs.get('display', config.rec_settings.screen)
+        self.capture_mode = kwargs.get('capture_mode', config.rec_settings.capture_mode)
+        self.min_refresh = kwargs.get('min_refresh', config.rec_settings.min_refresh)
+        self.gate = None
         self.port = kwargs.get('port', None)
+        self.socket_path = kwargs.get('socket_path', None)
+        self.audio_delay = kwargs.get('audio_delay', None)
+        self.test_source = kwargs.get('test_source', False)
+        self.preset = kwargs.get('preset', None)
+        self.profile = kwargs.get('profile', config.rec_settings.profile)
+        self.renditions = kwargs.get('renditions', None)
+        self.rendition_output = kwargs.get('rendition_output', available_rendition_outputs[0])
+        self.switching = kwargs.get('switching', False)
+        self.adaptive = kwargs.get('adaptive', False)
+        self.controller = None
+        self.content_mode = kwargs.get('content_mode', None)
+        if not self.content_mode:
+            self.content_mode = config.rec_settings.content_mode
+        self.classifier = None
+        self.selector = None
+        self.latency_probe = None
+        self.stats = None
 
         self.build_gst_pipeline(self.encoder)
 
     def build_gst_pipeline(self, encoding_method):
         # display src
-        src = None
-
-        if platform.system() == 'Linux':
-            src = Gst.ElementFactory.make('ximagesrc', 'source')
-            src.set_property('display-name', ':0.{}'.format(self.display))
-            src.set_property('use-damage', 0)
-            src.set_property('startx', 0)
-            src.set_property('starty', 0)
-            src.set_property('endx', self.width - 1)
-            src.set_property('endy', self.height - 1)
-        elif platform.system() == 'Darwin':
-            src = Gst.ElementFactory.make('avfvideosrc', 'source')
-            src.set_property('capture-screen', True)
-            src.set_property('capture-screen-cursor', True)
-            src.set_property('device-index', self.display)
-        elif platform.system() == 'Windows':
-            src = Gst.ElementFactory.make('dx9screencapsrc', 'source')
-            src.set_property('x', 0)
-            src.set_property('y', 0)
-            src.set_property('width', self.width - 1)
-            src.set_property('height', self.height - 1)
-            src.set_property('monitor', self.display)
-        src.set_property('do-timestamp', True)
+        damage = self.capture_mode == 'damage'
+        src = make_screen_source(
+            self.display, self.width, self.height,
+            use_damage=damage,
+            test_source=self.test_source,
+            fps=self.fps
+        )
+        if damage:
+            self.gate = DamageGate(src.get_static_pad('src'), min_refresh=self.min_refresh)
 
         queue = Gst.ElementFactory.make('queue')
 
@@ -80,19 +147,78 @@ class ScreenRecorder:
         self.pipeline.add(queue)
         src.link(queue)
 
+        video_out = queue
+        if self.switching:
+            # windows can take over the encoder without restarting this process
+            self.selector = SourceSelector(self.pipeline, self.width, self.height)
+            self.selector.add_screen(queue)
+            video_out = self.selector.selector
+
         sink, self.sink = get_recording_sink(
             scale_width=self.scale_width if self.scale_width else self.width,
             scale_height=self.scale_height if self.scale_height else self.height,
             fps=self.fps,
             encoder=self.encoder,
-            port=self.port
+            port=self.port,
+            socket_path=self.socket_path,
+            variable_framerate=damage,
+            preset=self.preset,
+            profile=self.profile,
+            min_refresh=self.min_refresh,
+            content='camera' if self.content_mode == 'camera' else 'screen',
+            renditions=self.renditions,
+            rendition_output=self.rendition_output
         )
 
         self.pipeline.add(sink)
-        queue.link(sink)
+        video_out.link(sink)
+
+        if self.content_mode == 'auto' and not self.renditions:
+            # frame rate and bitrate follow what is on screen, a video playing in a
+            # window needs more of both than a text editor
+            self.classifier = ContentClassifier(
+                sink.get_static_pad('sink'),
+                on_change=lambda content: GLib.idle_add(self.on_content, content)
+            )
+
+        video_encoder = sink.get_by_name('video_encoder')
+        if video_encoder and self.audio_delay is not None:
+            # track encoder latency drift, the muxer delays the audio by that amount
+            self.latency_probe = EncoderLatencyProbe(video_encoder)
+            GLib.timeout_add_seconds(5, self.check_latency)
 
         self.create_bus()
 
+    def check_latency(self):
+        if not self.pipeline:
+            return False
+        latency = self.latency_probe.latency()
+        if latency is not None and abs(latency - self.audio_delay) > ScreenRecorder.LATENCY_DRIFT_THRESHOLD:
+            print('Encoder latency {:.0f} ms, A/V delay is {:.0f} ms'.format(latency, self.audio_delay))
+            self.audio_delay = latency
+            if getattr(self, 'comm', None):
+                self.comm.outQueue.put({ 'encoder_latency': latency })
+        return True  # call again
+
+    def on_command(self, command):
+        if 'start' in command:
+            self.start_measured(command['start'])
+        if 'pause' in command:
+            self.pause()
+        if 'resume' in command:
+            self.resume()
+        if 'keyframe' in command:
+            force_keyframe(self.pipeline)
+        if not self.selector:
+            return
+        if 'add_input' in command:
+            input = command['add_input']
+            self.selector.add_input(input['id'], input['socket_path'], input['caps'])
+        if 'select' in command:
+            self.selector.select(command['select'])
+        if 'remove_input' in command:
+            self.selector.remove_input(command['remove_input'])
+
     def create_bus(self):
         # create a bus
         self.bus = self.pipeline.get_bus()
@@ -102,6 +228,9 @@ class ScreenRecorder:
 
         # on message print errors
         self.bus.connect('message', self.on_message)
+        if getattr(self, 'comm', None):
+            # the supervisor waits for our state changes
+            self.comm.watch_pipeline(self.bus, self.pipeline)
 
     def on_message(self, bus, message):
         t = message.type
@@ -110,16 +239,84 @@ class ScreenRecorder:
             # end of stream, just disable the switch and stop processing
             self.stop()
         if t == Gst.MessageType.ERROR:
+            input = self.selector.input_of(message.src) if self.selector else None
+            if input:
+                # a window feeding us went away, fall back to the screen
+                print('WARNING: ', message.parse_error())
+                self.selector.remove_input(input)
+                return
             # some error occured, log and stop
             print('ERROR: ', message.parse_error())
             self.stop()
 
+    def arm(self):
+        # build and preroll now, recording then only flips to PLAYING
+        self.pipeline.set_state(Gst.State.PAUSED)
+
+    def start_measured(self, start):
+        self.start_probe = StartLatencyProbe(self.pipeline, start['clicked'], self.on_started)
+        self.start(path=start.get('filename', None))
+
+    def on_started(self, latency):
+        print('Recording started {:.0f} ms after the click'.format(latency))
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'started': { 'id': self.id, 'latency': latency } })
+
+    def pause(self):
+        # live sources stop producing in PAUSED and the running time stops with
+        # them, so the paused span does not show up in the timestamps
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PAUSED)
+
+    def resume(self):
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PLAYING)
+            # the first frame after the pause must not reference the ones before it
+            force_keyframe(self.pipeline)
+
     def start(self, path=None):
-        if path:
+        if path and isinstance(self.sink, list):
+            # one file per rendition
+            for rendition, sink in zip(self.renditions, self.sink):
+                sink.set_property('location', rendition_path(path, rendition))
+        elif path:
             self.sink.set_property('location', path)
         self.pipeline.set_state(Gst.State.PLAYING)
+        if (self.adaptive or self.classifier) and not self.renditions:
+            # trade quality for a steady frame rate when the machine gets busy, the
+            # content classifier moves the base the levels apply to
+            self.controller = QualityController(
+                self.pipeline,
+                self.scale_width if self.scale_width else self.width,
+                self.scale_height if self.scale_height else self.height,
+                self.fps,
+                on_decision=self.on_quality
+            )
+        comm = getattr(self, 'comm', None)
+        if comm or self.controller:
+            # publish pipeline health to the control window
+            self.stats = PipelineStats(
+                self.id, self.pipeline, comm.outQueue if comm else None,
+                latency_probe=self.latency_probe,
+                on_collect=self.controller.update if self.adaptive and self.controller else None
+            )
+
+    def on_content(self, content):
+        settings = content_settings[content]
+        fps = max(1, int(round(self.fps * settings['fps'])))
+        if self.controller:
+            self.controller.rebase(fps, settings['bitrate'])
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'content': { 'id': self.id, 'content': content, 'fps': fps } })
+        return False
+
+    def on_quality(self, decision):
+        if getattr(self, 'comm', None):
+            self.comm.outQueue.put({ 'quality': dict(decision, id=self.id) })
 
     def stop(self):
+        if self.stats:
+            self.stats.stop()
         if self.pipeline:
             eos = Gst.Event.new_eos()
             self.pipeline.send_event(eos)
@@ -131,8 +328,8 @@ class ScreenRecorder:
 
 
 def main(**kwargs):
-    if 'filename' not in kwargs and 'port' not in kwargs:
-        raise AttributeError('you have to set filename or port')
+    if 'filename' not in kwargs and 'port' not in kwargs and 'socket_path' not in kwargs:
+        raise AttributeError('you have to set filename, port or socket_path')
 
     from ScreenRec.model.configfile import config
     display = kwargs.get('display', config.rec_settings.screen)
@@ -145,13 +342,21 @@ def main(**kwargs):
     Gst.init(None)
 
     # Start screen recorder
-    if 'filename' in kwargs:
+    if kwargs.get('armed', False):
+        # wait for the start command
+        recorder = ScreenRecorder(mainloop=mainloop, **kwargs)
+        recorder.arm()
+    elif 'filename' in kwargs:
         recorder = ScreenRecorder(mainloop=mainloop, **kwargs)
         recorder.start(path=kwargs['filename'])
     else:
         recorder = ScreenRecorder(mainloop=mainloop, **kwargs)
         recorder.start()
 
+    if kwargs.get('clicked') is not None and not kwargs.get('armed', False):
+        # cold start, measured the same way for comparison
+        recorder.start_probe = StartLatencyProbe(recorder.pipeline, kwargs['clicked'], recorder.on_started)
+
     # run the main loop
     try:
         mainloop.run()
@@ -162,13 +367,28 @@ def main(**kwargs):
 # if run as script start recording
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Record the screen')
+    parser.add_argument(
+        '-q', '--adaptive',
+        action='store_true',
+        dest='adaptive',
+        help='lower bitrate, frame rate and size while the encoder can not keep up'
+    )
+    parser.add_argument(
+        '--content',
+        type=str,
+        nargs=1,
+        dest='content_mode',
+        default=[None],
+        choices=available_content_modes,
+        help='kind of picture to tune the encoder for, auto follows what is on screen'
+    )
     parser.add_argument(
         '-d', '--display',
-        type=int,
+        type=str,
         nargs=1,
-        default=0,
+        default=['0'],
         dest='display',
-        help='display index to capture'
+        help='display index to capture, or an X display name like :99'
     )
     parser.add_argument(
         '-x', '--width',
@@ -211,6 +431,49 @@ if __name__ == "__main__":
         choices=ScreenRecorder.ENCODERS,
         help='encoder to use'
     )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        nargs=1,
+        dest='profile',
+        default=[None],
+        choices=available_profiles,
+        help='encoder profile, trades quality for latency'
+    )
+    parser.add_argument(
+        '-m', '--capture-mode',
+        type=str,
+        nargs=1,
+        dest='capture_mode',
+        default=[ScreenRecorder.CAPTURE_MODES[0]],
+        choices=ScreenRecorder.CAPTURE_MODES,
+        help='grab at a constant rate or only when the screen content changed'
+    )
+    parser.add_argument(
+        '--min-refresh',
+        type=int,
+        nargs=1,
+        dest='min_refresh',
+        default=[1000],
+        help='in damage mode send a frame at least every this many milliseconds'
+    )
+    parser.add_argument(
+        '-r', '--renditions',
+        type=str,
+        nargs='+',
+        dest='renditions',
+        default=None,
+        help='encode several sizes from one capture, WIDTHxHEIGHT[@FPS][:KBITS] each'
+    )
+    parser.add_argument(
+        '--rendition-output',
+        type=str,
+        nargs=1,
+        dest='rendition_output',
+        default=[available_rendition_outputs[0]],
+        choices=available_rendition_outputs,
+        help='write the renditions as tracks of one file or as separate files'
+    )
     parser.add_argument(
         '-p', '--port',
         type=int,
@@ -227,6 +490,10 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
+    renditions = None
+    if args.renditions:
+        renditions = [parse_rendition(r) for r in args.renditions]
+
     if args.filename:
         main(
             filename=args.filename[0],
@@ -235,7 +502,14 @@ if __name__ == "__main__":
             scale_width=args.scaled_width,
             scale_height=args.scaled_height,
             encoder=args.encoder,
-            display=args.display
+            profile=args.profile[0],
+            content_mode=args.content_mode[0],
+            display=args.display[0],
+            capture_mode=args.capture_mode[0],
+            min_refresh=args.min_refresh[0],
+            renditions=renditions,
+            rendition_output=args.rendition_output[0],
+            adaptive=args.adaptive
         )
     else:
         main(
@@ -245,5 +519,12 @@ if __name__ == "__main__":
             scale_width=args.scaled_width,
             scale_height=args.scaled_height,
             encoder=args.encoder,
-            display=args.display
+            profile=args.profile[0],
+            content_mode=args.content_mode[0],
+            display=args.display[0],
+            capture_mode=args.capture_mode[0],
+            min_refresh=args.min_refresh[0],
+            renditions=renditions,
+            rendition_output=args.rendition_output[0],
+            adaptive=args.adaptive
         )
@@ -0,0 +1,138 @@
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst
+
+from ScreenRec.Transport import make_shm_sink, make_shm_src
+from ScreenRec.VideoEncoder import force_keyframe
+
+available_switching_modes = [
+    'respawn',  # exclusive windows encode themselves, the screen recorder is restarted
+    'selector'  # windows feed raw video into the running screen recorder
+]
+
+# raw frames are big, this holds a few 1080p BGRx frames
+feed_shm_size = 64 * 1024 * 1024  # 64 MB
+
+
+def make_feed_sink(socket_path):
+    # attached to a window tee to feed its video into the screen recorder, converted
+    # to the format ximagesrc delivers so the selector only switches sizes
+    feed = Gst.Bin.new('feed')
+
+    queue = Gst.ElementFactory.make('queue')
+    queue.set_property('leaky', 2)  # never stall the window preview
+    convert = Gst.ElementFactory.make('videoconvert')
+    caps = Gst.Caps.from_string('video/x-raw,format=BGRx')
+    filter = Gst.ElementFactory.make('capsfilter')
+    filter.set_property('caps', caps)
+    sink = make_shm_sink(socket_path, feed_shm_size)
+
+    feed.add(queue)
+    feed.add(convert)
+    feed.add(filter)
+    feed.add(sink)
+    queue.link(convert)
+    convert.link(filter)
+    filter.link(sink)
+
+    ghost_sink = Gst.GhostPad.new('sink', queue.get_static_pad('sink'))
+    feed.add_pad(ghost_sink)
+
+    return feed, sink
+
+
+# Input selector in front of the encoder of a running screen recorder. The screen is
+# always input 'screen', windows are added as raw video shared memory inputs. Switching
+# happens on the next frame and the encoder starts a new GOP there.
+class SourceSelector:
+
+    def __init__(self, pipeline, width, height):
+        self.pipeline = pipeline
+        self.width = width
+        self.height = height
+        self.inputs = {}
+
+        self.selector = Gst.ElementFactory.make('input-selector', 'selector')
+        self.pipeline.add(self.selector)
+
+    def add_screen(self, src):
+        pad = self.selector.get_request_pad('sink_%u')
+        src.get_static_pad('src').link(pad)
+        self.inputs['screen'] = (None, pad)
+        self.selector.set_property('active-pad', pad)
+
+    def add_input(self, id, socket_path, caps_string):
+        if id in self.inputs:
+            self.remove_input(id)
+
+        src = Gst.Bin.new('input-{}'.format(id))
+        shm, _ = make_shm_src(socket_path, caps_string)
+        src.add(shm)
+
+        # bring the window to the screen size, with borders to keep its aspect
+        convert = Gst.ElementFactory.make('videoconvert')
+        scaler = Gst.ElementFactory.make('videoscale')
+        scaler.set_property('add-borders', True)
+        cap_string = 'video/x-raw,format=BGRx,width={},height={},pixel-aspect-ratio=1/1'.format(
+            self.width, self.height
+        )
+        caps = Gst.Caps.from_string(cap_string)
+        filter = Gst.ElementFactory.make('capsfilter')
+        filter.set_property('caps', caps)
+        queue = Gst.ElementFactory.make('queue')
+        queue.set_property('leaky', 2)
+
+        src.add(convert)
+        src.add(scaler)
+        src.add(filter)
+        src.add(queue)
+        shm.link(convert)
+        convert.link(scaler)
+        scaler.link(filter)
+        filter.link(queue)
+
+        ghost_src = Gst.GhostPad.new('src', queue.get_static_pad('src'))
+        src.add_pad(ghost_src)
+
+        self.pipeline.add(src)
+        pad = self.selector.get_request_pad('sink_%u')
+        ghost_src.link(pad)
+        src.sync_state_with_parent()
+
+        self.inputs[id] = (src, pad)
+        print('Added input {}'.format(id))
+
+    def remove_input(self, id):
+        if id not in self.inputs or id == 'screen':
+            return
+        src, pad = self.inputs.pop(id)
+        if self.selector.get_property('active-pad') == pad:
+            self.select('screen')
+
+        src.set_state(Gst.State.NULL)
+        src.get_static_pad('src').unlink(pad)
+        self.selector.release_request_pad(pad)
+        self.pipeline.remove(src)
+        print('Removed input {}'.format(id))
+
+    def input_of(self, element):
+        # id of the window input an element belongs to
+        for id, (src, _) in self.inputs.items():
+            if src and (element == src or element.has_as_ancestor(src)):
+                return id
+        return None
+
+    def select(self, id):
+        if id not in self.inputs:
+            print('No input {} to select'.format(id))
+            return
+        _, pad = self.inputs[id]
+        self.selector.set_property('active-pad', pad)
+        # the new picture should not be predicted from the old source
+        force_keyframe(self.pipeline)
+        print('Switched to input {}'.format(id))
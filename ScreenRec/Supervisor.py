@@ -0,0 +1,857 @@
+import importlib
+import itertools
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from time import monotonic
+
+import multiprocessing as mp
+
+from ScreenRec.ScreenRecorder import main as screenrecord_main
+from ScreenRec.AudioRecorder import main as audiorecord_main
+from ScreenRec.RTPMuxer import main as mux_main
+from ScreenRec.MonolithicRecorder import main as monolithic_main
+from ScreenRec.Calibration import main as calibration_main
+from ScreenRec.model.configfile import config
+from ScreenRec.Transport import ChannelAllocator
+from ScreenRec.Telemetry import stats_health
+from ScreenRec.WorkerPool import WorkerPool
+
+# source windows by button type, imported when first needed as they load Gtk
+source_modules = {
+    'v4l2': 'ScreenRec.gui.V4L2Window',
+    'mjpeg': 'ScreenRec.gui.MJPEGPipeWindow',
+    'rtmp': 'ScreenRec.gui.RTMPWindow',
+    'avf': 'ScreenRec.gui.OSXCamWindow',
+    # 'ks': 'ScreenRec.gui.KSWindow',
+    'player': 'ScreenRec.gui.PlayerWindow'
+}
+
+
+def source_entrypoint(button_type):
+    module = source_modules.get(button_type, None)
+    if not module:
+        return None
+    return importlib.import_module(module).main
+
+
+class QueueManager(threading.Thread):
+
+    STATS_HISTORY = 300  # records per process, about five minutes
+    REQUEST_TIMEOUT = 2  # seconds until an unanswered request gives up
+    READY_TIMEOUT = 5  # seconds a process gets to reach a state
+    STATE_ORDER = ['NULL', 'READY', 'PAUSED', 'PLAYING']
+    WATCHDOG_INTERVAL = 1  # seconds between liveness checks
+    STALL_TIMEOUT = 5  # seconds without telemetry until a running pipeline counts as stalled
+    MAX_RESTARTS = 5  # per process within RESTART_WINDOW, then it is left alone
+    RESTART_WINDOW = 60
+
+    def __init__(self, pool_size=0):
+        self.ctx = mp.get_context('spawn')
+        self.queue = self.ctx.Queue()
+        self.pool = WorkerPool(self.ctx, self.queue, size=pool_size)
+        self.outQueues = {}
+        self.processes = {}
+        self.process_info = {}
+        self.exclusive = None
+        self.retiring = None
+        self.stats = {}
+        self.on_stats = None
+        self.start_latency = {}
+        self.channels = ChannelAllocator()
+        # requests waiting for their reply and processes waiting to reach a state,
+        # callbacks registered from other threads are guarded by the lock
+        self.request_ids = itertools.count(1)
+        self.requests = {}
+        self.states = {}
+        self.state_waiters = {}
+        self.lock = threading.Lock()
+        # watchdog for supervised processes
+        self.next_check = 0
+        self.heartbeats = {}
+        self.restart_times = {}
+        self.restarts = {}
+        # latest decision of each adaptive quality controller and content classifier
+        self.quality = {}
+        self.content = {}
+        super().__init__()
+        
+    def run(self):
+        quit = False
+        while not quit:
+            try:
+                command = self.queue.get(timeout=self.next_timeout())
+            except queue.Empty:
+                command = {}
+            self.expire()
+            if monotonic() >= self.next_check:
+                # look for processes that crashed, stalled or went away on their own
+                self.next_check = monotonic() + QueueManager.WATCHDOG_INTERVAL
+                self.watchdog()
+                self.reap()
+
+            if 'quit' in command:
+                print('Supervisor: IPC quitting')
+                quit = True
+            if 'reply' in command:
+                self.on_reply(command['reply'])
+            if 'pipeline_state' in command:
+                self.on_pipeline_state(command['pipeline_state'])
+            if 'keyframe_needed' in command:
+                # the muxer waits for a keyframe, ask whoever sends the video right now
+                sender = 'screen_recorder'
+                if self.exclusive and not self.switching():
+                    sender = self.exclusive
+                self.request(sender, { 'keyframe': True })
+            if 'terminate' in command:
+                if command['terminate'] in self.process_info:
+                    print('Supervisor: IPC terminating {}'.format(
+                        self.process_info[command['terminate']]['main']
+                    ))
+                self.terminate(command['terminate'])
+            if 'calibrated' in command:
+                print('Supervisor: IPC encoder calibrated {key}: {delay} ms'.format(**command['calibrated']))
+                config.encoder_delays[command['calibrated']['key']] = command['calibrated']['delay']
+                config.save()
+            if 'encoder_latency' in command:
+                # live drift tracking from the screen recorder, shift the audio accordingly
+                if 'muxer' in self.processes and self.processes['muxer'].is_alive():
+                    print('Supervisor: IPC encoder latency drifted to {} ms, adjusting A/V delay'.format(
+                        command['encoder_latency']
+                    ))
+                    self.outQueues['muxer'].put({ 'audio_delay': command['encoder_latency'] })
+            if 'quality' in command:
+                print('Supervisor: IPC {id} switched to quality level {level}, {reason}'.format(**command['quality']))
+                self.quality[command['quality']['id']] = command['quality']
+            if 'content' in command:
+                print('Supervisor: IPC {id} records {content} content at {fps} fps'.format(**command['content']))
+                self.content[command['content']['id']] = command['content']
+            if 'started' in command:
+                print('Supervisor: IPC {id} started recording {latency:.0f} ms after the click'.format(**command['started']))
+                self.start_latency[command['started']['id']] = command['started']['latency']
+            if 'segments' in command:
+                segments = command['segments']
+                if segments['id'] in self.process_info:
+                    self.process_info[segments['id']]['segments'] = segments
+            if 'stats' in command:
+                # telemetry from a pipeline, sent about once a second
+                id = command['stats']['id']
+                if id not in self.stats:
+                    self.stats[id] = deque(maxlen=QueueManager.STATS_HISTORY)
+                self.stats[id].append(command['stats'])
+                self.heartbeats[id] = monotonic()
+                if self.on_stats:
+                    self.on_stats(command['stats'])
+            if 'send' in command:
+                id = command['send']['id']
+                alive = id in self.processes and self.processes[id].is_alive()
+                if alive:
+                    self.outQueues[id].put(command['send']['command'])
+                start = command['send']['command'].get('start', None)
+                if start and id in self.process_info and (alive or self.process_info[id]['supervised']):
+                    # armed processes get their file late, a restart needs it. A supervised
+                    # process that died while armed comes back started with this file.
+                    self.process_info[id]['started'] = True
+                    if start.get('filename', None):
+                        self.process_info[id]['kwargs']['filename'] = start['filename']
+                        self.process_info[id]['filename'] = start['filename']
+            if 'pool_size' in command:
+                self.pool.resize(command['pool_size'])
+            if 'execute' in command:
+                print('Supervisor: IPC executing {}'.format(
+                    command['execute']['main']
+                ))
+                self.execute(**command['execute'])
+            if 'exclusive' in command and 'recorder' in self.processes:
+                print('Supervisor: IPC {} wants exclusive mode, not supported by the monolithic engine'.format(
+                    command['exclusive']
+                ))
+            elif 'exclusive' in command and self.switching():
+                print('Supervisor: IPC {} going into exclusive mode, feeding the screen recorder'.format(
+                    command['exclusive']
+                ))
+                if self.exclusive and self.exclusive != command['exclusive']:
+                    # keeps recording until the new window delivers frames
+                    self.retiring = self.exclusive
+                socket_path = self.channels.lease_channel('feed-{}'.format(command['exclusive']))
+                self.process_info[command['exclusive']]['leases'].append(socket_path)
+                self.outQueues[command['exclusive']].put({ 'feed': { 'socket_path': socket_path } })
+                self.exclusive = command['exclusive']
+            elif 'exclusive' in command and not self.record_target():
+                print('Supervisor: IPC {} wants exclusive mode, but nothing is recording'.format(
+                    command['exclusive']
+                ))
+            elif 'exclusive' in command:
+                window = command['exclusive']
+                target = self.record_target()
+                if self.exclusive == None:
+                    print('Supervisor: IPC {} going into exclusive mode, terminating screen recorder'.format(
+                        window
+                    ))
+                    # returns once the process is gone
+                    self.terminate('screen_recorder', forget_everything=False)
+                    self.request(window, { 'record': target })
+                else:
+                    print('Supervisor: IPC {} going into exclusive mode, stopping exclusive mode on {}'.format(
+                        window, self.exclusive
+                    ))
+                    self.request(self.exclusive, { 'stop': True },
+                                 lambda reply: self.request(window, { 'record': target }))
+                self.exclusive = window
+            if 'feeding' in command:
+                feed = command['feeding']
+                if feed['id'] == self.exclusive and self.switching():
+                    print('Supervisor: IPC switching screen recorder to {}'.format(feed['id']))
+                    retiring = self.retiring
+                    self.retiring = None
+
+                    def on_selected(reply):
+                        if retiring:
+                            self.request('screen_recorder', { 'remove_input': retiring })
+                            self.request(retiring, { 'stop': True })
+
+                    def on_added(reply):
+                        self.request('screen_recorder', { 'select': feed['id'] }, on_selected)
+
+                    self.request('screen_recorder', { 'add_input': feed }, on_added)
+            if 'cooperative' in command and self.switching():
+                print('Supervisor: IPC {} resigned exclusive mode, switching back to the screen'.format(
+                    command['cooperative']
+                ))
+                window = command['cooperative']
+                self.request('screen_recorder', { 'remove_input': window },
+                             lambda reply: self.request(window, { 'stop': True }))
+                if self.exclusive == window:
+                    self.exclusive = None
+            elif 'cooperative' in command:
+                rec = self.process_info.get('screen_recorder', None)
+                if rec:
+                    print('Supervisor: IPC {} resigned exclusive mode, resuming screen recorder'.format(
+                        command['cooperative']
+                    ))
+
+                    def on_stopped(reply):
+                        # the recording is running, the new process must not wait for a start command
+                        kwargs = dict(rec['kwargs'], armed=False, clicked=None)
+                        self.execute('screen_recorder', main=rec['main'], kwargs=kwargs,
+                                     supervised=rec['supervised'])
+
+                    self.request(command['cooperative'], { 'stop': True }, on_stopped)
+                    self.exclusive = None
+
+        # terminate all other processes
+        self.pool.shutdown()
+        for id, process in self.processes.items():
+            if process.is_alive():
+                print('Sending quit to {}'.format(id))
+                self.outQueues[id].put({ 'quit': True })
+                process.join()
+        for id, process in self.processes.items():
+            if process.is_alive():
+                print('Force terminating {}'.format(id))
+                process.terminate()
+
+    def next_timeout(self):
+        # wake up for the next request or state wait that runs out, at least once a second
+        with self.lock:
+            deadlines = [r[0] for r in self.requests.values()]
+            deadlines += [w[1] for waiters in self.state_waiters.values() for w in waiters]
+        if not deadlines:
+            return 1
+        return min(1, max(0.01, min(deadlines) - monotonic()))
+
+    def request(self, id, command, callback=None, timeout=REQUEST_TIMEOUT):
+        # send a command and call callback(reply) when it was run, with None on timeout
+        # or when the process is not there
+        if id not in self.processes or not self.processes[id].is_alive():
+            if callback:
+                callback(None)
+            return None
+        request_id = next(self.request_ids)
+        with self.lock:
+            self.requests[request_id] = (monotonic() + timeout, callback, id)
+        self.outQueues[id].put(dict(command, request_id=request_id))
+        return request_id
+
+    def on_reply(self, reply):
+        with self.lock:
+            request = self.requests.pop(reply['request_id'], None)
+        if reply['error']:
+            print('Supervisor: {} failed a request: {}'.format(reply['id'], reply['error']))
+        if request and request[1]:
+            request[1](reply)
+
+    def when_state(self, id, callback, state='PLAYING', timeout=READY_TIMEOUT):
+        # call callback(True) once the pipeline of a process reached state, callback(False)
+        # if it did not within the timeout. May be called from any thread.
+        with self.lock:
+            reached = self.state_reached(id, state)
+            if not reached:
+                self.state_waiters.setdefault(id, []).append((state, monotonic() + timeout, callback))
+        if reached:
+            callback(True)
+
+    def wait_state(self, ids, state='PLAYING', timeout=READY_TIMEOUT):
+        # blocking version for other threads, returns the ids that got there
+        events = {}
+        reached = []
+        for id in ids:
+            events[id] = threading.Event()
+
+            def on_state(ok, id=id):
+                if ok:
+                    reached.append(id)
+                events[id].set()
+
+            self.when_state(id, on_state, state=state, timeout=timeout)
+        for event in events.values():
+            event.wait(timeout + 1)
+        return reached
+
+    def state_reached(self, id, state):
+        current = self.states.get(id, None)
+        return current is not None and \
+            QueueManager.STATE_ORDER.index(current) >= QueueManager.STATE_ORDER.index(state)
+
+    def on_pipeline_state(self, state):
+        ready = []
+        with self.lock:
+            self.states[state['id']] = state['state']
+            waiters = self.state_waiters.get(state['id'], [])
+            for waiter in list(waiters):
+                if self.state_reached(state['id'], waiter[0]):
+                    waiters.remove(waiter)
+                    ready.append(waiter[2])
+        for callback in ready:
+            callback(True)
+
+    def expire(self, id=None):
+        # fail requests and state waits that ran out, or all of a process that went away
+        now = monotonic()
+        expired_requests = []
+        expired_waiters = []
+        with self.lock:
+            for request_id, request in list(self.requests.items()):
+                if request[0] < now or request[2] == id:
+                    expired_requests.append((request_id, request))
+                    del self.requests[request_id]
+            for waiter_id, waiters in self.state_waiters.items():
+                for waiter in list(waiters):
+                    if waiter[1] < now or waiter_id == id:
+                        waiters.remove(waiter)
+                        expired_waiters.append((waiter_id, waiter))
+        for request_id, request in expired_requests:
+            print('Supervisor: request {} to {} got no reply'.format(request_id, request[2]))
+            if request[1]:
+                request[1](None)
+        for waiter_id, waiter in expired_waiters:
+            print('Supervisor: {} did not reach {}'.format(waiter_id, waiter[0]))
+            waiter[2](False)
+
+    def switching(self):
+        # running screen recorder with an input selector, windows feed it instead of encoding
+        rec = self.process_info.get('screen_recorder', None)
+        return rec is not None and rec['kwargs'].get('switching', False) \
+            and 'screen_recorder' in self.processes and self.processes['screen_recorder'].is_alive()
+
+    def record_target(self):
+        # exclusive sources send their video to wherever the screen recorder sent it
+        rec = self.process_info.get('screen_recorder', None)
+        if rec and rec['kwargs'].get('socket_path', None):
+            return { 'socket_path': rec['kwargs']['socket_path'] }
+        if rec and rec['kwargs'].get('port', None):
+            return { 'port': rec['kwargs']['port'] }
+        mux = self.process_info.get('muxer', None)
+        if mux and mux['kwargs'].get('video_socket', None):
+            return { 'socket_path': mux['kwargs']['video_socket'] }
+        if mux and mux['kwargs'].get('video_port', None):
+            return { 'port': mux['kwargs']['video_port'] }
+        return None
+
+    def execute(self, id=None, main=None, kwargs={}, pooled=False, leases=[], supervised=False):
+        # leases are ports and channels from self.channels, given back when the process is gone,
+        # supervised processes are restarted by the watchdog when they crash or stall
+        if id and main:
+            if id in self.processes and self.processes[id].is_alive():
+                self.channels.release(leases)
+                self.outQueues[id].put({ 'raise': True })
+                return
+            worker = self.pool.run(main, kwargs) if pooled else None
+            if worker:
+                # already initialized, it only has to build its window
+                self.processes[id], self.outQueues[id] = worker
+            else:
+                self.outQueues[id] = self.ctx.Queue()
+                kwargs['comm_queues'] = (self.queue, self.outQueues[id])
+                self.processes[id] = self.ctx.Process(target=main, kwargs=kwargs)
+                self.processes[id].start()
+            self.process_info[id] = {
+                'main': main,
+                'kwargs': kwargs,
+                'leases': list(leases),
+                'supervised': supervised
+            }
+            # fresh stats history for the new process, the old one is kept until now
+            self.stats.pop(id, None)
+            self.heartbeats.pop(id, None)
+            with self.lock:
+                self.states.pop(id, None)
+
+    def terminate(self, id, forget_everything=True):
+        if id in self.processes and self.processes[id].is_alive():
+            print('Sending quit to {}'.format(id))
+            self.outQueues[id].put({ 'quit': True })
+            self.processes[id].join()
+            # self.processes[id].terminate()
+        if forget_everything and id in self.process_info:
+            self.channels.release(self.process_info[id]['leases'])
+            del self.process_info[id]
+            self.restarts.pop(id, None)
+            self.restart_times.pop(id, None)
+        if id in self.processes:
+            del self.processes[id]
+        with self.lock:
+            self.states.pop(id, None)
+        self.expire(id)
+
+    def watchdog(self):
+        now = monotonic()
+        for id, info in list(self.process_info.items()):
+            process = self.processes.get(id, None)
+            if not info['supervised'] or process is None:
+                # not ours to restart, or stopped on purpose
+                continue
+            if not process.is_alive():
+                self.restart(id, 'exited with {}'.format(process.exitcode))
+            elif id in self.heartbeats and now - self.heartbeats[id] > QueueManager.STALL_TIMEOUT:
+                self.restart(id, 'stalled, no telemetry for {:.0f} s'.format(now - self.heartbeats[id]))
+
+    def restart(self, id, reason):
+        now = monotonic()
+        history = self.restart_times.setdefault(id, deque())
+        while history and now - history[0] > QueueManager.RESTART_WINDOW:
+            history.popleft()
+        info = self.process_info[id]
+        if len(history) >= QueueManager.MAX_RESTARTS:
+            print('Supervisor: {} {}, restarted too often, giving up'.format(id, reason))
+            info['supervised'] = False
+            return
+        history.append(now)
+        print('Supervisor: {} {}, restarting'.format(id, reason))
+
+        process = self.processes.pop(id)
+        if process.is_alive():
+            # stalled, it would not answer a quit either
+            process.terminate()
+            process.join(1)
+
+        # a process that crashed while armed waits for its start command again
+        armed = info['kwargs'].get('armed', False) and not info.get('started', False)
+        kwargs = dict(info['kwargs'], armed=armed, clicked=None)
+        kwargs.pop('comm_queues', None)
+        count = self.restarts.get(id, {}).get('count', 0) + 1
+        filename = info.get('filename', kwargs.get('filename', None))
+        if info['main'] is mux_main and 'segments' in info:
+            # segmented output goes on with the next number and keeps pruning
+            kwargs['segment_start'] = info['segments']['next']
+            kwargs['segments'] = info['segments']['paths']
+        elif filename and not armed:
+            # the new pipeline starts its timestamps at zero, continue in a new part
+            base, ext = os.path.splitext(filename)
+            kwargs['filename'] = '{}-part{}{}'.format(base, count + 1, ext)
+        self.execute(id, main=info['main'], kwargs=kwargs, leases=info['leases'], supervised=True)
+        self.process_info[id]['filename'] = filename
+        if 'segments' in info:
+            self.process_info[id]['segments'] = info['segments']
+        self.process_info[id]['started'] = not armed
+        self.restarts[id] = { 'count': count, 'reason': reason, 'latency': None }
+        if armed:
+            return
+
+        def on_playing(ok):
+            if not ok:
+                return
+            latency = (monotonic() - now) * 1000
+            self.restarts[id]['latency'] = latency
+            print('Supervisor: {} recording again {:.0f} ms after the restart'.format(id, latency))
+            if id != 'muxer':
+                # the stream starts over, the muxer picks it up at the next keyframe
+                self.request('muxer', { 'resync': id })
+
+        self.when_state(id, on_playing)
+
+    def reap(self):
+        # give back the leases of processes that exited or crashed
+        for id, process in list(self.processes.items()):
+            if not process.is_alive() and id in self.process_info and self.process_info[id]['leases']:
+                print('Supervisor: {} exited, releasing {}'.format(id, self.process_info[id]['leases']))
+                self.channels.release(self.process_info[id]['leases'])
+                self.process_info[id]['leases'] = []
+
+
+# Recording processes of one screen recording, independent of who drives it. The
+# control window and the daemon both keep one of these next to their QueueManager.
+class RecordingSession:
+    RECORDING_PROCESSES = ['recorder', 'screen_recorder', 'audio_recorder', 'muxer']
+    HEALTH_LEVELS = ['ok', 'struggling', 'overloaded']
+
+    def __init__(self, comm, display=None):
+        self.comm = comm
+        # full X display name like ':100', else the screen from the settings
+        self.display = display
+        self.recording = False
+        self.paused = False
+        self.recording_ids = []
+        self.armed = None
+        self.armed_ids = []
+        self.output_path = None
+        self.output_mode = None
+
+    def terminate_recording(self):
+        self.comm.queue.put({ 'terminate': 'recorder'})
+        self.comm.queue.put({ 'terminate': 'audio_recorder'})
+        self.comm.queue.put({ 'terminate': 'screen_recorder'})
+        self.comm.queue.put({ 'terminate': 'muxer'})
+
+    def start(self, clicked=None, filename=None):
+        if self.recording:
+            return False
+        self.comm.queue.put({ 'terminate': 'calibration'})
+
+        val = config.rec_settings
+        template = filename if filename else val.filename
+
+        output_path = datetime.now().strftime(template)
+        if val.output_mode in ('replay', 'segmented'):
+            # the muxer formats the template when a replay is saved or a segment starts
+            output_path = template
+
+        if self.armed is not None and self.armed == self.arm_signature():
+            # processes are built and waiting, only the filename is missing
+            def send_start(id):
+                start = { 'clicked': clicked }
+                if id in ('recorder', 'muxer'):
+                    start['filename'] = output_path
+                self.comm.queue.put({
+                    'send': {
+                        'id': id,
+                        'command': { 'start': start }
+                    }
+                })
+
+            receiver, senders = self.armed_ids[0], self.armed_ids[1:]
+            send_start(receiver)
+            if senders:
+                # the senders start once the muxer listens, or when it did not manage to
+                def on_receiver_playing(ok):
+                    for id in senders:
+                        send_start(id)
+
+                self.comm.when_state(receiver, on_receiver_playing)
+        else:
+            self.terminate_recording()
+            if val.engine == 'monolithic' and val.output_mode == 'file':
+                self.start_monolithic_recording(val, output_path, clicked=clicked)
+            else:
+                self.start_multiprocess_recording(val, output_path, clicked=clicked)
+        self.armed = None
+
+        if val.engine == 'monolithic' and val.output_mode == 'file':
+            self.recording_ids = ['recorder']
+        else:
+            self.recording_ids = ['muxer', 'screen_recorder', 'audio_recorder']
+
+        self.recording = True
+        self.paused = False
+        self.output_path = output_path
+        self.output_mode = val.output_mode
+        return True
+
+    def stop(self, arm=True):
+        if not self.recording:
+            return False
+        self.terminate_recording()
+        self.recording = False
+        self.paused = False
+        self.recording_ids = []
+        self.output_path = None
+        self.output_mode = None
+
+        if arm:
+            # get ready for the next recording
+            self.arm()
+        return True
+
+    def pause(self, paused=True):
+        if not self.recording or paused == self.paused:
+            return False
+        if paused:
+            ids = list(reversed(self.recording_ids))
+        else:
+            # receiver first, so nothing the senders produce gets lost
+            ids = self.recording_ids
+        for id in ids:
+            self.comm.queue.put({
+                'send': {
+                    'id': id,
+                    'command': { 'pause' if paused else 'resume': True }
+                }
+            })
+        self.paused = paused
+        return True
+
+    def save_replay(self, seconds=None):
+        if not self.recording or self.output_mode != 'replay':
+            return False
+        self.comm.queue.put({
+            'send': {
+                'id': 'muxer',
+                'command': { 'save_replay': int(seconds if seconds else config.rec_settings.replay_seconds) }
+            }
+        })
+        return True
+
+    def switch(self, source):
+        # record a source window exclusively, 'screen' goes back to the screen
+        if source == 'screen':
+            if not self.comm.exclusive:
+                return False
+            self.comm.queue.put({ 'cooperative': self.comm.exclusive })
+            return True
+
+        button = next((b for b in config.buttons if b.id == source), None)
+        if not button:
+            return False
+        if not self.open_source(button):
+            return False
+        # commands for the window queue up until it runs
+        self.comm.queue.put({ 'exclusive': button.id })
+        return True
+
+    def open_source(self, button):
+        main = source_entrypoint(button.button_type)
+        data = button.serialize()
+        del data['button_type']
+        if not main:
+            return False
+        self.comm.queue.put({
+            'execute': {
+                'id': data['id'],
+                'main': main,
+                'kwargs': data,
+                'pooled': True
+            }
+        })
+        return True
+
+    def encoding_geometry(self, val):
+        width = int(val.scale_width) if int(val.scale_width) else int(val.width)
+        height = int(val.scale_height) if int(val.scale_height) else int(val.height)
+        return width, height
+
+    def calibrate(self):
+        # measure the encoder latency for the current settings once, in the background
+        val = config.rec_settings
+        width, height = self.encoding_geometry(val)
+        if self.recording or config.is_calibrated(val.encoder, width, height, int(val.fps), val.profile):
+            return
+        self.comm.queue.put({
+            'execute': {
+                'id': 'calibration',
+                'main': calibration_main,
+                'kwargs': {
+                    'encoder': val.encoder,
+                    'width': width,
+                    'height': height,
+                    'fps': int(val.fps),
+                    'profile': val.profile
+                }
+            }
+        })
+
+    def arm_signature(self):
+        # armed processes are only of use if they were built with the current settings
+        return (config.rec_settings.serialize(), config.audio_settings.serialize())
+
+    def arm(self):
+        # start the recording processes and let them wait for the start command
+        val = config.rec_settings
+        if self.recording or not val.pre_arm:
+            return
+        if self.armed is not None and self.armed == self.arm_signature():
+            return
+
+        self.terminate_recording()
+
+        output_path = datetime.now().strftime(val.filename)
+        if val.engine == 'monolithic' and val.output_mode == 'file':
+            self.start_monolithic_recording(val, output_path, armed=True)
+            self.armed_ids = ['recorder']
+        else:
+            self.start_multiprocess_recording(val, output_path, armed=True)
+            # the muxer has to listen before the others send
+            self.armed_ids = ['muxer', 'screen_recorder', 'audio_recorder']
+        self.armed = self.arm_signature()
+
+    def start_monolithic_recording(self, val, output_path, armed=False, clicked=None):
+        self.comm.queue.put({
+            'execute': {
+                'id': 'recorder',
+                'supervised': True,
+                'main': monolithic_main,
+                'kwargs': {
+                    'filename': output_path,
+                    'display': self.display if self.display else val.screen,
+                    'encoder': val.encoder,
+                    'profile': val.profile,
+                    'width': val.width,
+                    'height': val.height,
+                    'scale_width': None if int(val.scale_width) == 0 else int(val.scale_width),
+                    'scale_height': None if int(val.scale_height) == 0 else int(val.scale_height),
+                    'capture_mode': val.capture_mode,
+                    'min_refresh': int(val.min_refresh),
+                    'device': config.audio_settings.device,
+                    'audio_codec': config.audio_settings.encoder,
+                    'audio_bitrate': config.audio_settings.bitrate,
+                    'armed': armed,
+                    'clicked': clicked
+                }
+            }
+        })
+
+    def start_multiprocess_recording(self, val, output_path, armed=False, clicked=None):
+        width, height = self.encoding_geometry(val)
+        audio_delay = config.encoder_delay(val.encoder, width, height, int(val.fps), val.profile)
+
+        # the muxer holds the leases, the recorders send to it
+        if val.transport == 'shm':
+            audio_target = { 'socket_path': self.comm.channels.lease_channel('audio') }
+            video_target = { 'socket_path': self.comm.channels.lease_channel('video') }
+            mux_sources = {
+                'audio_socket': audio_target['socket_path'],
+                'video_socket': video_target['socket_path']
+            }
+        else:
+            audio_target = { 'port': self.comm.channels.lease_port() }
+            video_target = { 'port': self.comm.channels.lease_port() }
+            mux_sources = {
+                'audio_port': audio_target['port'],
+                'video_port': video_target['port']
+            }
+        leases = list(audio_target.values()) + list(video_target.values())
+
+        self.comm.queue.put({
+            'execute': {
+                'id': 'muxer',
+                'supervised': True,
+                'main': mux_main,
+                'leases': leases,
+                'kwargs': dict(mux_sources, **{
+                    'filename': output_path,
+                    'transport': val.transport,
+                    'output_mode': val.output_mode,
+                    'replay_budget': int(val.replay_budget),
+                    'segment_duration': int(val.segment_duration),
+                    'segment_size': int(val.segment_size),
+                    'segment_retention': int(val.segment_retention),
+                    'audio_codec': config.audio_settings.encoder,
+                    'audio_delay': audio_delay,
+                    'audio_bitrate': config.audio_settings.bitrate,
+                    'armed': armed,
+                    'clicked': clicked
+                })
+            }
+        })
+
+        self.comm.queue.put({
+            'execute': {
+                'id': 'screen_recorder',
+                'supervised': True,
+                'main': screenrecord_main,
+                'kwargs': dict(video_target, **{
+                    'display': self.display if self.display else val.screen,
+                    'encoder': val.encoder,
+                    'profile': val.profile,
+                    'width': val.width,
+                    'height': val.height,
+                    'scale_width': None if int(val.scale_width) == 0 else int(val.scale_width),
+                    'scale_height': None if int(val.scale_height) == 0 else int(val.scale_height),
+                    'capture_mode': val.capture_mode,
+                    'min_refresh': int(val.min_refresh),
+                    'audio_delay': audio_delay,
+                    'switching': val.source_switching == 'selector',
+                    'adaptive': val.adaptive_quality,
+                    'content_mode': val.content_mode,
+                    'armed': armed,
+                    'clicked': clicked
+                })
+            }
+        })
+
+        self.comm.queue.put({
+            'execute': {
+                'id': 'audio_recorder',
+                'supervised': True,
+                'main': audiorecord_main,
+                'kwargs': dict(audio_target, **{
+                    'device': config.audio_settings.device,
+                    'armed': armed,
+                    'clicked': clicked
+                })
+            }
+        })
+
+    def health(self):
+        # worst rating of the recording processes and a line per process
+        health = 'ok'
+        details = []
+        for id in RecordingSession.RECORDING_PROCESSES:
+            history = self.comm.stats.get(id, None)
+            if not history:
+                continue
+            stats = history[-1]
+            rating = stats_health(stats)
+            if RecordingSession.HEALTH_LEVELS.index(rating) > RecordingSession.HEALTH_LEVELS.index(health):
+                health = rating
+            detail = '{}: {}, queues {:.0%}'.format(id, rating, stats['queue_fill'])
+            if stats['frames']:
+                detail += ', {:.0f} fps'.format(stats['frames'] / stats['interval'])
+            if stats['encoder_latency'] is not None:
+                detail += ', encoder {:.0f} ms'.format(stats['encoder_latency'])
+            restart = self.comm.restarts.get(id, None)
+            if restart:
+                detail += ', restarted {} times'.format(restart['count'])
+            details.append(detail)
+        return health, details
+
+    def profile_latency(self):
+        val = config.rec_settings
+        width, height = self.encoding_geometry(val)
+        return config.profile_latency(val.encoder, width, height, int(val.fps), val.profile)
+
+    def status(self):
+        health, details = self.health()
+        return {
+            'recording': self.recording,
+            'paused': self.paused,
+            'armed': self.armed is not None,
+            'output_path': self.output_path,
+            'output_mode': self.output_mode,
+            'exclusive': self.comm.exclusive,
+            'processes': dict(
+                (id, process.is_alive()) for id, process in list(self.comm.processes.items())
+            ),
+            'start_latency': dict(self.comm.start_latency),
+            'profile': config.rec_settings.profile,
+            'profile_latency': self.profile_latency(),
+            'restarts': dict(self.comm.restarts),
+            'quality': dict(self.comm.quality),
+            'content': dict(self.comm.content),
+            'health': health,
+            'health_details': details,
+            'stats': dict(
+                (id, history[-1]) for id, history in list(self.comm.stats.items()) if history
+            )
+        }
@@ -0,0 +1,132 @@
+import time
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst, GLib
+
+from ScreenRec.Latency import EncoderLatencyProbe
+
+
+# Collects counters from a running pipeline and publishes them once per interval on
+# the IPC queue as { 'stats': {...} }. The probes only increment counters, everything
+# else is read from element properties when the record is sent.
+class PipelineStats:
+
+    def __init__(self, id, pipeline, out_queue, interval=1, latency_probe=None, on_collect=None):
+        self.id = id
+        self.pipeline = pipeline
+        self.out_queue = out_queue
+        self.interval = interval
+        self.on_collect = on_collect
+        self.running = True
+
+        self.frames = 0
+        self.bytes = 0
+        self.xruns = 0
+        self.audio_buffers = 0
+        self.last = {}
+        self.last_time = time.monotonic()
+
+        self.videorates = []
+        self.queues = []
+        self.latency_probe = latency_probe
+
+        for element in pipeline.iterate_recurse():
+            factory = element.get_factory()
+            name = factory.get_name() if factory else None
+            if name == 'videorate':
+                self.videorates.append(element)
+            elif name == 'queue':
+                self.queues.append(element)
+            elif element.has_flag(Gst.ElementFlags.SINK) and not isinstance(element, Gst.Bin):
+                element.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self.on_sink_buffer)
+
+        source = pipeline.get_by_name('source')
+        if source:
+            source.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.on_frame)
+
+        audio_source = pipeline.get_by_name('audio_source')
+        if audio_source:
+            audio_source.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.on_audio_buffer)
+
+        video_encoder = pipeline.get_by_name('video_encoder')
+        if video_encoder and not self.latency_probe:
+            self.latency_probe = EncoderLatencyProbe(video_encoder)
+
+        GLib.timeout_add_seconds(interval, self.publish)
+
+    def on_frame(self, pad, info):
+        self.frames += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_sink_buffer(self, pad, info):
+        self.bytes += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    def on_audio_buffer(self, pad, info):
+        # audio sources flag the first buffer after lost samples as discontinuous
+        self.audio_buffers += 1
+        if self.audio_buffers > 1 and info.get_buffer().has_flags(Gst.BufferFlags.DISCONT):
+            self.xruns += 1
+        return Gst.PadProbeReturn.OK
+
+    def delta(self, key, value):
+        # counters are cumulative, the records carry the change since the last one
+        result = value - self.last.get(key, 0)
+        self.last[key] = value
+        return result
+
+    def collect(self):
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        self.last_time = now
+
+        queues = {}
+        for queue in self.queues:
+            limit = queue.get_property('max-size-buffers')
+            level = queue.get_property('current-level-buffers')
+            queues[queue.get_name()] = level / limit if limit else 0
+
+        stats = {
+            'id': self.id,
+            'time': time.time(),
+            'interval': elapsed,
+            'frames': self.delta('frames', self.frames),
+            'dropped': self.delta('dropped', sum(v.get_property('drop') for v in self.videorates)),
+            'duplicated': self.delta('duplicated', sum(v.get_property('duplicate') for v in self.videorates)),
+            'queues': queues,
+            'queue_fill': max(queues.values()) if queues else 0,
+            'encoder_latency': self.latency_probe.latency() if self.latency_probe else None,
+            'bytes': self.delta('bytes', self.bytes),
+            'xruns': self.delta('xruns', self.xruns)
+        }
+        return stats
+
+    def publish(self):
+        if not self.running or not self.pipeline:
+            return False
+        stats = self.collect()
+        if self.on_collect:
+            # local consumers, e.g. the quality controller
+            self.on_collect(stats)
+        if self.out_queue:
+            self.out_queue.put({ 'stats': stats })
+        return True  # call again
+
+    def stop(self):
+        self.running = False
+
+
+# Rate a stats record, used by the control window for its health indicator. Frames
+# videorate duplicates only pad a static or slow source, they are no sign of load.
+def stats_health(stats):
+    if stats['dropped'] > 0 or stats['xruns'] > 0 or stats['queue_fill'] > 0.8:
+        return 'overloaded'
+    if stats['queue_fill'] > 0.5:
+        return 'struggling'
+    return 'ok'
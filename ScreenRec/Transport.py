@@ -0,0 +1,106 @@
+import os
+import socket
+import tempfile
+import threading
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst
+
+
+available_transports = [
+    'udp',  # RTP over UDP on localhost, packetized and sent through a jitterbuffer
+    'shm',  # shared memory segment, no packetization, only works on a single host
+]
+
+# caps of the data that goes through the shared memory segments
+shm_video_caps = 'video/x-h264,stream-format=byte-stream,alignment=au'
+shm_audio_caps = 'audio/x-raw,format=S16LE,layout=interleaved,rate=44100,channels=2'
+
+# size of the shared memory areas, has to hold a few frames at least
+shm_video_size = 32 * 1024 * 1024  # 32 MB
+shm_audio_size = 2 * 1024 * 1024  # 2 MB
+
+
+def shm_socket_path(name):
+    # control socket path for a shared memory channel, unique per main process
+    return os.path.join(
+        tempfile.gettempdir(),
+        'ScreenRecorder-{}-{}'.format(os.getpid(), name)
+    )
+
+
+
+# Hands out UDP ports and shared memory channel names so several pipelines can run on
+# one host. Leases are given back with release() when their process is gone.
+class ChannelAllocator:
+    PORTS = (7654, 8653)
+
+    def __init__(self, ports=PORTS):
+        self.ports = ports
+        self.leased = set()
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def port_free(self, port):
+        # other programs on this host may use it as well
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            try:
+                s.bind(('127.0.0.1', port))
+            except OSError:
+                return False
+        return True
+
+    def lease_port(self):
+        with self.lock:
+            for port in range(self.ports[0], self.ports[1] + 1):
+                if port not in self.leased and self.port_free(port):
+                    self.leased.add(port)
+                    return port
+        raise RuntimeError('no free port in {}-{}'.format(*self.ports))
+
+    def lease_channel(self, name):
+        with self.lock:
+            self.counter += 1
+            path = shm_socket_path('{}-{}'.format(name, self.counter))
+            self.leased.add(path)
+            return path
+
+    def release(self, leases):
+        with self.lock:
+            for lease in leases:
+                self.leased.discard(lease)
+
+def make_shm_sink(path, size):
+    sink = Gst.ElementFactory.make('shmsink')
+    sink.set_property('socket-path', path)
+    sink.set_property('shm-size', size)
+    sink.set_property('wait-for-connection', False)  # drop data until the muxer is connected
+    sink.set_property('sync', False)
+    return sink
+
+
+def make_shm_src(path, caps_string):
+    src = Gst.Bin.new()
+
+    shmsrc = Gst.ElementFactory.make('shmsrc')
+    shmsrc.set_property('socket-path', path)
+    shmsrc.set_property('is-live', True)
+    shmsrc.set_property('do-timestamp', True)
+    src.add(shmsrc)
+
+    caps = Gst.Caps.from_string(caps_string)
+    filter = Gst.ElementFactory.make('capsfilter')
+    filter.set_property('caps', caps)
+    src.add(filter)
+    shmsrc.link(filter)
+
+    ghost_src = Gst.GhostPad.new('src', filter.get_static_pad('src'))
+    src.add_pad(ghost_src)
+
+    return src, shmsrc
@@ -9,10 +9,14 @@ import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('GstNet', '1.0')
 gi.require_version('GstRtsp', '1.0')
+gi.require_version('GstVideo', '1.0')
 
 # Import GStreamer
-from gi.repository import Gst, GObject, GstNet, GstRtsp, GLib
+from gi.repository import Gst, GObject, GstNet, GstRtsp, GLib, GstVideo
 
+from ScreenRec.Transport import make_shm_sink, shm_video_caps, shm_video_size
+from ScreenRec.FrameGate import DuplicateGate
+from ScreenRec.ContentClassifier import content_settings
 
 if platform.system() == 'Linux':
     available_encoders = [
@@ -32,6 +36,24 @@ elif platform.system() == 'Windows':
         'x264'
     ]
 
+# GStreamer elements behind the encoder names, to check what is installed
+encoder_factories = {
+    'x264': 'x264enc',
+    'vaapi': 'vaapih264enc',
+    'openh264': 'openh264enc',
+    'vtenc_h264': 'vtenc_h264',
+    'vtenc_h264_hw': 'vtenc_h264_hw'
+}
+
+# raw format the software encoders take without converting again inside
+encoder_formats = {
+    'x264': 'I420',
+    'openh264': 'I420',
+    'vtenc_h264': 'NV12',
+    'vtenc_h264_hw': 'NV12'
+}
+
+# measured defaults, the real latency depends on settings and load, see Calibration.py
 encoder_delay = {
     'x264': 1150,
     'vaapi': 240,
@@ -41,7 +63,328 @@ encoder_delay = {
     'openh264': 0
 }
 
+available_profiles = [
+    'balanced',  # what the recorder always did, about a second behind
+    'archive',   # best quality per bit, latency does not matter
+    'live'       # lowest latency for streaming, costs quality per bit
+]
+
+# Encoder settings of the profiles, translated for every encoder by apply_profile.
+# What a profile costs in latency depends on the host, bench.py --profiles measures the
+# glass-to-mux time and --save stores it in the config.
+encoder_profiles = {
+    'balanced': {
+        'preset': 'veryfast',
+        'tune': None,
+        'bframes': 0,
+        'lookahead': 10,
+        'sliced_threads': False,
+        'keyframe_seconds': 2,
+        'quality_level': 4,  # vaapi, 1 best to 7 fastest
+        'complexity': 0  # openh264, 0 low to 2 high
+    },
+    'archive': {
+        'preset': 'faster',
+        'tune': None,
+        'bframes': 3,
+        'lookahead': 40,
+        'sliced_threads': False,
+        'keyframe_seconds': 10,
+        'quality_level': 2,
+        'complexity': 2
+    },
+    'live': {
+        'preset': 'superfast',
+        'tune': 'zerolatency',
+        'bframes': 0,
+        'lookahead': 0,
+        'sliced_threads': True,
+        'keyframe_seconds': 1,
+        'quality_level': 7,
+        'complexity': 0
+    }
+}
+
+available_rendition_outputs = [
+    'tracks',  # all renditions as separate video tracks of one file
+    'files'    # one file per rendition
+]
+
+# bitrate property of the encoders, in kbit/s unless noted
+encoder_bitrate_scale = {
+    'x264': 1,
+    'vaapi': 1,
+    'openh264': 1000,  # bit/s
+    'vtenc_h264': 1,
+    'vtenc_h264_hw': 1
+}
+
+
+def set_supported(element, name, value):
+    # property sets differ between encoders and plugin versions, skip what is missing
+    if value is None or element.find_property(name) is None:
+        return
+    if isinstance(value, str):
+        # enums and flags by nick
+        Gst.util_set_object_arg(element, name, value)
+    else:
+        element.set_property(name, value)
+
+
+def apply_profile(video_encoder, encoder, profile, fps, preset=None):
+    # preset overrides the one of the profile, e.g. for degraded farm recordings
+    settings = encoder_profiles.get(profile, encoder_profiles[available_profiles[0]])
+    keyframe_interval = max(1, int(fps * settings['keyframe_seconds']))
+    if encoder == 'x264':
+        set_supported(video_encoder, 'speed-preset', preset if preset else settings['preset'])
+        if settings['tune']:
+            set_supported(video_encoder, 'tune', settings['tune'])
+        set_supported(video_encoder, 'bframes', settings['bframes'])
+        set_supported(video_encoder, 'rc-lookahead', settings['lookahead'])
+        set_supported(video_encoder, 'sliced-threads', settings['sliced_threads'])
+        set_supported(video_encoder, 'key-int-max', keyframe_interval)
+    elif encoder == 'vaapi':
+        set_supported(video_encoder, 'keyframe-period', keyframe_interval)
+        set_supported(video_encoder, 'max-bframes', settings['bframes'])
+        set_supported(video_encoder, 'quality-level', settings['quality_level'])
+    elif encoder == 'openh264':
+        # baseline profile, no b-frames and no lookahead to configure
+        set_supported(video_encoder, 'complexity', settings['complexity'])
+        set_supported(video_encoder, 'gop-size', keyframe_interval)
+    elif encoder == 'vtenc_h264' or encoder == 'vtenc_h264_hw':
+        set_supported(video_encoder, 'realtime', settings['tune'] == 'zerolatency')
+        set_supported(video_encoder, 'allow-frame-reordering', settings['bframes'] > 0)
+        set_supported(video_encoder, 'max-keyframe-interval', keyframe_interval)
+
+
+def apply_content(video_encoder, encoder, content):
+    # only x264 has knobs for the kind of picture, and only before it runs
+    if encoder != 'x264' or content not in content_settings:
+        return
+    set_supported(video_encoder, 'psy-tune', content_settings[content]['psy_tune'])
+    set_supported(video_encoder, 'ref', content_settings[content]['ref'])
+
+
+def make_convert_stage(enc, width, height, format, threads=0):
+    # scale first, so a downscale only converts the pixels that are kept, then convert
+    # straight into the format the encoder takes. 0 threads is one per core.
+    if Gst.ElementFactory.find('videoconvertscale'):
+        # both in a single pass over the frame, GStreamer 1.22 and later
+        elements = [Gst.ElementFactory.make('videoconvertscale')]
+    else:
+        elements = [Gst.ElementFactory.make('videoscale'), Gst.ElementFactory.make('videoconvert')]
+
+    # named so the quality controller can change the size while recording
+    filter = Gst.ElementFactory.make('capsfilter', 'scale_filter')
+    filter.set_property('caps', Gst.Caps.from_string('video/x-raw,format={},width={},height={}'.format(
+        format, width, height
+    )))
+
+    for element in elements:
+        set_supported(element, 'n-threads', threads)
+        enc.add(element)
+    enc.add(filter)
+    for upstream, downstream in zip(elements, elements[1:] + [filter]):
+        upstream.link(downstream)
+    return elements[0], filter
+
+
+def force_keyframe(pipeline):
+    # ask every encoder in the pipeline to start a new GOP with the next frame
+    for element in pipeline.iterate_recurse():
+        if element.get_name().startswith('video_encoder'):
+            event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+            element.get_static_pad('src').send_event(event)
+
+
+def parse_rendition(value, fps=30):
+    # WIDTHxHEIGHT[@FPS][:BITRATE], e.g. 1280x720@30:2500
+    bitrate = None
+    if ':' in value:
+        value, bitrate = value.split(':')
+        bitrate = int(bitrate)
+    if '@' in value:
+        value, fps = value.split('@')
+    width, height = value.split('x')
+    return {
+        'width': int(width),
+        'height': int(height),
+        'fps': int(fps),
+        'bitrate': bitrate
+    }
+
+
+def rendition_path(path, rendition):
+    # output file of one rendition in 'files' mode
+    base, ext = os.path.splitext(path)
+    return '{}-{}x{}{}'.format(base, rendition['width'], rendition['height'], ext)
+
+
+def get_rendition_sink(renditions, **kwargs):
+        # one convert stage, then a tee into a scaler and encoder per rendition, so
+        # capture and colorspace conversion run once for all of them
+        from ScreenRec.model.configfile import config
+
+        encoder = kwargs.get('encoder', config.rec_settings.encoder)
+        if not encoder:
+            encoder = available_encoders[0]
+        if encoder not in encoder_factories:
+            raise NotImplementedError("Encoder '{}' does not support renditions".format(encoder))
+        port = kwargs.get('port', None)
+        if port and len(renditions) > 1:
+            # only the one port is leased, the next ones may belong to someone else
+            raise NotImplementedError('Only one rendition can be sent to a port')
+        socket_path = kwargs.get('socket_path', None)
+        expose_src = kwargs.get('expose_src', False)
+        rendition_output = kwargs.get('rendition_output', available_rendition_outputs[0])
+        preset = kwargs.get('preset', None)
+        profile = kwargs.get('profile', None)
+        if not profile:
+            profile = config.rec_settings.profile
+
+        print('Using {} encoder for {} renditions'.format(encoder, len(renditions)))
+
+        enc = Gst.Bin.new('encoder')
+
+        queue = Gst.ElementFactory.make('queue')
+        queue.set_property('max-size-buffers', 200)
+        queue.set_property('max-size-bytes', 104857600)  # 10 MB
+        queue.set_property('max-size-time', 10000000000)  # 10 sec
+        enc.add(queue)
+
+        tee = Gst.ElementFactory.make('tee')
+        enc.add(tee)
+        if encoder == 'vaapi':
+            # vaapipostproc converts on the GPU in every branch
+            queue.link(tee)
+        else:
+            # convert into the encoder format on all cores, the branches scale that
+            convert = Gst.ElementFactory.make('videoconvert')
+            set_supported(convert, 'n-threads', 0)
+            format_filter = Gst.ElementFactory.make('capsfilter')
+            format_filter.set_property('caps', Gst.Caps.from_string(
+                'video/x-raw,format={}'.format(encoder_formats.get(encoder, 'I420'))
+            ))
+            enc.add(convert)
+            enc.add(format_filter)
+            queue.link(convert)
+            convert.link(format_filter)
+            format_filter.link(tee)
+
+        muxer = None
+        filesinks = []
+        if not expose_src and not socket_path and not port and rendition_output == 'tracks':
+            muxer = Gst.ElementFactory.make('mpegtsmux')
+            enc.add(muxer)
+            filesink = Gst.ElementFactory.make('filesink')
+            enc.add(filesink)
+            muxer.link(filesink)
+            filesinks.append(filesink)
+
+        for index, rendition in enumerate(renditions):
+            fps = rendition.get('fps', 30)
+            bitrate = rendition.get('bitrate', None)
+
+            branch_queue = Gst.ElementFactory.make('queue')
+            branch_queue.set_property('max-size-buffers', 200)
+            branch_queue.set_property('leaky', 2)  # a slow rendition must not stall the others
+            videorate = Gst.ElementFactory.make('videorate')
+            rate_filter = Gst.ElementFactory.make('capsfilter')
+            rate_filter.set_property('caps', Gst.Caps.from_string('video/x-raw,framerate={}/1'.format(fps)))
+            enc.add(branch_queue)
+            enc.add(videorate)
+            enc.add(rate_filter)
+            tee.link(branch_queue)
+            branch_queue.link(videorate)
+            videorate.link(rate_filter)
+
+            # the first encoder keeps the usual name, latency probes look for it
+            name = 'video_encoder' if index == 0 else 'video_encoder_{}'.format(index)
+            if encoder == 'vaapi':
+                scaler = Gst.ElementFactory.make('vaapipostproc')
+                scaler.set_property('width', rendition['width'])
+                scaler.set_property('height', rendition['height'])
+                scaler.set_property('scale-method', 2)
+                enc.add(scaler)
+                rate_filter.link(scaler)
+                last = scaler
+
+                video_encoder = Gst.ElementFactory.make('vaapih264enc', name)
+            else:
+                scaler = Gst.ElementFactory.make('videoscale')
+                set_supported(scaler, 'n-threads', 0)
+                size_filter = Gst.ElementFactory.make('capsfilter')
+                size_filter.set_property('caps', Gst.Caps.from_string('video/x-raw,width={},height={}'.format(
+                    rendition['width'], rendition['height']
+                )))
+                enc.add(scaler)
+                enc.add(size_filter)
+                rate_filter.link(scaler)
+                scaler.link(size_filter)
+                last = size_filter
+
+                video_encoder = Gst.ElementFactory.make(encoder_factories[encoder], name)
+            # keyframes at the same times in every rendition
+            apply_profile(video_encoder, encoder, profile, fps, preset)
+            if bitrate:
+                video_encoder.set_property('bitrate', bitrate * encoder_bitrate_scale[encoder])
+            enc.add(video_encoder)
+            last.link(video_encoder)
+
+            out_queue = Gst.ElementFactory.make('queue')
+            parser = Gst.ElementFactory.make('h264parse')
+            enc.add(out_queue)
+            enc.add(parser)
+            video_encoder.link(out_queue)
+            out_queue.link(parser)
+
+            # the first rendition goes where a single encode would go, the others
+            # to numbered sockets
+            if expose_src:
+                ghost_src = Gst.GhostPad.new('src' if index == 0 else 'src_{}'.format(index), parser.get_static_pad('src'))
+                enc.add_pad(ghost_src)
+            elif socket_path:
+                parser.set_property('config-interval', -1)
+                path = socket_path if index == 0 else '{}-{}'.format(socket_path, index)
+                shmsink = make_shm_sink(path, shm_video_size)
+                enc.add(shmsink)
+                # shmsink takes anything, make the parser deliver what shmsrc declares
+                parser.link_filtered(shmsink, Gst.Caps.from_string(shm_video_caps))
+            elif port:
+                rtp_payload = Gst.ElementFactory.make('rtph264pay')
+                rtp_payload.set_property('config-interval', -1)
+                udpsink = Gst.ElementFactory.make('udpsink')
+                udpsink.set_property('sync', True)
+                udpsink.set_property('host', '127.0.0.1')
+                udpsink.set_property('port', port)
+                enc.add(rtp_payload)
+                enc.add(udpsink)
+                parser.link(rtp_payload)
+                rtp_payload.link(udpsink)
+            elif muxer:
+                parser.link(muxer)
+            else:
+                file_muxer = Gst.ElementFactory.make('mpegtsmux')
+                filesink = Gst.ElementFactory.make('filesink')
+                enc.add(file_muxer)
+                enc.add(filesink)
+                parser.link(file_muxer)
+                file_muxer.link(filesink)
+                filesinks.append(filesink)
+
+        ghost_sink = Gst.GhostPad.new('sink', queue.get_static_pad('sink'))
+        enc.add_pad(ghost_sink)
+
+        # one filesink for all tracks or one per rendition
+        if muxer:
+            return enc, filesinks[0]
+        return enc, filesinks if filesinks else None
+
+
 def get_recording_sink(**kwargs):
+        if kwargs.get('renditions', None):
+            return get_rendition_sink(**kwargs)
+
         # read settings
         from ScreenRec.model.configfile import config
         
@@ -55,9 +398,19 @@ def get_recording_sink(**kwargs):
         if not encoder:
             encoder = ScreenRecorder.ENCODERS[0]
         port = kwargs.get('port', None)
+        socket_path = kwargs.get('socket_path', None)
+        expose_src = kwargs.get('expose_src', False)
         fps = kwargs.get('fps', config.rec_settings.fps)
+        variable_framerate = kwargs.get('variable_framerate', False)
+        preset = kwargs.get('preset', None)
+        profile = kwargs.get('profile', None)
+        if not profile:
+            profile = config.rec_settings.profile
+        deduplicate = kwargs.get('deduplicate', config.rec_settings.deduplicate)
+        content = kwargs.get('content', None)
+        min_refresh = kwargs.get('min_refresh', config.rec_settings.min_refresh)
 
-        print('Using {} encoder'.format(encoder))
+        print('Using {} encoder with {} profile'.format(encoder, profile))
 
         # create encoder bin
         enc = Gst.Bin.new('encoder')
@@ -68,14 +421,30 @@ def get_recording_sink(**kwargs):
         queue.set_property('max-size-time', 10000000000)  # 10 sec
         
         videorate = Gst.ElementFactory.make('videorate')
-        cap_string = 'video/x-raw,framerate={}/1'.format(fps)
-        filter = Gst.ElementFactory.make('capsfilter')
-        caps = Gst.Caps.from_string(cap_string)
+        if variable_framerate:
+            # only limit the rate, never duplicate frames to fill gaps
+            videorate.set_property('drop-only', True)
+            videorate.set_property('max-rate', fps)
 
         enc.add(queue)
         enc.add(videorate)
         queue.link(videorate)
 
+        rate_out = videorate
+        if not variable_framerate:
+            # named so the quality controller can change the rate while recording
+            cap_string = 'video/x-raw,framerate={}/1'.format(fps)
+            caps = Gst.Caps.from_string(cap_string)
+            rate_filter = Gst.ElementFactory.make('capsfilter', 'rate_filter')
+            rate_filter.set_property('caps', caps)
+            enc.add(rate_filter)
+            videorate.link(rate_filter)
+            rate_out = rate_filter
+            if deduplicate:
+                # spare the encoder the copies of a static screen, in damage mode the
+                # DamageGate at the source does that already
+                DuplicateGate(rate_out.get_static_pad('src'), min_refresh=int(min_refresh))
+
         # build encoding pipelines
         src = None
         sink = None
@@ -87,93 +456,26 @@ def get_recording_sink(**kwargs):
             scaler.set_property('scale-method', 2)
             enc.add(scaler)
 
-            video_encoder = Gst.ElementFactory.make('vaapih264enc')
-            video_encoder.set_property('keyframe-period', fps)
+            video_encoder = Gst.ElementFactory.make('vaapih264enc', 'video_encoder')
+            apply_profile(video_encoder, encoder, profile, fps, preset)
             enc.add(video_encoder)
 
             scaler.link(video_encoder)
             src = scaler
             sink = video_encoder
-        elif encoder == 'x264':
+        elif encoder in encoder_formats:
             # scale, convert and encode with software encoders
-            convert = Gst.ElementFactory.make('autovideoconvert')
-            enc.add(convert)
-
-            scaler = Gst.ElementFactory.make('videoscale')
-            enc.add(scaler)
-            cap_string = 'video/x-raw,width={},height={}'.format(
-                scale_width, scale_height
-            )
-            caps = Gst.Caps.from_string(cap_string)
-            filter = Gst.ElementFactory.make('capsfilter')
-            filter.set_property('caps', caps)
-            enc.add(filter)
+            src, filter = make_convert_stage(enc, scale_width, scale_height, encoder_formats[encoder])
 
-            video_encoder = Gst.ElementFactory.make('x264enc')
-            video_encoder.set_property('speed-preset', 'veryfast')
-            #video_encoder.set_property('tune', 4)  # zero latency
+            video_encoder = Gst.ElementFactory.make(encoder_factories[encoder], 'video_encoder')
+            apply_profile(video_encoder, encoder, profile, fps, preset)
+            apply_content(video_encoder, encoder, content)
             enc.add(video_encoder)
-
-            convert.link(scaler)
-            scaler.link(filter)
-            filter.link(video_encoder)
-
-            src = convert
-            sink = video_encoder
-        elif encoding_method == 'openh264':
-            # scale, convert and encode with software encoders
-            convert = Gst.ElementFactory.make('autovideoconvert')
-            enc.add(convert)
-
-            scaler = Gst.ElementFactory.make('videoscale')
-            enc.add(scaler)
-            cap_string = 'video/x-raw,width={},height={}'.format(
-                scale_width, scale_height
-            )
-            caps = Gst.Caps.from_string(cap_string)
-            filter = Gst.ElementFactory.make('capsfilter')
-            filter.set_property('caps', caps)
-            enc.add(filter)
-
-            video_encoder = Gst.ElementFactory.make('openh264enc')
-            video_encoder.set_property('complexity', 0)
-
-            enc.add(video_encoder)
-
-            convert.link(scaler)
-            scaler.link(filter)
-            filter.link(video_encoder)
-
-            src = convert
-            sink = video_encoder
-        elif encoding_method == 'vtenc_h264' or encoding_method == 'vtenc_h264_hw':
-            # scale, convert and encode with software encoders
-
-            convert = Gst.ElementFactory.make('autovideoconvert')
-            enc.add(convert)
-
-            scaler = Gst.ElementFactory.make('videoscale')
-            enc.add(scaler)
-            cap_string = 'video/x-raw,width={},height={}'.format(
-                scale_width, scale_height
-            )
-            caps = Gst.Caps.from_string(cap_string)
-            filter = Gst.ElementFactory.make('capsfilter')
-            filter.set_property('caps', caps)
-            enc.add(filter)
-
-            video_encoder = Gst.ElementFactory.make(encoding_method)
-
-            enc.add(video_encoder)
-
-            convert.link(scaler)
-            scaler.link(filter)
             filter.link(video_encoder)
 
-            src = convert
             sink = video_encoder
 
-        videorate.link(src)
+        rate_out.link(src)
 
         # output part of pipeline
         out_queue = Gst.ElementFactory.make('queue')
@@ -185,7 +487,18 @@ def get_recording_sink(**kwargs):
         out_queue.link(parser)
 
         filesink = None
-        if port:
+        if expose_src:
+            # the caller muxes the encoded stream itself
+            ghost_src = Gst.GhostPad.new('src', parser.get_static_pad('src'))
+            enc.add_pad(ghost_src)
+        elif socket_path:
+            parser.set_property('config-interval', -1)  # muxer may connect at any time, repeat sps and pps
+            shmsink = make_shm_sink(socket_path, shm_video_size)
+            enc.add(shmsink)
+
+            # shmsink takes anything, make the parser deliver what shmsrc declares
+            parser.link_filtered(shmsink, Gst.Caps.from_string(shm_video_caps))
+        elif port:
             rtp_payload = Gst.ElementFactory.make('rtph264pay')
             rtp_payload.set_property('config-interval', -1)  # send sps and pps with every keyframe
             enc.add(rtp_payload)
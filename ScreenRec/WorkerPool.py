@@ -0,0 +1,89 @@
+import importlib
+from collections import deque
+
+# modules a source window needs, imported while the worker is idle
+preload_modules = [
+    'ScreenRec.gui.GtkPlaybackWindow',
+    'ScreenRec.gui.V4L2Window',
+    'ScreenRec.gui.MJPEGPipeWindow',
+    'ScreenRec.gui.RTMPWindow',
+    'ScreenRec.gui.PlayerWindow',
+]
+
+
+def worker(out_queue, in_queue, modules):
+    # runs in the pooled process: pay for gi, Gtk, the GStreamer registry and our own
+    # modules up front, then wait until we are given something to run
+    from setproctitle import setproctitle
+    setproctitle('ScreenRecorder - Idle worker')
+
+    import gi
+    gi.require_version('Gst', '1.0')
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gst, GObject, Gtk
+
+    GObject.threads_init()
+    Gst.init(None)
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except (ImportError, ValueError) as e:
+            # e.g. platform specific windows, they are imported on demand then
+            print('Worker could not preload {}: {}'.format(module, e))
+
+    command = in_queue.get()
+    if 'run' not in command:
+        return
+
+    main = command['run']['main']
+    kwargs = command['run']['kwargs']
+    kwargs['comm_queues'] = (out_queue, in_queue)
+    main(**kwargs)
+
+
+# Pre-initialized processes for source windows. Every worker runs exactly one window
+# and exits with it, a replacement is started as soon as one is taken.
+class WorkerPool:
+
+    def __init__(self, ctx, out_queue, size=2, modules=preload_modules):
+        self.ctx = ctx
+        self.out_queue = out_queue
+        self.size = size
+        self.modules = modules
+        self.idle = deque()
+        self.fill()
+
+    def fill(self):
+        # forget workers that died while idle
+        self.idle = deque(w for w in self.idle if w[0].is_alive())
+        while len(self.idle) < self.size:
+            in_queue = self.ctx.Queue()
+            process = self.ctx.Process(target=worker, args=(self.out_queue, in_queue, self.modules))
+            process.start()
+            self.idle.append((process, in_queue))
+
+    def run(self, main, kwargs):
+        # hand main to an idle worker, returns (process, command queue) or None if the pool is empty
+        result = None
+        while self.idle and not result:
+            process, in_queue = self.idle.popleft()
+            if process.is_alive():
+                in_queue.put({ 'run': { 'main': main, 'kwargs': kwargs } })
+                result = (process, in_queue)
+        self.fill()
+        return result
+
+    def resize(self, size):
+        self.size = size
+        while len(self.idle) > self.size:
+            process, in_queue = self.idle.pop()
+            in_queue.put({ 'quit': True })
+        self.fill()
+
+    def shutdown(self):
+        self.size = 0
+        for process, in_queue in self.idle:
+            in_queue.put({ 'quit': True })
+        for process, in_queue in self.idle:
+            process.join()
+        self.idle.clear()
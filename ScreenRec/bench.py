@@ -0,0 +1,482 @@
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import shutil
+import socket
+import tempfile
+import time
+from datetime import datetime
+
+# gi is GObject instrospection
+import gi
+
+# we need GStreamer 1.0
+gi.require_version('Gst', '1.0')
+
+# Import GStreamer
+from gi.repository import Gst, GObject, GLib
+
+from ScreenRec.VideoEncoder import available_encoders, available_profiles, encoder_factories, make_convert_stage
+from ScreenRec.Transport import shm_socket_path
+
+
+# Headless benchmark of the capture -> encode -> mux pipelines. The real ScreenRecorder,
+# AudioRecorder and RTPMuxer pipelines are built with test sources instead of the
+# screen and sound card and write into a tmpfs directory, one process per pipeline
+# just like a real recording.
+
+x264_presets = [
+    'ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium'
+]
+
+available_convert_stages = [
+    'none',      # source only, subtracted from the others
+    'legacy',    # autovideoconvert on the full frame, then videoscale
+    'single',    # scale first, convert into the encoder format, one thread
+    'threaded'   # the same on all cores, what the recorder uses
+]
+
+available_bench_transports = [
+    'none',  # screen recorder only, muxes itself into a file
+    'udp',
+    'shm'
+]
+
+
+def encoder_available(encoder):
+    factory = encoder_factories.get(encoder, None)
+    return factory is not None and Gst.ElementFactory.find(factory) is not None
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def current_rss():
+    # resident set size in MB, Linux only
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    return None
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_worker(role, kwargs, warmup, duration, results):
+    # runs in its own process, builds one of the recording pipelines and measures it
+    from setproctitle import setproctitle
+    setproctitle('ScreenRecorder - Benchmark {}'.format(role))
+
+    GObject.threads_init()
+    Gst.init(None)
+    mainloop = GLib.MainLoop()
+
+    if role == 'muxer':
+        from ScreenRec.RTPMuxer import RTPMuxer
+        recorder = RTPMuxer(**kwargs)
+    elif role == 'audio_recorder':
+        from ScreenRec.AudioRecorder import AudioRecorder
+        recorder = AudioRecorder(test_source=True, **kwargs)
+    else:
+        from ScreenRec.ScreenRecorder import ScreenRecorder
+        recorder = ScreenRecorder(test_source=True, **kwargs)
+
+    frames = [0]
+    probe = None
+    glass_probe = None
+    video_encoder = recorder.pipeline.get_by_name('video_encoder')
+    if role == 'screen_recorder' and video_encoder:
+        from ScreenRec.Latency import EncoderLatencyProbe, GlassLatencyProbe
+
+        def count_frame(pad, info):
+            frames[0] += 1
+            return Gst.PadProbeReturn.OK
+
+        video_encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_frame)
+        probe = EncoderLatencyProbe(video_encoder, window=100000)
+        # the parser output goes into the muxer, or to the transport towards it
+        for element in recorder.pipeline.iterate_recurse():
+            factory = element.get_factory()
+            if factory and factory.get_name() == 'h264parse':
+                glass_probe = GlassLatencyProbe(recorder.pipeline, element.get_static_pad('src'), window=100000)
+
+    recorder.start(path=kwargs.get('filename', None))
+    results.put({ 'ready': role })
+
+    marks = {}
+
+    def start_measuring():
+        marks['cpu'] = cpu_time()
+        marks['time'] = time.monotonic()
+        marks['frames'] = frames[0]
+        if probe:
+            probe.samples.clear()
+        if glass_probe:
+            glass_probe.samples.clear()
+        return False
+
+    def stop_measuring():
+        mainloop.quit()
+        return False
+
+    GLib.timeout_add(int(warmup * 1000), start_measuring)
+    GLib.timeout_add(int((warmup + duration) * 1000), stop_measuring)
+    mainloop.run()
+
+    elapsed = time.monotonic() - marks['time']
+    result = {
+        'role': role,
+        'ok': recorder.pipeline is not None,
+        'cpu_percent': 100 * (cpu_time() - marks['cpu']) / elapsed,
+        'rss_mb': current_rss(),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+    if role == 'screen_recorder':
+        result['fps'] = (frames[0] - marks['frames']) / elapsed
+        if probe and probe.samples:
+            samples = sorted(probe.samples)
+            result['encode_latency_ms'] = samples[len(samples) // 2]
+            result['encode_latency_p95_ms'] = samples[int(len(samples) * 0.95)]
+        if glass_probe and glass_probe.samples:
+            samples = sorted(glass_probe.samples)
+            result['glass_to_mux_ms'] = samples[len(samples) // 2]
+            result['glass_to_mux_p95_ms'] = samples[int(len(samples) * 0.95)]
+
+    recorder.stop()
+    results.put(result)
+
+
+def run_case(case, warmup, duration, directory):
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    output = os.path.join(directory, 'bench-{}.ts'.format(os.getpid()))
+
+    screen_kwargs = {
+        'width': case['width'],
+        'height': case['height'],
+        'fps': case['fps'],
+        'encoder': case['encoder'],
+        'preset': case['preset'],
+        'profile': case['profile'],
+        'display': 0,
+        'capture_mode': 'constant',
+        'min_refresh': 1000
+    }
+    workers = []
+    if case['transport'] == 'none':
+        workers.append(('screen_recorder', dict(screen_kwargs, filename=output)))
+    else:
+        if case['transport'] == 'shm':
+            audio_target = { 'socket_path': shm_socket_path('bench-audio') }
+            video_target = { 'socket_path': shm_socket_path('bench-video') }
+            mux_sources = {
+                'audio_socket': audio_target['socket_path'],
+                'video_socket': video_target['socket_path']
+            }
+        else:
+            audio_target = { 'port': free_port() }
+            video_target = { 'port': free_port() }
+            mux_sources = {
+                'audio_port': audio_target['port'],
+                'video_port': video_target['port']
+            }
+        workers.append(('muxer', dict(mux_sources, filename=output, transport=case['transport'], audio_delay=0)))
+        workers.append(('screen_recorder', dict(screen_kwargs, **video_target)))
+        workers.append(('audio_recorder', dict(audio_target, device=None)))
+
+    processes = []
+    for role, kwargs in workers:
+        process = ctx.Process(target=run_worker, args=(role, kwargs, warmup, duration, results))
+        process.start()
+        processes.append(process)
+        # the muxer has to listen before the senders start
+        results.get(timeout=60)
+
+    measurements = {}
+    for _ in processes:
+        result = results.get(timeout=warmup + duration + 60)
+        measurements[result['role']] = result
+    for process in processes:
+        process.join()
+
+    result = dict(case)
+    result['processes'] = measurements
+    result['ok'] = all(m['ok'] for m in measurements.values())
+    if os.path.exists(output):
+        result['output_bytes'] = os.path.getsize(output)
+        result['bitrate_kbps'] = result['output_bytes'] * 8 / 1000 / (warmup + duration)
+        os.remove(output)
+    return result
+
+
+def run_convert_case(case, frames):
+    # per frame cost of the colorspace conversion and scaling alone, as fast as it goes
+    source_width, source_height = [int(v) for v in case['source'].split('x')]
+    width, height = [int(v) for v in case['target'].split('x')]
+
+    pipeline = Gst.Pipeline.new('convert')
+    src = Gst.ElementFactory.make('videotestsrc')
+    src.set_property('num-buffers', frames)
+    Gst.util_set_object_arg(src, 'pattern', 'ball')
+    src_filter = Gst.ElementFactory.make('capsfilter')
+    src_filter.set_property('caps', Gst.Caps.from_string(
+        'video/x-raw,format=BGRx,width={},height={},framerate=30/1'.format(source_width, source_height)
+    ))
+    sink = Gst.ElementFactory.make('fakesink')
+    sink.set_property('sync', False)
+    for element in [src, src_filter, sink]:
+        pipeline.add(element)
+    src.link(src_filter)
+
+    if case['stage'] == 'none':
+        src_filter.link(sink)
+    elif case['stage'] == 'legacy':
+        # what the software encoder branches did before
+        convert = Gst.ElementFactory.make('autovideoconvert')
+        scaler = Gst.ElementFactory.make('videoscale')
+        filter = Gst.ElementFactory.make('capsfilter')
+        filter.set_property('caps', Gst.Caps.from_string(
+            'video/x-raw,format=I420,width={},height={}'.format(width, height)
+        ))
+        for element in [convert, scaler, filter]:
+            pipeline.add(element)
+        src_filter.link(convert)
+        convert.link(scaler)
+        scaler.link(filter)
+        filter.link(sink)
+    else:
+        first, last = make_convert_stage(pipeline, width, height, 'I420', threads=1 if case['stage'] == 'single' else 0)
+        src_filter.link(first)
+        last.link(sink)
+
+    bus = pipeline.get_bus()
+    start_cpu = cpu_time()
+    start = time.monotonic()
+    pipeline.set_state(Gst.State.PLAYING)
+    message = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    elapsed = time.monotonic() - start
+    cpu = cpu_time() - start_cpu
+    pipeline.set_state(Gst.State.NULL)
+
+    result = dict(case)
+    result['ok'] = message.type == Gst.MessageType.EOS
+    if not result['ok']:
+        print('ERROR: ', message.parse_error())
+    result['frame_ms'] = elapsed * 1000 / frames
+    result['cpu_frame_ms'] = cpu * 1000 / frames
+    return result
+
+
+def run_convert_bench(pairs, frames):
+    results = []
+    for pair in pairs:
+        source, target = pair.split(':')
+        baseline = None
+        for stage in available_convert_stages:
+            result = run_convert_case({ 'source': source, 'target': target, 'stage': stage }, frames)
+            if stage == 'none':
+                baseline = result
+            else:
+                # without the cost of generating the test frames
+                result['stage_frame_ms'] = result['frame_ms'] - baseline['frame_ms']
+                result['stage_cpu_frame_ms'] = result['cpu_frame_ms'] - baseline['cpu_frame_ms']
+                print('  {} -> {} {}: {:.2f} ms per frame, {:.2f} ms CPU'.format(
+                    source, target, stage, result['stage_frame_ms'], result['stage_cpu_frame_ms']
+                ))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recording pipelines with synthetic input')
+    parser.add_argument(
+        '-r', '--resolutions',
+        type=str,
+        nargs='+',
+        default=['1280x720', '1920x1080'],
+        help='capture resolutions, WIDTHxHEIGHT'
+    )
+    parser.add_argument(
+        '-f', '--fps',
+        type=int,
+        nargs='+',
+        default=[30],
+        help='frame rates'
+    )
+    parser.add_argument(
+        '-e', '--encoders',
+        type=str,
+        nargs='+',
+        default=available_encoders,
+        help='encoders, unavailable ones fall back to x264'
+    )
+    parser.add_argument(
+        '-p', '--presets',
+        type=str,
+        nargs='+',
+        default=None,
+        choices=x264_presets,
+        help='x264 speed presets, override the one of the profile'
+    )
+    parser.add_argument(
+        '-P', '--profiles',
+        type=str,
+        nargs='+',
+        default=[available_profiles[0]],
+        choices=available_profiles,
+        help='encoder profiles'
+    )
+    parser.add_argument(
+        '-t', '--transports',
+        type=str,
+        nargs='+',
+        default=['none', 'udp', 'shm'],
+        choices=available_bench_transports,
+        help='how the recorders deliver to the muxer, none to skip the muxer'
+    )
+    parser.add_argument(
+        '-d', '--duration',
+        type=float,
+        default=10,
+        help='seconds to measure per case'
+    )
+    parser.add_argument(
+        '-w', '--warmup',
+        type=float,
+        default=2,
+        help='seconds to run before measuring'
+    )
+    parser.add_argument(
+        '-l', '--label',
+        type=str,
+        default=None,
+        help='name of this run, e.g. the version under test'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default='bench.json',
+        help='JSON file to write the results to'
+    )
+    parser.add_argument(
+        '-c', '--convert',
+        type=str,
+        nargs='+',
+        default=None,
+        help='only measure the conversion stage per frame, SOURCE:TARGET sizes, e.g. 3840x2160:1920x1080'
+    )
+    parser.add_argument(
+        '--convert-frames',
+        type=int,
+        default=300,
+        help='frames per conversion case'
+    )
+    parser.add_argument(
+        '-s', '--save',
+        action='store_true',
+        help='store the glass-to-mux latency of the cases without transport in the config'
+    )
+    args = parser.parse_args()
+
+    Gst.init(None)
+
+    if args.convert:
+        report = {
+            'label': args.label,
+            'date': datetime.now().isoformat(),
+            'gstreamer': Gst.version_string(),
+            'cpus': os.cpu_count(),
+            'frames': args.convert_frames,
+            'convert': run_convert_bench(args.convert, args.convert_frames)
+        }
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=4)
+        print('Results written to {}'.format(args.output))
+        return
+
+    # software fallback for encoders that need hardware or plugins we do not have
+    encoders = []
+    for encoder in args.encoders:
+        if not encoder_available(encoder):
+            print('Encoder {} not available, using x264'.format(encoder))
+            encoder = 'x264'
+        if encoder not in encoders:
+            encoders.append(encoder)
+
+    cases = []
+    for resolution, fps, encoder, profile, transport in itertools.product(
+            args.resolutions, args.fps, encoders, args.profiles, args.transports):
+        width, height = [int(v) for v in resolution.split('x')]
+        # presets only mean something for x264
+        for preset in (args.presets if encoder == 'x264' and args.presets else [None]):
+            cases.append({
+                'width': width,
+                'height': height,
+                'fps': fps,
+                'encoder': encoder,
+                'profile': profile,
+                'preset': preset,
+                'transport': transport
+            })
+
+    # tmpfs so disk speed does not show up in the numbers
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    directory = tempfile.mkdtemp(prefix='ScreenRecorder-bench-', dir=base)
+
+    results = []
+    try:
+        for case in cases:
+            print('Running {width}x{height}@{fps} {encoder} {profile} {preset} over {transport}'.format(**case))
+            result = run_case(case, args.warmup, args.duration, directory)
+            screen = result['processes'].get('screen_recorder', {})
+            print('  {:.1f} fps, encode latency {} ms, glass to mux {} ms, {:.0f}% CPU'.format(
+                screen.get('fps', 0), screen.get('encode_latency_ms', None),
+                screen.get('glass_to_mux_ms', None), screen.get('cpu_percent', 0)
+            ))
+            results.append(result)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'label': args.label,
+        'date': datetime.now().isoformat(),
+        'gstreamer': Gst.version_string(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'duration': args.duration,
+        'results': results
+    }
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=4)
+    print('Results written to {}'.format(args.output))
+
+    if args.save:
+        from ScreenRec.Calibration import calibration_key
+        from ScreenRec.model.configfile import config
+
+        for result in results:
+            latency = result['processes'].get('screen_recorder', {}).get('glass_to_mux_ms', None)
+            if result['transport'] != 'none' or result['preset'] or latency is None:
+                continue
+            key = calibration_key(result['encoder'], result['width'], result['height'], result['fps'], result['profile'])
+            config.profile_latencies[key] = latency
+        config.save()
+        print('Profile latencies saved to {}'.format(config.path))
+
+
+if __name__ == "__main__":
+    main()
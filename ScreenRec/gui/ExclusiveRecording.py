@@ -8,7 +8,8 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gio, Gdk, Gst
 
 
-from ScreenRec.VideoEncoder import get_recording_sink
+from ScreenRec.VideoEncoder import get_recording_sink, force_keyframe
+from ScreenRec.SourceSelector import make_feed_sink
 from ScreenRec.IPC import IPCWatcher
 
 class Watcher(IPCWatcher):
@@ -16,6 +17,7 @@ class Watcher(IPCWatcher):
     def __init__(self, queues, main):
         super().__init__(queues, main)
         self.tee_pad = None
+        self.attached = None
 
     def run_command(self, command):
         if 'quit' in command and command['quit'] == True:
@@ -27,35 +29,77 @@ class Watcher(IPCWatcher):
             self.main.present()
 
         if 'record' in command:
-            # add encoder to pipeline
-            self.main.pipeline.add(self.main.encoder)
-
-            # get a tee pad and hook it up
-            self.tee_pad = self.main.tee.get_request_pad('src_%u')
-            Gst.Element.link_pads(self.main.tee, self.tee_pad.get_name(), self.main.encoder, 'sink')
-
-            # run encoder
-            self.main.encoder.set_state(Gst.State.PLAYING)
+            target = command['record']
+            current = getattr(self.main, 'target', None)
+            if current is None and self.main.port:
+                # prebuilt for the port the window was started with
+                current = { 'port': self.main.port }
+            if self.main.encoder is None or target != current:
+                # the channel is leased per recording, rebuild the encoder for it
+                self.main.encoder, _ = get_recording_sink(content='camera', **target)
+                self.main.port = target.get('port', None)
+            self.main.target = target
+
+            self.attach(self.main.encoder)
+        if 'keyframe' in command and self.attached:
+            force_keyframe(self.main.pipeline)
+        if 'feed' in command:
+            # send raw frames to the running screen recorder, it encodes them
+            socket_path = command['feed']['socket_path']
+            feed, sink = make_feed_sink(socket_path)
+
+            def on_caps(pad, info):
+                event = info.get_event()
+                if event.type == Gst.EventType.CAPS:
+                    # the screen recorder needs the caps to read from shared memory
+                    self.outQueue.put({
+                        'feeding': {
+                            'id': self.main.id,
+                            'socket_path': socket_path,
+                            'caps': event.parse_caps().to_string()
+                        }
+                    })
+                    return Gst.PadProbeReturn.REMOVE
+                return Gst.PadProbeReturn.OK
+
+            sink.get_static_pad('sink').add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, on_caps)
+            self.attach(feed)
         if 'stop' in command:
             if self.main.excl_button.get_active():
                 self.main.excl_button.disconnect(self.main.excl_button_signal)
-                context = button.get_style_context()
+                context = self.main.excl_button.get_style_context()
                 self.main.excl_button.set_active(False)
                 context.remove_class('destructive-action')
-                self.main.excl_button_signal = self.main.excl_button.connect('toggled', on_excl, self)
+                self.main.excl_button_signal = self.main.excl_button.connect('toggled', on_excl, self.main)
+
+            if not self.attached:
+                return
 
             # unlink encoder from tee and destroy pad
-            Gst.Element.unlink_pads(self.main.tee, self.tee_pad.get_name(), self.main.encoder, 'sink')
+            Gst.Element.unlink_pads(self.main.tee, self.tee_pad.get_name(), self.attached, 'sink')
             self.main.tee.release_request_pad(self.tee_pad)
             self.tee_pad = None
             
             # send end of stream to encoder
             eos = Gst.Event.new_eos()
-            self.main.encoder.send_event(eos)
-            self.main.encoder.set_state(Gst.State.NULL)
+            self.attached.send_event(eos)
+            self.attached.set_state(Gst.State.NULL)
 
             # remove from pipeline again
-            self.main.pipeline.remove(self.main.encoder)
+            self.main.pipeline.remove(self.attached)
+            self.attached = None
+
+    def attach(self, element):
+        # add encoder or feed to pipeline
+        self.main.pipeline.add(element)
+
+        # get a tee pad and hook it up
+        self.tee_pad = self.main.tee.get_request_pad('src_%u')
+        Gst.Element.link_pads(self.main.tee, self.tee_pad.get_name(), element, 'sink')
+
+        # run it
+        element.set_state(Gst.State.PLAYING)
+        self.attached = element
 
 def on_excl(button, self):
     context = button.get_style_context()
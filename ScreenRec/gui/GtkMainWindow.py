@@ -1,7 +1,5 @@
 import platform
-import threading
-from datetime import datetime
-from time import sleep
+from time import time
 import gi
 
 # we need GStreamer 1.0 and Gtk 3.0
@@ -11,127 +9,27 @@ gi.require_version('Gst', '1.0')
 gi.require_version('Gtk', '3.0')
 
 # import everything we need for a Gtk Window
-from gi.repository import Gtk, Gio, Gdk
-
-import multiprocessing as mp
-
-from .V4L2Window import main as v4l2_main
-from .OSXCamWindow import main as osxcam_main
-from .MJPEGPipeWindow import main as mjpeg_main
-from .RTMPWindow import main as rtmp_main
-from .PlayerWindow import main as player_main
-from ScreenRec.ScreenRecorder import main as screenrecord_main, ScreenRecorder
-from ScreenRec.AudioRecorder import main as audiorecord_main
-from ScreenRec.RTPMuxer import main as mux_main
-from ScreenRec.model.configfile import config
-
-entrypoints = {
-    'v4l2': v4l2_main,
-    'mjpeg': mjpeg_main,
-    'rtmp': rtmp_main,
-    'avf': osxcam_main,
-    # 'ks': ks_main,
-    'player': player_main
-}
-
-class QueueManager(threading.Thread):
+from gi.repository import Gtk, Gio, Gdk, GLib
 
-    def __init__(self):
-        self.ctx = mp.get_context('spawn')
-        self.queue = self.ctx.Queue()
-        self.outQueues = {}
-        self.processes = {}
-        self.process_info = {}
-        self.exclusive = None
-        super().__init__()
-        
-    def run(self):
-        quit = False
-        while not quit:
-            command = self.queue.get()
-
-            if 'quit' in command:
-                print('MainWindow: IPC quitting')
-                quit = True
-            if 'terminate' in command:
-                if command['terminate'] in self.process_info:
-                    print('MainWindow: IPC terminating {}'.format(
-                        self.process_info[command['terminate']]['main']
-                    ))
-                self.terminate(command['terminate'])
-            if 'execute' in command:
-                print('MainWindow: IPC executing {}'.format(
-                    command['execute']['main']
-                ))
-                self.execute(**command['execute'])
-            if 'exclusive' in command:
-                if self.exclusive == None:
-                    print('MainWindow: IPC {} going into exclusive mode, terminating screen recorder'.format(
-                        command['exclusive']
-                    ))
-                    self.terminate('screen_recorder', forget_everything=False)
-                    sleep(0.25)
-                else:
-                    print('MainWindow: IPC {} going into exclusive mode, stopping exclusive mode on {}'.format(
-                        command['exclusive'], self.exclusive
-                    ))
-                    self.outQueues[self.exclusive].put({ 'stop': True })
-                    sleep(0.25)
-                self.outQueues[command['exclusive']].put({ 'record': 7655 })
-                self.exclusive = command['exclusive']
-            if 'cooperative' in command:
-                rec = self.process_info.get('screen_recorder', None)
-                if rec:
-                    print('MainWindow: IPC {} resigned exclusive mode, resuming screen recorder'.format(
-                        command['cooperative']
-                    ))
-                    self.outQueues[command['cooperative']].put({ 'stop': True })
-                    sleep(0.25)
-                    self.execute('screen_recorder', main=rec['main'], kwargs=rec['kwargs'])
-                    self.exclusive = None
-
-        # terminate all other processes
-        for id, process in self.processes.items():
-            if process.is_alive():
-                print('Sending quit to {}'.format(id))
-                self.outQueues[id].put({ 'quit': True })
-                process.join()
-        for id, process in self.processes.items():
-            if process.is_alive():
-                print('Force terminating {}'.format(id))
-                process.terminate()
-
-    def execute(self, id=None, main=None, kwargs={}):
-        if id and main:
-            if id in self.processes and self.processes[id].is_alive():
-                self.outQueues[id].put({ 'raise': True })
-                return
-            self.outQueues[id] = self.ctx.Queue()
-            kwargs['comm_queues'] = (self.queue, self.outQueues[id])
-            self.processes[id] = self.ctx.Process(target=main, kwargs=kwargs)
-            self.processes[id].start()
-            self.process_info[id] = { 'main': main, 'kwargs': kwargs }
-
-    def terminate(self, id, forget_everything=True):
-        if id in self.processes and self.processes[id].is_alive():
-            print('Sending quit to {}'.format(id))
-            self.outQueues[id].put({ 'quit': True })
-            self.processes[id].join()
-            # self.processes[id].terminate()
-        if forget_everything and id in self.process_info:
-            del self.process_info[id]
-        if id in self.processes:
-            del self.processes[id]
+from ScreenRec.model.configfile import config
+from ScreenRec.Supervisor import QueueManager, RecordingSession
 
 
 # Control window
 class ControlWindow(Gtk.Window):
+    HEALTH_COLORS = {
+        'ok': '#4e9a06',
+        'struggling': '#c4a000',
+        'overloaded': '#cc0000'
+    }
+
     def __init__(self):
-        self.comm = QueueManager()
+        self.comm = QueueManager(pool_size=int(config.rec_settings.worker_pool))
+        self.comm.on_stats = self.on_stats
         self.comm.start()
+        self.session = RecordingSession(self.comm)
         print('Running main window')
 
-        self.recording = False
         self.streaming = False
 
         self.config_window = None
@@ -153,6 +51,37 @@ class ControlWindow(Gtk.Window):
         self.record_button.connect("clicked", self.on_record)
         self.header.pack_end(self.record_button)
 
+        # add save replay button, only visible while recording into the replay buffer
+        self.replay_button = Gtk.Button()
+        icon = Gio.ThemedIcon(name="document-save")
+        image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
+        self.replay_button.set_image(image)
+        self.replay_button.set_no_show_all(True)
+        self.replay_button.connect("clicked", self.on_save_replay)
+        self.header.pack_end(self.replay_button)
+
+        # add pause button, only visible while recording
+        self.pause_button = Gtk.Button()
+        icon = Gio.ThemedIcon(name="media-playback-pause")
+        image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
+        self.pause_button.set_image(image)
+        self.pause_button.set_no_show_all(True)
+        self.pause_button.connect("clicked", self.on_pause)
+        self.header.pack_end(self.pause_button)
+
+        # Ctrl+S saves the replay buffer, Ctrl+P pauses
+        accelerators = Gtk.AccelGroup()
+        key, modifier = Gtk.accelerator_parse('<Control>s')
+        self.replay_button.add_accelerator('clicked', accelerators, key, modifier, Gtk.AccelFlags.VISIBLE)
+        key, modifier = Gtk.accelerator_parse('<Control>p')
+        self.pause_button.add_accelerator('clicked', accelerators, key, modifier, Gtk.AccelFlags.VISIBLE)
+        self.add_accel_group(accelerators)
+
+        # health indicator, fed by the pipeline telemetry while recording
+        self.health_label = Gtk.Label()
+        self.health_label.set_no_show_all(True)
+        self.header.pack_start(self.health_label)
+
         # add stream button
         # self.stream_button = Gtk.Button()
         # icon = Gio.ThemedIcon(name="internet-radio-new")
@@ -174,6 +103,8 @@ class ControlWindow(Gtk.Window):
         self.add(self.box)
 
         self.fill_source_buttons()
+        self.session.calibrate()
+        self.session.arm()
 
         # no border
         self.set_border_width(0)
@@ -203,88 +134,62 @@ class ControlWindow(Gtk.Window):
         self.box.show_all()
 
     def on_source_button(self, sender, button):
-        main = entrypoints.get(button.button_type, None)
-        data = button.serialize()
-        del data['button_type']
-        if main:
-            self.comm.queue.put({
-                'execute': {
-                    'id': data['id'],
-                    'main': main,
-                    'kwargs': data
-                }
-            })
+        self.session.open_source(button)
 
     def on_record(self, sender):
-        if self.recording:
-            # stop recording
-            self.comm.queue.put({ 'terminate': 'audio_recorder'})
-            self.comm.queue.put({ 'terminate': 'screen_recorder'})
-            self.comm.queue.put({ 'terminate': 'muxer'})
-
-            self.recording = False
+        clicked = time()
+        if self.session.recording:
+            self.session.stop()
+            self.replay_button.hide()
+            self.health_label.hide()
+            self.set_paused(False)
+            self.pause_button.hide()
             # self.stream_button.set_sensitive(True)
             icon = Gio.ThemedIcon(name="media-record")
             image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
             self.record_button.set_image(image)
         else:
-            # start recording
-            self.comm.queue.put({ 'terminate': 'audio_recorder'})
-            self.comm.queue.put({ 'terminate': 'screen_recorder'})
-            self.comm.queue.put({ 'terminate': 'muxer'})
-
-            val = config.rec_settings
-
-            output_path = datetime.now().strftime(val.filename)
-
-            self.comm.queue.put({
-                'execute': {
-                    'id': 'muxer',
-                    'main': mux_main,
-                    'kwargs': {
-                        'filename': output_path,
-                        'audio_port': 7654,
-                        'video_port': 7655,
-                        'audio_codec': config.audio_settings.encoder,
-                        'audio_delay': ScreenRecorder.ENCODER_DELAY[val.encoder],
-                        'audio_bitrate': config.audio_settings.bitrate
-                    }
-                }
-            })
-
-            self.comm.queue.put({
-                'execute': {
-                    'id': 'screen_recorder',
-                    'main': screenrecord_main,
-                    'kwargs': {
-                        'display': val.screen,
-                        'encoder': val.encoder,
-                        'port': 7655,
-                        'width': val.width,
-                        'height': val.height,
-                        'scale_width': None if int(val.scale_width) == 0 else int(val.scale_width),
-                        'scale_height': None if int(val.scale_height) == 0 else int(val.scale_height)
-                    }
-                }
-            })
-
-            self.comm.queue.put({
-                'execute': {
-                    'id': 'audio_recorder',
-                    'main': audiorecord_main,
-                    'kwargs': {
-                        'device': config.audio_settings.device,
-                        'port': 7654
-                    }
-                }
-            })
-
-            self.recording = True
+            self.session.start(clicked=clicked)
+            if self.session.output_mode == 'replay':
+                self.replay_button.show()
+            self.pause_button.show()
             # self.stream_button.set_sensitive(False)
             icon = Gio.ThemedIcon(name="media-playback-stop")
             image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
             self.record_button.set_image(image)
 
+    def on_save_replay(self, sender):
+        if not self.replay_button.get_visible():
+            # not recording into a replay buffer
+            return
+        self.session.save_replay()
+
+    def on_pause(self, sender):
+        if self.session.pause(not self.session.paused):
+            self.set_paused(self.session.paused)
+
+    def set_paused(self, paused):
+        icon = Gio.ThemedIcon(name="media-playback-start" if paused else "media-playback-pause")
+        image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
+        self.pause_button.set_image(image)
+
+    def on_stats(self, stats):
+        # called on the queue manager thread
+        GLib.idle_add(self.update_health)
+
+    def update_health(self):
+        if not self.session.recording:
+            self.health_label.hide()
+            return False
+
+        health, details = self.session.health()
+        self.health_label.set_markup('<span foreground="{}">\u25cf</span> {}'.format(
+            ControlWindow.HEALTH_COLORS[health], health
+        ))
+        self.health_label.set_tooltip_text('\n'.join(details))
+        self.health_label.show()
+        return False
+
     def on_stream(self, sender):
         if self.streaming:
             # TODO: stop streaming
@@ -309,7 +214,10 @@ class ControlWindow(Gtk.Window):
             self.config_window.show_all()
 
     def on_settings_quit(self):
+        self.comm.queue.put({ 'pool_size': int(config.rec_settings.worker_pool) })
         self.fill_source_buttons()
+        self.session.calibrate()
+        self.session.arm()
         self.config_window = None
 
     def quit(self, sender, gparam):
@@ -143,6 +143,10 @@ class PlaybackWindow(Gtk.Window):
         # connect sync message to reparent output window
         self.bus.connect("sync-message::element", self.on_sync_message)
 
+        if self.comm is not None:
+            # the supervisor waits for our state changes
+            self.comm.watch_pipeline(self.bus, self.pipeline)
+
         if self.auto_start:
             self.switch.set_active(True)
 
@@ -38,7 +38,7 @@ class MJPEGPipeWindow(PlaybackWindow):
         self.zoomed = False
         self.width = width
         self.height = height
-        self.port = 7655  # FIXME: dynamic
+        self.port = kwargs.get('port', None)  # leased by the supervisor
 
         if 'comm_queues' in kwargs:
             self.comm = Watcher(kwargs['comm_queues'], self)
@@ -108,8 +108,11 @@ class MJPEGPipeWindow(PlaybackWindow):
         parse.link(decoder)
         self.scalerObject.link(sink)
 
-        # connect encoder but do not start
-        self.encoder, _ = get_recording_sink(port=self.port)
+        # connect encoder but do not start, without a port it is built when the
+        # record command tells where the recording goes
+        self.encoder = None
+        if self.port:
+            self.encoder, _ = get_recording_sink(port=self.port, content='camera')
 
     def on_play(self, switch, gparam):
         if switch.get_active():
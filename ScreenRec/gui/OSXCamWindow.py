@@ -32,7 +32,7 @@ class OSXCamWindow(PlaybackWindow):
         self.width = width
         self.height = height
         self.framerate = framerate
-        self.port = 7655  # FIXME: dynamic
+        self.port = kwargs.get('port', None)  # leased by the supervisor
 
         if 'comm_queues' in kwargs:
             self.comm = Watcher(kwargs['comm_queues'], self)
@@ -98,8 +98,11 @@ class OSXCamWindow(PlaybackWindow):
         self.pipeline.add(self.sink)
         self.scaler.link(self.sink)
 
-        # connect encoder but do not start
-        self.encoder, _ = get_recording_sink(port=self.port)
+        # connect encoder but do not start, without a port it is built when the
+        # record command tells where the recording goes
+        self.encoder = None
+        if self.port:
+            self.encoder, _ = get_recording_sink(port=self.port, content='camera')
 
     def on_zoom(self, src):
         width = int(self.width / 2)
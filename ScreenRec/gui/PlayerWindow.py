@@ -43,7 +43,7 @@ class PlayerWindow(PlaybackWindow):
         self.restart_on_deactivate = restart_on_deactivate
         self.auto_play = auto_play
         self.seek_bar = seek_bar
-        self.port = 7655  # FIXME: dynamic
+        self.port = kwargs.get('port', None)  # leased by the supervisor
 
         if 'comm_queues' in kwargs:
             self.comm = Watcher(kwargs['comm_queues'], self)
@@ -86,8 +86,11 @@ class PlayerWindow(PlaybackWindow):
         self.pipeline.add(sink)
         self.tee.link(sink)
 
-        # connect encoder but do not start
-        self.encoder, _ = get_recording_sink(port=self.port)
+        # connect encoder but do not start, without a port it is built when the
+        # record command tells where the recording goes
+        self.encoder = None
+        if self.port:
+            self.encoder, _ = get_recording_sink(port=self.port, content='camera')
 
     def on_message(self, bus, message):
         super().on_message(bus, message)
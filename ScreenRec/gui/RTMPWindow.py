@@ -37,7 +37,7 @@ class RTMPWindow(PlaybackWindow):
         self.id = id
         self.max_width = max_width
         self.max_height = max_height
-        self.port = 7655  # FIXME: dynamic
+        self.port = kwargs.get('port', None)  # leased by the supervisor
 
         if 'comm_queues' in kwargs:
             self.comm = Watcher(kwargs['comm_queues'], self)
@@ -77,8 +77,11 @@ class RTMPWindow(PlaybackWindow):
 
         # rest happens in pad_added
         
-        # connect encoder but do not start
-        self.encoder, _ = get_recording_sink(port=self.port)
+        # connect encoder but do not start, without a port it is built when the
+        # record command tells where the recording goes
+        self.encoder = None
+        if self.port:
+            self.encoder, _ = get_recording_sink(port=self.port, content='camera')
 
     def pad_added(self, src, pad):
         if src == self.src and pad.get_name() == 'src_0':
@@ -39,7 +39,7 @@ class V4L2Window(PlaybackWindow):
         self.height = height
         self.framerate = framerate
         self.device = device
-        self.port = 7655  # FIXME: dynamic
+        self.port = kwargs.get('port', None)  # leased by the supervisor
 
         if 'comm_queues' in kwargs:
             self.comm = Watcher(kwargs['comm_queues'], self)
@@ -164,8 +164,11 @@ class V4L2Window(PlaybackWindow):
         self.tee.link(scaler)
         scaler.link(sink)
 
-        # connect encoder but do not start
-        self.encoder, _ = get_recording_sink(port=self.port)
+        # connect encoder but do not start, without a port it is built when the
+        # record command tells where the recording goes
+        self.encoder = None
+        if self.port:
+            self.encoder, _ = get_recording_sink(port=self.port, content='camera')
 
     def on_zoom(self, src):
         width = int(self.width / 2)
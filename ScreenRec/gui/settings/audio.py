@@ -11,17 +11,19 @@ from gi.repository import Gtk, Gio, Gdk
 
 from .tools import make_settings_page
 from ScreenRec.AudioRecorder import AudioRecorder
+from ScreenRec.AudioEncoder import audio_devices
 
 
 def build_stack_page(config, size_groups):
     container = Gtk.Grid()
     container.set_column_homogeneous(False)
+    devices, default_device = audio_devices()
 
     make_settings_page(
         container,
         config,
         OrderedDict([
-            ('device', [AudioRecorder.DEVICES, config.device]),
+            ('device', [devices, config.device if config.device else default_device]),
             ('encoder', (AudioRecorder.ENCODERS, config.encoder)),
 #            ('samplerate', (['8000', '11025', '22050', '44100', '48000', '96000'], str(config.samplerate))),
 #            ('channels', ('int', (config.channels, 1, 6))),
@@ -10,6 +10,13 @@ from gi.repository import Gtk, Gio, Gdk
 
 from .tools import make_settings_page
 from ScreenRec.ScreenRecorder import ScreenRecorder
+from ScreenRec.Transport import available_transports
+from ScreenRec.MonolithicRecorder import available_engines
+from ScreenRec.FrameGate import available_capture_modes
+from ScreenRec.RTPMuxer import available_output_modes
+from ScreenRec.SourceSelector import available_switching_modes
+from ScreenRec.VideoEncoder import available_profiles
+from ScreenRec.ContentClassifier import available_content_modes
 
 
 def build_stack_page(config, size_groups):
@@ -28,8 +35,25 @@ def build_stack_page(config, size_groups):
             ('width', ('int', (config.width, 0, screen_width))),
             ('height', ('int', (config.height, 0, screen_height))),
             ('fps', ('int', (config.fps, 0, 120))),
+            ('profile', (available_profiles, config.profile)),
             ('scale_width', ('int', (config.scale_width, 0, screen_width))),
-            ('scale_height', ('int', (config.scale_height, 0, screen_height)))
+            ('scale_height', ('int', (config.scale_height, 0, screen_height))),
+            ('transport', (available_transports, config.transport)),
+            ('engine', (available_engines, config.engine)),
+            ('capture_mode', (available_capture_modes, config.capture_mode)),
+            ('min_refresh', ('int', (config.min_refresh, 100, 10000))),
+            ('deduplicate', ('bool', config.deduplicate)),
+            ('content_mode', (available_content_modes, config.content_mode)),
+            ('output_mode', (available_output_modes, config.output_mode)),
+            ('replay_budget', ('int', (config.replay_budget, 16, 16384))),
+            ('replay_seconds', ('int', (config.replay_seconds, 5, 3600))),
+            ('segment_duration', ('int', (config.segment_duration, 0, 86400))),
+            ('segment_size', ('int', (config.segment_size, 0, 65536))),
+            ('segment_retention', ('int', (config.segment_retention, 0, 10000))),
+            ('source_switching', (available_switching_modes, config.source_switching)),
+            ('pre_arm', ('bool', config.pre_arm)),
+            ('adaptive_quality', ('bool', config.adaptive_quality)),
+            ('worker_pool', ('int', (config.worker_pool, 0, 16)))
         ]),
         size_groups=size_groups
     )
@@ -1,12 +1,12 @@
 import platform
 
-from ScreenRec.AudioRecorder import AudioRecorder, default_audio_device
+from ScreenRec.AudioRecorder import AudioRecorder
 from .config import Config
 
 class AudioConfig(Config):
 
     def __init__(self):
-        self.device = default_audio_device
+        self.device = None  # the default source of the sound server
         self.encoder = AudioRecorder.ENCODERS[0]
         self.samplerate = 44100
         self.channels = 2
@@ -22,7 +22,7 @@ class AudioConfig(Config):
         }
 
     def deserialize(self, data):
-        self.device = data.get('device', default_audio_device)
+        self.device = data.get('device', None)
         self.encoder = data['encoder'] \
             if 'encoder' in data \
                and data['encoder'] in AudioRecorder.ENCODERS \
@@ -1,3 +1,19 @@
+import sys
+
+
+def screen_size(default=(1920, 1080)):
+    # size of the default screen, falls back to full HD when there is no display.
+    # Only processes that run Gtk anyway ask the display, recorder processes get the
+    # geometry from their parent and must not load Gtk just for this.
+    if 'gi.repository.Gdk' not in sys.modules:
+        return default
+    from gi.repository import Gdk
+    screen = Gdk.Screen.get_default()
+    if screen is None:
+        return default
+    return screen.get_width(), screen.get_height()
+
+
 class Config():
     def serialize(self):
         pass
@@ -6,6 +6,8 @@ from .button import ButtonConfig
 from .recorder import RecorderConfig
 from .stream import StreamConfig
 from .audio import AudioConfig
+from ScreenRec.Calibration import calibration_key
+from ScreenRec.VideoEncoder import available_profiles, encoder_delay
 
 
 class ConfigFile:
@@ -16,6 +18,8 @@ class ConfigFile:
         self.rec_settings = None
         self.stream_settings = None
         self.audio_settings = None
+        self.encoder_delays = {}
+        self.profile_latencies = {}
         self.load()
 
     def save(self):
@@ -25,7 +29,9 @@ class ConfigFile:
             'buttons': [button.serialize() for button in self.buttons],
             'rec_settings': self.rec_settings.serialize(),
             'stream_settings': self.stream_settings.serialize(),
-            'audio_settings': self.audio_settings.serialize()
+            'audio_settings': self.audio_settings.serialize(),
+            'encoder_delays': self.encoder_delays,
+            'profile_latencies': self.profile_latencies
         }
         json.dump(conf, open(self.path, 'w'), indent=4)
 
@@ -43,6 +49,10 @@ class ConfigFile:
                     self.stream_settings.deserialize(value)
                 if key == 'audio_settings':
                     self.audio_settings.deserialize(value)
+                if key == 'encoder_delays':
+                    self.encoder_delays = dict(value)
+                if key == 'profile_latencies':
+                    self.profile_latencies = dict(value)
         except IOError:
             pass
 
@@ -51,6 +61,25 @@ class ConfigFile:
         self.rec_settings = RecorderConfig()
         self.stream_settings = StreamConfig()
         self.audio_settings = AudioConfig()
+        self.encoder_delays = {}
+        self.profile_latencies = {}
+
+    def is_calibrated(self, encoder, width, height, fps, profile=None):
+        return calibration_key(encoder, width, height, fps, profile) in self.encoder_delays
+
+    def encoder_delay(self, encoder, width, height, fps, profile=None):
+        # measured on this host if available, else the static default
+        key = calibration_key(encoder, width, height, fps, profile)
+        if key in self.encoder_delays:
+            return self.encoder_delays[key]
+        return encoder_delay.get(encoder, 0)
+
+    def profile_latency(self, encoder, width, height, fps, profile=None):
+        # glass-to-mux latency, None until bench.py --profiles --save ran on this host
+        if not profile:
+            profile = available_profiles[0]
+        key = calibration_key(encoder, width, height, fps, profile)
+        return self.profile_latencies.get(key, None)
 
     def button(self, button_id):
         for button in self.buttons:
@@ -1,11 +1,13 @@
 import platform
 
-# we need Gtk 3.0
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gdk
-
-from .config import Config
+from ScreenRec.Transport import available_transports
+from ScreenRec.MonolithicRecorder import available_engines
+from ScreenRec.FrameGate import available_capture_modes
+from ScreenRec.RTPMuxer import available_output_modes
+from ScreenRec.SourceSelector import available_switching_modes
+from ScreenRec.VideoEncoder import available_profiles
+from ScreenRec.ContentClassifier import available_content_modes
+from .config import Config, screen_size
 
 
 class RecorderConfig(Config):
@@ -20,12 +22,28 @@ class RecorderConfig(Config):
         else:
             self.filename = '~/Capture/cap-%Y-%m-%d_%H-%M-%S.ts'
 
-        self.width = Gdk.Screen.get_default().get_width()
-        self.height = Gdk.Screen.get_default().get_height()
+        self.width, self.height = screen_size()
 
         self.scale_width = 0
         self.scale_height = 0
         self.fps = 30
+        self.profile = available_profiles[0]
+        self.transport = 'udp'
+        self.engine = available_engines[0]
+        self.capture_mode = available_capture_modes[0]
+        self.min_refresh = 1000
+        self.deduplicate = True
+        self.content_mode = available_content_modes[0]
+        self.output_mode = available_output_modes[0]
+        self.replay_budget = 512
+        self.replay_seconds = 120
+        self.segment_duration = 600
+        self.segment_size = 0
+        self.segment_retention = 0
+        self.source_switching = available_switching_modes[0]
+        self.pre_arm = True
+        self.adaptive_quality = False
+        self.worker_pool = 2  # warm processes for source windows
 
     def serialize(self):
         return {
@@ -35,8 +53,25 @@ class RecorderConfig(Config):
             'width': self.width,
             'height': self.height,
             'fps': self.fps,
+            'profile': self.profile,
             'scale_width': self.scale_width,
-            'scale_height': self.scale_height
+            'scale_height': self.scale_height,
+            'transport': self.transport,
+            'engine': self.engine,
+            'capture_mode': self.capture_mode,
+            'min_refresh': self.min_refresh,
+            'deduplicate': self.deduplicate,
+            'content_mode': self.content_mode,
+            'output_mode': self.output_mode,
+            'replay_budget': self.replay_budget,
+            'replay_seconds': self.replay_seconds,
+            'segment_duration': self.segment_duration,
+            'segment_size': self.segment_size,
+            'segment_retention': self.segment_retention,
+            'source_switching': self.source_switching,
+            'pre_arm': self.pre_arm,
+            'adaptive_quality': self.adaptive_quality,
+            'worker_pool': self.worker_pool
         }
 
     def deserialize(self, data):
@@ -54,12 +89,50 @@ class RecorderConfig(Config):
             self.filename = '~/Capture/cap-%Y-%m-%d_%H-%M-%S.ts'
         self.filename = data.get('filename', self.filename)
 
-        self.width = Gdk.Screen.get_default().get_width()
+        self.width, self.height = screen_size()
         self.width = int(data.get('width', self.width))
-        self.height = Gdk.Screen.get_default().get_height()
         self.height = int(data.get('height', self.height))
 
         self.fps = int(data.get('fps', self.fps))
+        self.profile = data['profile'] \
+            if 'profile' in data \
+               and data['profile'] in available_profiles \
+            else available_profiles[0]
 
         self.scale_width = int(data.get('scale_width', 0))
         self.scale_height = int(data.get('scale_height', 0))
+
+        self.transport = data['transport'] \
+            if 'transport' in data \
+               and data['transport'] in available_transports \
+            else 'udp'
+        self.engine = data['engine'] \
+            if 'engine' in data \
+               and data['engine'] in available_engines \
+            else available_engines[0]
+        self.capture_mode = data['capture_mode'] \
+            if 'capture_mode' in data \
+               and data['capture_mode'] in available_capture_modes \
+            else available_capture_modes[0]
+        self.min_refresh = int(data.get('min_refresh', 1000))
+        self.deduplicate = bool(data.get('deduplicate', True))
+        self.content_mode = data['content_mode'] \
+            if 'content_mode' in data \
+               and data['content_mode'] in available_content_modes \
+            else available_content_modes[0]
+        self.output_mode = data['output_mode'] \
+            if 'output_mode' in data \
+               and data['output_mode'] in available_output_modes \
+            else available_output_modes[0]
+        self.replay_budget = int(data.get('replay_budget', 512))
+        self.replay_seconds = int(data.get('replay_seconds', 120))
+        self.segment_duration = int(data.get('segment_duration', 600))
+        self.segment_size = int(data.get('segment_size', 0))
+        self.segment_retention = int(data.get('segment_retention', 0))
+        self.source_switching = data['source_switching'] \
+            if 'source_switching' in data \
+               and data['source_switching'] in available_switching_modes \
+            else available_switching_modes[0]
+        self.pre_arm = bool(data.get('pre_arm', True))
+        self.adaptive_quality = bool(data.get('adaptive_quality', False))
+        self.worker_pool = int(data.get('worker_pool', 2))
@@ -1,11 +1,4 @@
-from .config import Config
-
-# we need Gtk 3.0
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gdk
-
-from .config import Config
+from .config import Config, screen_size
 
 
 class StreamConfig(Config):
@@ -18,8 +11,7 @@ class StreamConfig(Config):
 
         self.bitrate = 2000
 
-        self.width = Gdk.Screen.get_default().get_width()
-        self.height = Gdk.Screen.get_default().get_height()
+        self.width, self.height = screen_size()
 
         self.scale_width = 0
         self.scale_height = 0
@@ -49,9 +41,8 @@ class StreamConfig(Config):
         self.url = 'rtmp://127.0.0.1:1935/live/stream'
         self.url = data.get('url', self.url)
 
-        self.width = Gdk.Screen.get_default().get_width()
+        self.width, self.height = screen_size()
         self.width = int(data.get('width', self.width))
-        self.height = Gdk.Screen.get_default().get_height()
         self.height = int(data.get('height', self.height))
 
         self.scale_width = int(data.get('scale_width', 0))
@@ -1,17 +1,5 @@
 import signal
 
-# gi is GObject instrospection
-import gi
-
-# we need GStreamer 1.0 and Gtk 3.0
-gi.require_version('Gst', '1.0')
-gi.require_version('Gtk', '3.0')
-
-# import everything we need for a Gtk Window
-from gi.repository import Gtk, GObject, GLib
-
-from ScreenRec.gui.GtkMainWindow import ControlWindow
-
 # Signal handler to allow HUP, INT and TERM signal handling
 def InitSignal(gui):
     def signal_action(signal):
@@ -50,6 +38,19 @@ def InitSignal(gui):
 
 
 if __name__ == "__main__":
+    # recorder processes are spawned and import this module again as __mp_main__,
+    # keep Gtk out of them, it opens a display connection on import
+    import gi
+
+    # we need GStreamer 1.0 and Gtk 3.0
+    gi.require_version('Gst', '1.0')
+    gi.require_version('Gtk', '3.0')
+
+    # import everything we need for a Gtk Window
+    from gi.repository import Gtk, GObject, GLib
+
+    from ScreenRec.gui.GtkMainWindow import ControlWindow
+
     from setproctitle import setproctitle
     setproctitle('ScreenRecorder - Main Window')
 